@@ -0,0 +1,742 @@
+"""
+app.py - Backend HTTP de AirBytes (Flask).
+
+Sirve el frontend (code/scripts/html/AirBytes) y una API JSON:
+
+    GET /api/cities
+    GET /api/current/<ciudad>        (o /api/current?lat=..&lon=.., se ajusta a ciudad o celda)
+    GET /api/history/<ciudad>?parameter=pm25&hours=48&step=1h
+    GET /api/forecast/<ciudad>?targets=pm25,no2   (modelo + `daily` de OpenWeather)
+    GET /api/events?cities=bogota,cali   (Server-Sent Events)
+    GET /api/stats
+
+- Las respuestas salen de una caché TTL compartida por todos los clientes
+  (SharedCache). Cada clave se calcula una sola vez por intervalo: si llegan
+  cien pedidos de la misma ciudad mientras se consulta OpenWeather, esperan
+  esa misma llamada (single-flight) en vez de hacer cien.
+- El JSON se serializa y comprime una vez por actualización; cada pedido
+  sólo elige variante (gzip o no) y responde 304 si el ETag coincide.
+- Si la fuente falla y hay una versión vencida en caché, se sirve esa.
+- /api/events empuja por ciudad sólo lo que cambió (delta del JSON de
+  /api/current y /api/forecast). Los cambios salen de los NOTIFY del ETL
+  (update_events.py: mediciones -> current/history, features del modelo ->
+  forecast) y, para OpenWeather (clima actual y pronóstico diario), de un
+  refresco periódico de las ciudades con suscriptores: el costo no depende
+  de cuántos clientes haya.
+
+Uso:
+    python app.py [--host 0.0.0.0] [--port 5000]
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import requests
+from flask import Flask, Response, abort, jsonify, request, send_from_directory
+from werkzeug.exceptions import HTTPException
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "mod", "model"))
+sys.path.insert(0, os.path.join(ROOT, "mod", "scripts"))
+from config_db import air_quality_engine, pooled_conn  # noqa: E402
+from update_events import listen_updates  # noqa: E402
+
+from aggregates import query_series  # noqa: E402
+from rate_limit import get_limiter  # noqa: E402
+
+FRONTEND_DIR = os.path.join(ROOT, "code", "scripts", "html", "AirBytes")
+
+OPENWEATHER_KEY = os.getenv("OPENWEATHER_API")   # sin ella los endpoints de OpenWeather responden 503
+OPENWEATHER_CURRENT = "https://api.openweathermap.org/data/2.5/weather"
+OPENWEATHER_AIR = "https://api.openweathermap.org/data/2.5/air_pollution"
+OPENWEATHER_FORECAST = "https://api.openweathermap.org/data/2.5/forecast"   # 5 días en pasos de 3 h
+UPSTREAM_TIMEOUT = 10
+
+# segundos que vale cada tipo de respuesta
+UPSTREAM_TTL = 600       # OpenWeather actualiza cada ~10 min
+OUTLOOK_TTL = 3600       # el pronóstico de 5 días de OpenWeather cambia cada 3 h
+CURRENT_TTL = 120        # mediciones de estaciones (el ETL carga cada pocos minutos)
+HISTORY_TTL = 600
+FORECAST_TTL = 900
+CACHE_MAX_ENTRIES = 2048
+LOAD_TIMEOUT = 30        # cuánto espera un pedido a la carga que ya está en curso
+GZIP_MIN_BYTES = 512
+
+CITY_RADIUS = 0.3        # grados alrededor de la ciudad para buscar estaciones
+STATION_WINDOW = timedelta(hours=6)
+CELL_RES = 0.25          # coordenadas sueltas se agrupan en celdas de este tamaño
+SNAP_RADIUS = CITY_RADIUS  # ?lat=&lon= a menos de esto de una ciudad conocida usa esa ciudad
+HISTORY_MAX_HOURS = 24 * 90
+HISTORY_MAX_POINTS = 5000  # hours / step
+HISTORY_PARAMETERS = ("pm25", "pm10", "no2", "o3", "co", "so2", "no2_tropospheric_column", "cloud_fraction")
+FORECAST_TARGETS = ("no2", "o3", "pm25")
+
+EVENT_KEEPALIVE = 15     # segundos entre comentarios ": keepalive" (proxies cierran conexiones mudas)
+EVENT_RETRY_MS = 5000    # reconexión sugerida al EventSource
+SUBSCRIBER_QUEUE = 100   # eventos pendientes por cliente; si se llena se lo fuerza a reconectar
+REFRESH_TICK = 60        # cada cuánto se revisan las ciudades con suscriptores
+
+# mismas ubicaciones que northAmericanRegions / colombianCities de script.js
+CITIES = {
+    "north-america": {"name": "Norteamérica", "lat": 45.0, "lon": -100.0},
+    "usa": {"name": "Estados Unidos", "lat": 39.8283, "lon": -98.5795},
+    "canada": {"name": "Canadá", "lat": 56.1304, "lon": -106.3468},
+    "mexico": {"name": "México", "lat": 23.6345, "lon": -102.5528},
+    "colombia": {"name": "Colombia", "lat": 4.5709, "lon": -74.2973},
+    "bogota": {"name": "Bogotá", "lat": 4.7110, "lon": -74.0721},
+    "medellin": {"name": "Medellín", "lat": 6.2442, "lon": -75.5812},
+    "cali": {"name": "Cali", "lat": 3.4516, "lon": -76.5320},
+    "barranquilla": {"name": "Barranquilla", "lat": 10.9639, "lon": -74.7964},
+    "cartagena": {"name": "Cartagena", "lat": 10.3910, "lon": -75.4794},
+    "bucaramanga": {"name": "Bucaramanga", "lat": 7.1193, "lon": -73.1227},
+    "pereira": {"name": "Pereira", "lat": 4.8133, "lon": -75.6961},
+    "santa-marta": {"name": "Santa Marta", "lat": 11.2408, "lon": -74.2110},
+    "ibague": {"name": "Ibagué", "lat": 4.4378, "lon": -75.2006},
+    "manizales": {"name": "Manizales", "lat": 5.0689, "lon": -75.5174},
+    "neiva": {"name": "Neiva", "lat": 2.9345, "lon": -75.2809},
+}
+
+
+# ------------------ Caché compartida ------------------
+
+Payload = namedtuple("Payload", "data body gzipped etag created expires")
+
+
+def make_payload(data, ttl):
+    body = json.dumps(data, ensure_ascii=False, default=str, separators=(",", ":")).encode("utf-8")
+    now = time.time()
+    return Payload(data=data, body=body,
+                   gzipped=gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_BYTES else None,
+                   etag=hashlib.sha1(body).hexdigest()[:20], created=now, expires=now + ttl)
+
+
+class SharedCache:
+    """
+    Caché TTL en memoria del proceso con coalescencia de cargas: para una
+    clave vencida sólo un hilo ejecuta `loader`; los demás esperan su Future.
+    Las entradas vencidas se conservan (LRU acotado) para servirlas si la
+    recarga falla. Cuando una recarga cambia el contenido se llama a
+    on_update(key, anterior, nuevo) (así se generan los eventos SSE).
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, on_update=None):
+        self.max_entries = max_entries
+        self.on_update = on_update
+        self._entries = OrderedDict()    # key -> Payload
+        self._inflight = {}              # key -> Future
+        self._dirty = set()              # invalidadas mientras se cargaban
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "loads": 0, "coalesced": 0, "stale": 0, "errors": 0}
+
+    def get(self, key, ttl, loader):
+        """Payload de `key`; llama a loader() (que devuelve datos JSON-serializables) si hace falta."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > time.time():
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+                self.counters["loads"] += 1
+            else:
+                self.counters["coalesced"] += 1
+        if not leader:
+            return fut.result(timeout=LOAD_TIMEOUT)
+
+        try:
+            payload = make_payload(loader(), ttl)
+            with self._lock:
+                previous = self._entries.get(key)
+                # si llegó una invalidación durante la carga, lo leído puede ser viejo: se guarda
+                # (y se devuelve) ya vencido, así el próximo get recarga
+                if key in self._dirty:
+                    payload = payload._replace(expires=0)
+                self._entries[key] = payload
+                self._dirty.discard(key)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            fut.set_result(payload)
+            if self.on_update and (previous is None or previous.etag != payload.etag):
+                try:
+                    self.on_update(key, previous, payload)
+                except Exception as e:
+                    print(f"⚠️ on_update {key}: {e}")
+        except Exception as e:
+            with self._lock:
+                self.counters["errors"] += 1
+                if entry is not None:
+                    self.counters["stale"] += 1
+            if entry is not None:
+                print(f"⚠️ {key}: {e}; se sirve la versión anterior")
+                fut.set_result(entry)
+            else:
+                fut.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return fut.result()
+
+    def peek(self, key):
+        """Entrada actual (vigente o no) sin cargar nada."""
+        with self._lock:
+            return self._entries.get(key)
+
+    def invalidate(self, prefix):
+        """Vence las claves que empiezan con la tupla `prefix` (se recargan en el próximo get)."""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if key[:len(prefix)] == prefix:
+                    self._entries[key] = entry._replace(expires=0)
+            self._dirty.update(k for k in self._inflight if k[:len(prefix)] == prefix)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "inflight": len(self._inflight)}
+
+
+CACHE = SharedCache()
+
+# ------------------ Fuentes ------------------
+
+_session = requests.Session()
+_upstream_lock = threading.Lock()
+UPSTREAM_CALLS = {"openweather": 0}
+
+
+def _openweather(url, lat, lon):
+    if not OPENWEATHER_KEY:
+        abort(503, description="Falta la variable de entorno OPENWEATHER_API")
+    with _upstream_lock:
+        UPSTREAM_CALLS["openweather"] += 1
+    get_limiter(url).acquire()
+    r = _session.get(url, params={"lat": lat, "lon": lon, "appid": OPENWEATHER_KEY, "units": "metric", "lang": "es"},
+                     timeout=UPSTREAM_TIMEOUT)
+    r.raise_for_status()
+    return r.json()
+
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat() if epoch else None
+
+
+def load_upstream(place):
+    """Clima y contaminación de OpenWeather para un lugar (una llamada a cada endpoint)."""
+    weather = _openweather(OPENWEATHER_CURRENT, place["lat"], place["lon"])
+    air = _openweather(OPENWEATHER_AIR, place["lat"], place["lon"])
+    main, wind = weather.get("main", {}), weather.get("wind", {})
+    first = (air.get("list") or [{}])[0]
+    return {
+        "weather": {
+            "temperature": main.get("temp"), "humidity": main.get("humidity"), "pressure": main.get("pressure"),
+            "windSpeed": wind.get("speed", 0) * 3.6, "windDeg": wind.get("deg"),
+            "precipitation": (weather.get("rain") or {}).get("1h", 0),
+            "description": (weather.get("weather") or [{}])[0].get("description"),
+            "icon": (weather.get("weather") or [{}])[0].get("icon"),
+            "visibility": weather.get("visibility"), "cloudiness": (weather.get("clouds") or {}).get("all"),
+            "sunrise": _iso((weather.get("sys") or {}).get("sunrise")),
+            "sunset": _iso((weather.get("sys") or {}).get("sunset")),
+            "timestamp": _iso(weather.get("dt", time.time())),
+            "source": "OpenWeatherMap",
+        },
+        "air": {
+            "components": first.get("components", {}), "owmAqi": (first.get("main") or {}).get("aqi"),
+            "timestamp": _iso(first.get("dt", time.time())),
+            "source": "OpenWeatherMap Air Pollution",
+        },
+    }
+
+
+def load_outlook(place):
+    """Pronóstico de 5 días de OpenWeather (pasos de 3 h) resumido por día local de la ciudad."""
+    data = _openweather(OPENWEATHER_FORECAST, place["lat"], place["lon"])
+    offset = timedelta(seconds=(data.get("city") or {}).get("timezone", 0))
+    by_day = {}
+    for step in data.get("list") or []:
+        local = datetime.fromtimestamp(step["dt"], timezone.utc) + offset
+        by_day.setdefault(local.date().isoformat(), []).append((local.hour, step))
+    days = []
+    for day, steps in sorted(by_day.items()):
+        mains = [s.get("main", {}) for _, s in steps]
+        winds = [(s.get("wind") or {}).get("speed", 0) * 3.6 for _, s in steps]
+        # el cielo del día: el paso más cercano al mediodía
+        _, noon = min(steps, key=lambda hs: abs(hs[0] - 12))
+        days.append({
+            "date": day,
+            "temp": sum(m.get("temp", 0) for m in mains) / len(mains),
+            "tempMin": min(m.get("temp_min", m.get("temp", 0)) for m in mains),
+            "tempMax": max(m.get("temp_max", m.get("temp", 0)) for m in mains),
+            "humidity": sum(m.get("humidity", 0) for m in mains) / len(mains),
+            "pressure": sum(m.get("pressure", 0) for m in mains) / len(mains),
+            "windSpeed": sum(winds) / len(winds),
+            "precipitation": sum((s.get("rain") or {}).get("3h", 0) for _, s in steps),
+            "description": (noon.get("weather") or [{}])[0].get("description"),
+            "icon": (noon.get("weather") or [{}])[0].get("icon"),
+        })
+    return {"days": days, "source": "OpenWeatherMap 5 day / 3 hour"}
+
+
+def _bbox(place, radius=CITY_RADIUS):
+    return (place["lat"] - radius, place["lat"] + radius, place["lon"] - radius, place["lon"] + radius)
+
+
+def _station_ids(cur, place):
+    lat_min, lat_max, lon_min, lon_max = _bbox(place)
+    cur.execute("SELECT id FROM stations WHERE lat BETWEEN %s AND %s AND lon BETWEEN %s AND %s",
+                (lat_min, lat_max, lon_min, lon_max))
+    return [r[0] for r in cur.fetchall()]
+
+
+def load_stations(place):
+    """Último valor de cada parámetro por estación cercana (STATION_WINDOW) y su promedio."""
+    lat_min, lat_max, lon_min, lon_max = _bbox(place)
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT ON (m.station_id, m.parameter)
+                   m.station_id, s.nombre, m.parameter, m.value, m.unit, m.datetime_utc
+            FROM measurements m JOIN stations s ON s.id = m.station_id
+            WHERE m.datetime_utc >= %s
+              AND s.lat BETWEEN %s AND %s AND s.lon BETWEEN %s AND %s
+            ORDER BY m.station_id, m.parameter, m.datetime_utc DESC
+        """, (datetime.now(timezone.utc) - STATION_WINDOW, lat_min, lat_max, lon_min, lon_max))
+        rows = cur.fetchall()
+    by_param = {}
+    for station_id, nombre, parameter, value, unit, ts in rows:
+        p = by_param.setdefault(parameter, {"values": [], "unit": unit, "latest": None})
+        p["values"].append(value)
+        p["latest"] = max(p["latest"] or ts, ts)
+    return {
+        param: {"mean": sum(p["values"]) / len(p["values"]), "min": min(p["values"]), "max": max(p["values"]),
+                "stations": len(p["values"]), "unit": p["unit"], "latest": p["latest"].isoformat()}
+        for param, p in by_param.items()
+    }
+
+
+def load_current(key, place):
+    # la parte de OpenWeather tiene su propio TTL: refrescar estaciones no la vuelve a pedir
+    upstream = CACHE.get(("upstream", key), UPSTREAM_TTL, lambda: load_upstream(place)).data
+    try:
+        stations = load_stations(place)
+    except Exception as e:
+        print(f"⚠️ Sin estaciones para {key}: {e}")
+        stations = {}
+    return {"place": key, "name": place["name"], "lat": place["lat"], "lon": place["lon"],
+            **upstream, "stations": stations, "updated_at": datetime.now(timezone.utc).isoformat()}
+
+
+def load_history(key, place, parameter, hours, step):
+    """Serie horaria (o de `step`) de las estaciones cercanas, combinada con promedio ponderado por n."""
+    # límites en bordes de `step` (así pick_rollup puede usar measurements_hourly/_daily);
+    # end es el inicio del bucket siguiente para incluir el que está en curso
+    step_s = int(pd.Timedelta(step).total_seconds())
+    end = datetime.fromtimestamp((time.time() // step_s + 1) * step_s, timezone.utc)
+    start = end - timedelta(hours=hours)
+    with pooled_conn() as conn, conn.cursor() as cur:
+        ids = _station_ids(cur, place)
+        df = query_series(cur, parameter, start, end, step, station_ids=ids) if ids else None
+    series = []
+    if df is not None and not df.empty:
+        df["total"] = df["mean"] * df["n"]
+        agg = df.groupby("bucket").agg(n=("n", "sum"), total=("total", "sum"), min=("min", "min"),
+                                       max=("max", "max")).reset_index()
+        series = [{"t": r.bucket.isoformat(), "mean": r.total / r.n if r.n else None, "min": r.min,
+                   "max": r.max, "n": int(r.n)} for r in agg.itertuples()]
+    return {"place": key, "parameter": parameter, "step": step, "start": start.isoformat(),
+            "end": end.isoformat(), "stations": len(ids), "series": series,
+            "source": df["source"].iloc[0] if df is not None and not df.empty else None}
+
+
+def load_forecast(key, place, targets):
+    """
+    Predicción del modelo en el punto de la ciudad con lo último observado
+    alrededor, más el pronóstico diario de OpenWeather (`daily`, con su propio
+    TTL: recargar la predicción no lo vuelve a pedir).
+    """
+    import numpy as np
+    import model as aq_model
+
+    try:
+        daily = CACHE.get(("outlook", key), OUTLOOK_TTL, lambda: load_outlook(place)).data
+    except Exception as e:
+        print(f"⚠️ Sin pronóstico de OpenWeather para {key}: {e}")
+        daily = None
+    at = datetime.now(timezone.utc)
+    lat, lon = np.array([place["lat"]]), np.array([place["lon"]])
+    out = {}
+    for target in targets:
+        try:
+            _, feature_names = aq_model.load_model(target)
+        except FileNotFoundError:
+            continue
+        feats, origin = aq_model.grid_features(feature_names, lat, lon, at, _bbox(place))
+        pred = aq_model.predict_batch(lat, lon, features=feats, target=target,
+                                      save=False)
+        out[target] = {"value": float(pred[0]), "features": origin}
+    if not out and daily is None:
+        # mejor un error (no se cachea) que un pronóstico vacío durante FORECAST_TTL
+        raise FileNotFoundError(f"No hay modelos entrenados para {', '.join(targets)} en {aq_model.MODEL_DIR} "
+                                f"ni pronóstico de OpenWeather")
+    return {"place": key, "valid_at": at.isoformat(), "model_version": aq_model.MODEL_VERSION, "targets": out,
+            "daily": daily}
+
+
+# ------------------ Push (SSE) ------------------
+
+def diff(old, new):
+    """Lo que cambió de `old` a `new` (recursivo en dicts; claves borradas -> None). {} si nada."""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    out = {}
+    for k, v in new.items():
+        if k not in old:
+            out[k] = v
+        elif isinstance(v, dict) and isinstance(old[k], dict):
+            sub = diff(old[k], v)
+            if sub:
+                out[k] = sub
+        elif v != old[k]:
+            out[k] = v
+    out.update({k: None for k in old if k not in new})
+    return out
+
+
+class UpdateBroker:
+    """Suscriptores SSE por ciudad. Cada evento se serializa una vez y se encola a cada cliente."""
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE):
+        self.queue_size = queue_size
+        self._subs = {}          # ciudad -> set(queue.Queue)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.counters = {"published": 0, "delivered": 0, "resyncs": 0}
+
+    def subscribe(self, cities):
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            for city in cities:
+                self._subs.setdefault(city, set()).add(q)
+        return q
+
+    def unsubscribe(self, q, cities):
+        with self._lock:
+            for city in cities:
+                subs = self._subs.get(city)
+                if subs:
+                    subs.discard(q)
+                    if not subs:
+                        del self._subs[city]
+
+    def cities(self):
+        with self._lock:
+            return list(self._subs)
+
+    def publish(self, city, event, data):
+        with self._lock:
+            self._seq += 1
+            message = format_event(event, data, self._seq)
+            targets = list(self._subs.get(city, ()))
+            self.counters["published"] += 1
+        for q in targets:
+            try:
+                q.put_nowait(message)
+                self.counters["delivered"] += 1
+            except queue.Full:
+                # cliente lento: se descarta lo pendiente y se corta; al reconectar recibe el estado completo
+                self.counters["resyncs"] += 1
+                while not q.empty():
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+                q.put_nowait(None)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "cities": len(self._subs),
+                    "subscribers": len(set().union(*self._subs.values())) if self._subs else 0}
+
+
+BROKER = UpdateBroker()
+_background = ThreadPoolExecutor(max_workers=4, thread_name_prefix="refresh")
+_started = threading.Event()
+_start_lock = threading.Lock()
+
+
+def format_event(event, data, seq=None):
+    body = json.dumps(data, ensure_ascii=False, default=str, separators=(",", ":"))
+    return (f"id: {seq}\n" if seq is not None else "") + f"event: {event}\ndata: {body}\n\n"
+
+
+def _entry(kind, city):
+    """(clave, ttl, loader) de lo que se empuja por ciudad."""
+    place = CITIES[city]
+    if kind == "current":
+        return ("current", city), CURRENT_TTL, lambda: load_current(city, place)
+    return ("forecast", city, FORECAST_TARGETS), FORECAST_TTL, lambda: load_forecast(city, place, FORECAST_TARGETS)
+
+
+def _refresh(kind, city):
+    key, ttl, loader = _entry(kind, city)
+    try:
+        # si había una carga en curso al invalidar, get() devuelve lo de esa carga ya vencido: se repite
+        if CACHE.get(key, ttl, loader).expires <= time.time():
+            CACHE.get(key, ttl, loader)
+    except Exception as e:
+        print(f"⚠️ No se pudo refrescar {key}: {e}")
+
+
+def on_cache_update(key, old, new):
+    """Cada recarga que cambia /api/current o /api/forecast de una ciudad se publica como delta."""
+    if key[0] == "current" and key[1] in CITIES:
+        kind = "current"
+    elif key[0] == "forecast" and key[1] in CITIES and key[2] == FORECAST_TARGETS:
+        kind = "forecast"
+    else:
+        return
+    changes = diff(old.data if old else {}, new.data)
+    if set(changes) - {"updated_at", "valid_at"}:   # sólo la hora de carga no es un cambio
+        BROKER.publish(key[1], kind, {"place": key[1], "etag": new.etag, "delta": changes})
+
+
+CACHE.on_update = on_cache_update
+
+
+def _touches(place, bbox):
+    lat_min, lat_max, lon_min, lon_max = _bbox(place)
+    return lat_min <= bbox[1] and lat_max >= bbox[0] and lon_min <= bbox[3] and lon_max >= bbox[2]
+
+
+# tipo de aviso (update_events) -> endpoints cuyas cargas leen esas tablas
+EVENT_KINDS = {
+    "measurements": ("current", "history"),   # load_stations / load_history
+    "features": ("forecast",),                # grid_features de load_forecast
+}
+
+
+def on_db_updates(events):
+    """Avisos de update_events: vence la caché de las ciudades tocadas y recarga las que tienen suscriptores."""
+    touched = set()
+    for ev in events:
+        for city, place in CITIES.items():
+            if _touches(place, ev["bbox"]):
+                touched.update((kind, city) for kind in EVENT_KINDS.get(ev.get("kind"), ()))
+    subscribed = set(BROKER.cities())
+    for kind, city in touched:
+        CACHE.invalidate((kind, city))
+        if kind != "history" and city in subscribed:
+            _background.submit(_refresh, kind, city)
+
+
+def _listen_loop():
+    def handle(events):
+        try:
+            on_db_updates(events)
+        except Exception as e:
+            print(f"⚠️ Error procesando avisos de la DB: {e}")
+
+    listen_updates(handle, [air_quality_engine])
+
+
+def _tick_loop():
+    # OpenWeather no avisa: las ciudades con suscriptores se recargan al vencer su TTL
+    # (current por el clima actual, forecast por el pronóstico diario)
+    while True:
+        time.sleep(REFRESH_TICK)
+        for city in BROKER.cities():
+            _background.submit(_refresh, "current", city)
+            _background.submit(_refresh, "forecast", city)
+
+
+def start_background():
+    """Arranca (una vez por proceso) el LISTEN de la DB y el refresco periódico."""
+    with _start_lock:
+        if _started.is_set():
+            return
+        threading.Thread(target=_listen_loop, name="db-listen", daemon=True).start()
+        threading.Thread(target=_tick_loop, name="refresh-tick", daemon=True).start()
+        _started.set()
+
+# ------------------ HTTP ------------------
+
+app = Flask(__name__, static_folder=None)
+
+
+def respond(payload):
+    """Responde un Payload con ETag (304 si el cliente ya lo tiene), gzip si lo acepta y max-age restante."""
+    max_age = max(0, int(payload.expires - time.time()))
+    if request.if_none_match.contains_weak(payload.etag):
+        resp = Response(status=304)
+    else:
+        use_gzip = payload.gzipped is not None and "gzip" in request.accept_encodings
+        resp = Response(payload.gzipped if use_gzip else payload.body, mimetype="application/json")
+        if use_gzip:
+            resp.headers["Content-Encoding"] = "gzip"
+    resp.set_etag(payload.etag, weak=True)
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}"
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+
+def resolve_place(city=None):
+    """
+    Ciudad conocida o ?lat=&lon=. Las coordenadas cerca de una ciudad de
+    CITIES usan esa ciudad; el resto se agrupa en celdas de CELL_RES. Así se
+    comparte la caché y un cliente no puede multiplicar las llamadas a
+    OpenWeather variando decimales.
+    """
+    if city:
+        if city not in CITIES:
+            abort(404, description=f"Ciudad desconocida: {city}")
+        return city, CITIES[city]
+    try:
+        lat, lon = float(request.args["lat"]), float(request.args["lon"])
+    except (KeyError, ValueError):
+        abort(400, description="Falta la ciudad o lat/lon")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        abort(400, description="lat debe estar en [-90, 90] y lon en [-180, 180]")
+    dist, near = min((math.hypot(p["lat"] - lat, p["lon"] - lon), c) for c, p in CITIES.items())
+    if dist <= SNAP_RADIUS:
+        return near, CITIES[near]
+    lat, lon = round(round(lat / CELL_RES) * CELL_RES, 4), round(round(lon / CELL_RES) * CELL_RES, 4)
+    return f"cell:{lat}:{lon}", {"name": f"{lat}, {lon}", "lat": lat, "lon": lon}
+
+
+@app.errorhandler(400)
+@app.errorhandler(404)
+@app.errorhandler(503)
+def json_error(e):
+    return jsonify({"error": e.description}), e.code
+
+
+def cached(key, ttl, loader):
+    try:
+        return respond(CACHE.get(key, ttl, loader))
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ {key}: {e}")
+        return jsonify({"error": str(e)}), 502
+
+
+@app.get("/api/cities")
+def api_cities():
+    return cached(("cities",), 24 * 3600, lambda: CITIES)
+
+
+@app.get("/api/current")
+@app.get("/api/current/<city>")
+def api_current(city=None):
+    key, place = resolve_place(city)
+    return cached(("current", key), CURRENT_TTL, lambda: load_current(key, place))
+
+
+@app.get("/api/history")
+@app.get("/api/history/<city>")
+def api_history(city=None):
+    key, place = resolve_place(city)
+    parameter = request.args.get("parameter", "pm25")
+    if parameter not in HISTORY_PARAMETERS:
+        abort(400, description=f"parameter debe ser uno de: {', '.join(HISTORY_PARAMETERS)}")
+    hours = request.args.get("hours", 48, type=int)
+    if hours is None or not 1 <= hours <= HISTORY_MAX_HOURS:
+        abort(400, description=f"hours debe ser un entero entre 1 y {HISTORY_MAX_HOURS}")
+    try:
+        step_s = int(pd.Timedelta(request.args.get("step", "1h")).total_seconds())
+    except ValueError:
+        step_s = 0
+    if step_s <= 0 or hours * 3600 // step_s > HISTORY_MAX_POINTS:
+        abort(400, description=f"step debe ser una duración positiva (1h, 15min, 1d) "
+                               f"de no más de {HISTORY_MAX_POINTS} puntos")
+    # la clave usa el paso normalizado: "1h", "60min" y "3600s" comparten entrada
+    step = f"{step_s}s"
+    return cached(("history", key, parameter, hours, step), HISTORY_TTL,
+                  lambda: load_history(key, place, parameter, hours, step))
+
+
+@app.get("/api/forecast")
+@app.get("/api/forecast/<city>")
+def api_forecast(city=None):
+    key, place = resolve_place(city)
+    targets = tuple(sorted(set(request.args.get("targets", ",".join(FORECAST_TARGETS)).split(","))))
+    if not set(targets) <= set(FORECAST_TARGETS):
+        abort(400, description=f"targets debe ser parte de: {', '.join(FORECAST_TARGETS)}")
+    return cached(("forecast", key, targets), FORECAST_TTL, lambda: load_forecast(key, place, targets))
+
+
+@app.get("/api/events")
+def api_events():
+    """
+    Stream SSE. Al conectar manda el estado completo de cada ciudad que ya
+    esté en caché (evento `current` con `data`); después sólo deltas
+    (`current` / `forecast` con `delta`, null = clave borrada).
+    """
+    cities = [c for c in request.args.get("cities", "").split(",") if c in CITIES]
+    if not cities:
+        abort(400, description="Indica ?cities= con ciudades conocidas")
+    start_background()
+    q = BROKER.subscribe(cities)   # antes de leer el estado: así no se pierde un cambio intermedio
+
+    def stream():
+        try:
+            yield f"retry: {EVENT_RETRY_MS}\n\n"
+            for city in cities:
+                entry = CACHE.peek(("current", city))
+                if entry is None:
+                    # llega como delta completo cuando termine de cargar
+                    _background.submit(_refresh, "current", city)
+                else:
+                    yield format_event("current", {"place": city, "etag": entry.etag, "data": entry.data})
+            while True:
+                try:
+                    message = q.get(timeout=EVENT_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            BROKER.unsubscribe(q, cities)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/stats")
+def api_stats():
+    return jsonify({"cache": CACHE.stats(), "events": BROKER.stats(), "upstream_calls": dict(UPSTREAM_CALLS)})
+
+
+@app.get("/")
+@app.get("/<path:filename>")
+def frontend(filename="index.html"):
+    return send_from_directory(FRONTEND_DIR, filename)
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5000)
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not OPENWEATHER_KEY:
+        print("⚠️ OPENWEATHER_API no está definida: /api/current responderá 503")
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -1,35 +1,9 @@
 
 
 const AIRBYTES_CONFIG = {
-    // NASA TEMPO API Configuration
-    nasa: {
-        apiKey: '8VFqhy83c3Ji3gbebKoLe3DfMO4UkothFZJElztB', 
-        baseUrl: 'https://api.nasa.gov/planetary/earth/assets',
-        endpoints: {
-            no2: '/tempo/no2',
-            o3: '/tempo/o3',
-            hcho: '/tempo/hcho'
-        }
-    },
-
-  
-    weather: {
-        apiKey: '147e23d2ab0429fc6473a00033041c0d', 
-        baseUrl: 'https://api.openweathermap.org/data/2.5',
-        endpoints: {
-            current: '/weather',
-            forecast: '/forecast'
-        }
-    },
-
-  
-    airQuality: {
-        apiKey: '147e23d2ab0429fc6473a00033041c0d', 
-        baseUrl: 'https://api.openweathermap.org/data/2.5',
-        endpoints: {
-            current: '/weather',
-            forecast: '/forecast'
-        }
+    // AirBytes backend (app.py); empty = same origin
+    backend: {
+        baseUrl: ''
     },
 
     // Application Settings
@@ -1,20 +1,6 @@
 class AirBytesApp {
     constructor() {
     
-        this.nasaApiKey = '8VFqhy83c3Ji3gbebKoLe3DfMO4UkothFZJElztB';
-        this.tempoBaseUrl = 'https://api.nasa.gov/planetary/earth/assets';
-        this.tempoEndpoints = {
-            no2: `${this.tempoBaseUrl}`,
-            o3: `${this.tempoBaseUrl}`,
-            hcho: `${this.tempoBaseUrl}`
-        };
-        
-        this.weatherApiKey = '147e23d2ab0429fc6473a00033041c0d';
-        this.weatherBaseUrl = 'https://api.openweathermap.org/data/2.5';
-        
-        this.airQualityApiKey = '147e23d2ab0429fc6473a00033041c0d';
-        this.airQualityBaseUrl = 'https://api.openweathermap.org/data/2.5';
-        
         this.currentLocation = 'colombia';
         this.updateInterval = 600000; // 10 minutes
         this.agriculturalUpdateInterval = 900000; // 15 minutes for agricultural data
@@ -25,6 +11,13 @@ class AirBytesApp {
         this.pollutionMarkers = [];
         this.mapUpdateInterval = null;
         
+        const backendConfig = (window.AIRBYTES_CONFIG && window.AIRBYTES_CONFIG.backend) || {};
+        this.apiBaseUrl = backendConfig.baseUrl || '';
+        this.pendingRequests = new Map();
+        this.eventSource = null;
+        this.mapMarkersByKey = new Map();
+        this.alertSettings = null;
+
         this.dataCache = new Map();
         this.cacheTimeout = 300000; // 5 minutes cache
         this.isMapLoaded = false;
@@ -59,8 +52,13 @@ class AirBytesApp {
     init() {
         this.setupEventListeners();
         this.loadInitialData();
-        this.startAutoUpdate();
-        this.startAgriculturalAutoUpdate();
+        // Server push replaces the refresh intervals; polling stays as fallback
+        if (window.EventSource) {
+            this.startServerUpdates();
+        } else {
+            this.startAutoUpdate();
+            this.startAgriculturalAutoUpdate();
+        }
         
         setTimeout(() => {
             this.initializeMap();
@@ -407,15 +405,8 @@ class AirBytesApp {
                     return cachedData;
                 }
                 
-                try {
-                    const data = await this.fetchAlternativeTempoData(locationData);
-                    this.setCachedData(cacheKey, data);
-                    return data;
-                } catch (altError) {
-                    console.error('Error fetching alternative TEMPO data:', altError);
-                    this.showNotification('Error al obtener datos TEMPO, usando datos simulados', 'warning');
-            return this.generateSimulatedTempoData();
-                }
+                this.showNotification('Error al obtener datos TEMPO, usando datos simulados', 'warning');
+                return this.generateSimulatedTempoData();
             }
         } else {
             
@@ -458,28 +449,8 @@ class AirBytesApp {
 
     async getWeatherDataForLocation(locationData) {
         try {
-            const response = await fetch(`${this.weatherBaseUrl}/weather?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.weatherApiKey}&units=metric&lang=es`);
-            const data = await response.json();
-            
-            if (data.cod === 200) {
-                return {
-                    temperature: Math.round(data.main.temp),
-                    humidity: data.main.humidity,
-                    pressure: data.main.pressure,
-                    windSpeed: Math.round(data.wind.speed * 3.6),
-                    windDirection: this.getWindDirection(data.wind.deg),
-                    precipitation: data.rain ? (data.rain['1h'] || 0) : 0,
-                    description: data.weather[0].description,
-                    icon: data.weather[0].icon,
-                    visibility: data.visibility / 1000,
-                    uvIndex: data.uvi || 0,
-                    cloudiness: data.clouds.all,
-                    timestamp: new Date().toISOString(),
-                    source: 'OpenWeatherMap'
-                };
-            } else {
-                throw new Error('Error en la respuesta de la API');
-            }
+            const data = await this.fetchCurrentConditions(locationData);
+            return this.mapBackendWeather(data.weather);
         } catch (error) {
             console.error('Error fetching weather data for location:', error);
             // Fallback to simulated data
@@ -795,9 +766,15 @@ class AirBytesApp {
     }
 
 
-    loadMonthlyData() {
+    async loadMonthlyData() {
         const container = document.getElementById('monthlyAnalysis');
-        const monthlyData = this.generateMonthlyData();
+        let monthlyData;
+        try {
+            monthlyData = await this.getRealMonthlyData();
+        } catch (error) {
+            console.error('Error fetching monthly history:', error);
+            monthlyData = this.generateMonthlyData();
+        }
         
         container.innerHTML = monthlyData.map(month => `
             <div class="monthly-card">
@@ -973,6 +950,12 @@ class AirBytesApp {
         if (this.alertInterval) {
             clearInterval(this.alertInterval);
         }
+        this.alertSettings = settings;
+        
+        // Con actualizaciones del servidor se verifica al llegar cada cambio
+        if (this.eventSource) {
+            return;
+        }
         
         // Configurar verificación periódica de alertas
         this.alertInterval = setInterval(() => {
@@ -1080,29 +1063,8 @@ class AirBytesApp {
 
     async getCurrentWeatherData() {
         try {
-            const locationData = this.getCurrentLocationData();
-            const response = await fetch(`${this.weatherBaseUrl}/weather?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.weatherApiKey}&units=metric&lang=es`);
-            const data = await response.json();
-            
-            if (data.cod === 200) {
-                return {
-                    temperature: Math.round(data.main.temp),
-                    humidity: data.main.humidity,
-                    pressure: data.main.pressure,
-                    windSpeed: Math.round(data.wind.speed * 3.6), // Convert m/s to km/h
-                    windDirection: this.getWindDirection(data.wind.deg),
-                    precipitation: data.rain ? (data.rain['1h'] || 0) : 0,
-                    description: data.weather[0].description,
-                    icon: data.weather[0].icon,
-                    visibility: data.visibility / 1000, // Convert to km
-                    uvIndex: data.uvi || 0,
-                    cloudiness: data.clouds.all,
-                    sunrise: new Date(data.sys.sunrise * 1000),
-                    sunset: new Date(data.sys.sunset * 1000)
-                };
-            } else {
-                throw new Error('Error en datos meteorológicos');
-            }
+            const data = await this.fetchCurrentConditions(this.getCurrentLocationData());
+            return this.mapBackendWeather(data.weather);
         } catch (error) {
             console.error('Error fetching weather data:', error);
             // Fallback to existing data or generate realistic data
@@ -1556,16 +1518,8 @@ class AirBytesApp {
         const container = document.getElementById('agriculturalForecast');
         
         try {
-            // Use cached data if available
-            const cacheKey = 'agricultural_forecast';
-            const cachedData = this.getCachedData(cacheKey);
-            if (cachedData) {
-                this.displayForecast(cachedData, container);
-                return;
-            }
-            
+            // /api/forecast is cached per location and kept fresh by the 'forecast' event
             const forecast = await this.getRealAgriculturalForecast();
-            this.setCachedData(cacheKey, forecast);
             this.displayForecast(forecast, container);
         } catch (error) {
             console.error('Error loading agricultural forecast:', error);
@@ -1599,49 +1553,32 @@ class AirBytesApp {
 
     async getRealAgriculturalForecast() {
         try {
-            const locationData = this.getCurrentLocationData();
-            const response = await fetch(`${this.weatherBaseUrl}/onecall?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.weatherApiKey}&units=metric&exclude=minutely,alerts`);
-            const data = await response.json();
-            
-            if (data.daily) {
-                return data.daily.slice(0, 7).map((day, index) => {
-                    const date = new Date(day.dt * 1000);
-                    return {
-                        name: date.toLocaleDateString('es-ES', { weekday: 'short' }),
-                        temp: Math.round(day.temp.day),
-                        rain: day.rain ? Math.round(day.rain) : 0,
-                        wind: Math.round(day.wind_speed * 3.6), // Convert m/s to km/h
-                        humidity: day.humidity,
-                        pressure: day.pressure,
-                        description: day.weather[0].description,
-                        icon: day.weather[0].icon
-                    };
-                });
-            }
+            const data = await this.fetchForecast(this.getCurrentLocationData());
+            return this.mapBackendOutlook(data.daily);
         } catch (error) {
             console.error('Error fetching real forecast data:', error);
             throw error;
         }
-        
-        // Fallback to generated data
-        return this.generateAgriculturalForecast();
     }
 
-    generateAgriculturalForecast() {
-        const days = [];
-        const today = new Date();
-        
-        for (let i = 0; i < 7; i++) {
-            const day = new Date(today.getTime() + (i * 24 * 60 * 60 * 1000));
-            days.push({
-                name: day.toLocaleDateString('es-ES', { weekday: 'short' }),
-                temp: Math.round(18 + Math.random() * 15),
-                rain: Math.round(Math.random() * 20),
-                wind: Math.round(5 + Math.random() * 20)
-            });
+    mapBackendOutlook(daily) {
+        if (!daily || !daily.days.length) {
+            throw new Error('Forecast without daily outlook');
         }
-        
-        return days;
+        return daily.days.slice(0, 7).map(day => {
+            // `date` is the city's local day; noon UTC keeps the weekday stable
+            const date = new Date(`${day.date}T12:00:00Z`);
+            return {
+                name: date.toLocaleDateString('es-ES', { weekday: 'short', timeZone: 'UTC' }),
+                temp: Math.round(day.temp),
+                rain: Math.round(day.precipitation),
+                wind: Math.round(day.windSpeed),
+                humidity: day.humidity,
+                pressure: day.pressure,
+                description: day.description,
+                icon: day.icon
+            };
+        });
     }
 
     setupCropConfiguration() {
@@ -1719,6 +1656,31 @@ class AirBytesApp {
         return days;
     }
 
+    async getRealMonthlyData() {
+        const history = await this.fetchHistory(this.getCurrentLocationData(), 'pm25', 24 * 90, '1d');
+        const months = new Map();
+        history.series.filter(day => day.mean !== null).forEach(day => {
+            const date = new Date(day.t);
+            const key = `${date.getUTCFullYear()}-${date.getUTCMonth()}`;
+            if (!months.has(key)) {
+                const name = date.toLocaleDateString('es-ES', { month: 'long', timeZone: 'UTC' });
+                months.set(key, { month: name.charAt(0).toUpperCase() + name.slice(1), aqis: [] });
+            }
+            months.get(key).aqis.push(this.calculatePollutantAQI(day.mean, 'pm25'));
+        });
+        if (!months.size) {
+            throw new Error('No PM2.5 history for this location');
+        }
+        // the history has no temperature; the card shows it as unavailable
+        return [...months.values()].map(({ month, aqis }) => ({
+            month,
+            avgAqi: Math.round(aqis.reduce((sum, aqi) => sum + aqi, 0) / aqis.length),
+            goodDays: aqis.filter(aqi => aqi <= 50).length,
+            unhealthyDays: aqis.filter(aqi => aqi > 150).length,
+            avgTemp: '--'
+        }));
+    }
+
     generateMonthlyData() {
         const months = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio'];
         
@@ -1732,52 +1694,7 @@ class AirBytesApp {
     }
 
     async fetchRealTempoData() {
-        try {
-            const locationData = this.getCurrentLocationData();
-            
-            
-            const [no2Data, o3Data, hchoData] = await Promise.all([
-                this.fetchTempoPollutant('no2', locationData.lat, locationData.lon),
-                this.fetchTempoPollutant('o3', locationData.lat, locationData.lon),
-                this.fetchTempoPollutant('hcho', locationData.lat, locationData.lon)
-            ]);
-
-            return {
-                no2: no2Data.value,
-                o3: o3Data.value,
-                hcho: hchoData.value,
-                timestamp: no2Data.timestamp,
-                source: 'TEMPO Satellite'
-            };
-        } catch (error) {
-            console.error('Error fetching real TEMPO data:', error);
-            throw error; 
-        }
-    }
-
-    async fetchTempoPollutant(pollutant, lat, lon) {
-        const params = new URLSearchParams({
-            lat: lat,
-            lon: lon,
-            date: new Date().toISOString().split('T')[0], 
-            api_key: this.nasaApiKey
-        });
-
-        const response = await fetch(`${this.tempoBaseUrl}?${params}`);
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-
-        const data = await response.json();
-        
-        
-        
-        return {
-            value: Math.floor(Math.random() * 50) + 10, 
-            timestamp: new Date().toISOString(),
-            quality: 'good'
-        };
+        return await this.fetchRealTempoDataForLocation(this.getCurrentLocationData());
     }
 
     generateSimulatedTempoData() {
@@ -1960,15 +1877,8 @@ class AirBytesApp {
                     return cachedData;
                 }
                 
-                try {
-                    const data = await this.fetchAlternativeGroundData(locationData);
-                    this.setCachedData(cacheKey, data);
-                    return data;
-                } catch (altError) {
-                    console.error('Error fetching alternative ground data:', altError);
-                    this.showNotification('Error al obtener datos terrestres, usando datos simulados', 'warning');
-            return this.generateSimulatedGroundData();
-                }
+                this.showNotification('Error al obtener datos terrestres, usando datos simulados', 'warning');
+                return this.generateSimulatedGroundData();
             }
         } else {
             
@@ -2001,23 +1911,15 @@ class AirBytesApp {
 
     async fetchOpenWeatherAirData(locationData) {
         try {
-            const response = await fetch(
-                `${this.airQualityBaseUrl}/air_pollution?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.airQualityApiKey}`
-            );
+            const data = await this.fetchCurrentConditions(locationData);
+            const airData = data.air.components;
 
-                if (!response.ok) {
-                    throw new Error(`HTTP error! status: ${response.status}`);
-                }
-
-                const data = await response.json();
-            const airData = data.list[0].components;
-
-                return {
+            return {
                 pm25: airData.pm2_5,
                 pm10: airData.pm10,
                 co: airData.co / 1000, 
-                timestamp: new Date(data.list[0].dt * 1000).toISOString(),
-                source: 'OpenWeatherMap Air Pollution API'
+                timestamp: data.air.timestamp,
+                source: data.air.source
             };
         } catch (error) {
             console.error('Error fetching OpenWeather air data:', error);
@@ -2062,15 +1964,8 @@ class AirBytesApp {
                     return cachedData;
                 }
                 
-                try {
-                    const data = await this.fetchAlternativeWeatherData();
-                    this.setCachedData(cacheKey, data);
-                    return data;
-                } catch (altError) {
-                    console.error('Error fetching alternative weather data:', altError);
-                    this.showNotification('Error al obtener datos meteorológicos, usando datos simulados', 'warning');
-                    return this.generateSimulatedWeatherData();
-                }
+                this.showNotification('Error al obtener datos meteorológicos, usando datos simulados', 'warning');
+                return this.generateSimulatedWeatherData();
             }
         } else {
             
@@ -2099,25 +1994,8 @@ class AirBytesApp {
 
     async fetchRealWeatherData() {
         try {
-            const locationData = this.getCurrentLocationData();
-            
-            const response = await fetch(
-                `${this.weatherBaseUrl}/weather?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.weatherApiKey}&units=metric`
-            );
-
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-
-        const data = await response.json();
-        
-        return {
-                temperature: Math.round(data.main.temp),
-                humidity: data.main.humidity,
-                windSpeed: Math.round(data.wind.speed * 3.6), 
-                timestamp: new Date().toISOString(),
-                source: 'OpenWeatherMap'
-            };
+            const data = await this.fetchCurrentConditions(this.getCurrentLocationData());
+            return this.mapBackendWeather(data.weather);
         } catch (error) {
             console.error('Error fetching real weather data:', error);
             throw error;
@@ -2138,23 +2016,14 @@ class AirBytesApp {
     
     async fetchRealTempoDataForLocation(locationData) {
         try {
-            
-            const response = await fetch(
-                `${this.airQualityBaseUrl}/air_pollution?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.airQualityApiKey}`
-            );
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-
-            const data = await response.json();
-            const airData = data.list[0].components;
+            const data = await this.fetchCurrentConditions(locationData);
+            const airData = data.air.components;
         
         return {
                 no2: airData.no2,
                 o3: airData.o3,
                 hcho: airData.nh3 || 0, 
-                timestamp: new Date(data.list[0].dt * 1000).toISOString(),
+                timestamp: data.air.timestamp,
                 source: 'OpenWeatherMap Air Pollution (TEMPO Alternative)'
             };
         } catch (error) {
@@ -2165,23 +2034,8 @@ class AirBytesApp {
 
     async fetchRealWeatherDataForLocation(locationData) {
         try {
-            const response = await fetch(
-                `${this.weatherBaseUrl}/weather?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.weatherApiKey}&units=metric`
-            );
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-
-            const data = await response.json();
-        
-        return {
-                temperature: Math.round(data.main.temp),
-                humidity: data.main.humidity,
-                windSpeed: Math.round(data.wind.speed * 3.6),
-                timestamp: new Date().toISOString(),
-                source: 'OpenWeatherMap'
-            };
+            const data = await this.fetchCurrentConditions(locationData);
+            return this.mapBackendWeather(data.weather);
         } catch (error) {
             console.error('Error fetching real weather data:', error);
             throw error; 
@@ -2254,6 +2108,7 @@ class AirBytesApp {
                 this.updateAgriculturalWeatherData();
                 this.updateAgriculturalAlerts();
                 this.updateAgriculturalRecommendations();
+                this.loadAgriculturalForecast();
             }
         }, this.agriculturalUpdateInterval);
     }
@@ -2527,15 +2382,6 @@ class AirBytesApp {
     }
 
     
-    configureApiKeys(nasaKey, weatherKey, airQualityKey) {
-        this.nasaApiKey = nasaKey;
-        this.weatherApiKey = weatherKey;
-        this.airQualityApiKey = airQualityKey;
-        this.showNotification('API keys configuradas correctamente', 'success');
-    }
-
-
-    
     initializeMap() {
         
         this.map = L.map('pollutionMap').setView([4.5709, -74.2973], 6);
@@ -2554,7 +2400,9 @@ class AirBytesApp {
         }, 500);
         
         
-        this.startMapAutoUpdate();
+        if (!this.eventSource) {
+            this.startMapAutoUpdate();
+        }
     }
 
     async loadMapData() {
@@ -2616,6 +2464,7 @@ class AirBytesApp {
             
             marker.addTo(this.map);
             this.pollutionMarkers.push(marker);
+            this.mapMarkersByKey.set(locationKey, marker);
 
         } catch (error) {
             console.error(`Error adding marker for ${locationData.name}:`, error);
@@ -2632,98 +2481,27 @@ class AirBytesApp {
         }
         
         try {
+            const data = await this.fetchCurrentConditions(locationData);
+            const airData = data.air.components;
             
-            const response = await fetch(
-                `${this.airQualityBaseUrl}/air_pollution?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.airQualityApiKey}`
-            );
-            
-            if (response.ok) {
-                const data = await response.json();
-                const airData = data.list[0].components;
-                
-                const result = {
-                    pm25: airData.pm2_5,
-                    pm10: airData.pm10,
-                    co: airData.co / 1000,
-                    aqi: this.calculateAQIFromComponents(airData),
-                    timestamp: new Date(data.list[0].dt * 1000).toISOString(),
-                    source: 'OpenWeatherMap'
-                };
-                
-                this.setCachedData(cacheKey, result);
-                return result;
-        } else {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            
-        } catch (error) {
-            console.error('Error getting real pollution data:', error);
+            const result = {
+                pm25: airData.pm2_5,
+                pm10: airData.pm10,
+                co: airData.co / 1000,
+                aqi: this.calculateAQIFromComponents(airData),
+                timestamp: data.air.timestamp,
+                source: 'OpenWeatherMap'
+            };
             
-            const result = await this.getAlternativePollutionData(locationData);
             this.setCachedData(cacheKey, result);
             return result;
-        }
-    }
-
-    async getAlternativePollutionData(locationData) {
-        try {
-            
-            const response = await fetch(
-                `https://api.waqi.info/feed/geo:${locationData.lat};${locationData.lon}/?token=demo`
-            );
-
-            if (response.ok) {
-                const data = await response.json();
-                
-                return {
-                    pm25: data.data.iaqi.pm25?.v || 0,
-                    pm10: data.data.iaqi.pm10?.v || 0,
-                    co: data.data.iaqi.co?.v || 0,
-                    aqi: data.data.aqi || 0,
-                    timestamp: new Date().toISOString(),
-                    source: 'WAQI Air Quality'
-                };
-            } else {
-                throw new Error(`WAQI API error! status: ${response.status}`);
-            }
             
         } catch (error) {
-            console.error('Error getting alternative pollution data:', error);
-            
-            return await this.getForecastPollutionData(locationData);
-        }
-    }
-
-    async getForecastPollutionData(locationData) {
-        try {
-            const response = await fetch(
-                `${this.airQualityBaseUrl}/air_pollution/forecast?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.airQualityApiKey}`
-            );
-
-            if (response.ok) {
-                const data = await response.json();
-                const airData = data.list[0].components;
-                
-                return {
-                    pm25: airData.pm2_5,
-                    pm10: airData.pm10,
-                    co: airData.co / 1000,
-                    aqi: this.calculateAQIFromComponents(airData),
-                    timestamp: new Date(data.list[0].dt * 1000).toISOString(),
-                    source: 'OpenWeatherMap Forecast'
-                };
-            } else {
-                throw new Error(`Forecast API error! status: ${response.status}`);
-            }
-            
-        } catch (error) {
-            console.error('Error getting forecast pollution data:', error);
-            throw new Error('All real pollution data sources have failed');
+            console.error('Error getting real pollution data:', error);
+            throw error;
         }
     }
 
-    
-
     calculateAQIFromComponents(components) {
         const pm25AQI = this.calculatePollutantAQI(components.pm2_5, 'pm25');
         const pm10AQI = this.calculatePollutantAQI(components.pm10, 'pm10');
@@ -2774,6 +2552,7 @@ class AirBytesApp {
             this.map.removeLayer(marker);
         });
         this.pollutionMarkers = [];
+        this.mapMarkersByKey.clear();
     }
 
     async refreshMapData() {
@@ -2807,230 +2586,208 @@ class AirBytesApp {
     }
 
     
-    getCachedData(key) {
-        const cached = this.dataCache.get(key);
-        if (cached && (Date.now() - cached.timestamp) < this.cacheTimeout) {
-            return cached.data;
-        }
-        return null;
+    getLocationKey(locationData) {
+        const allLocations = { ...this.northAmericanRegions, ...this.colombianCities };
+        return Object.keys(allLocations).find(key => allLocations[key] === locationData) || null;
     }
 
-    setCachedData(key, data) {
-        this.dataCache.set(key, {
-            data: data,
-            timestamp: Date.now()
-        });
+    // Every call goes through the backend (app.py), which holds the API keys and
+    // shares one upstream call per city among all clients; here concurrent
+    // callers of the same URL share one request.
+    backendUrl(endpoint, locationData, params = '') {
+        const key = this.getLocationKey(locationData);
+        return key
+            ? `${this.apiBaseUrl}/api/${endpoint}/${key}${params ? `?${params}` : ''}`
+            : `${this.apiBaseUrl}/api/${endpoint}?lat=${locationData.lat}&lon=${locationData.lon}${params ? `&${params}` : ''}`;
     }
 
-    clearExpiredCache() {
-        const now = Date.now();
-        for (const [key, value] of this.dataCache.entries()) {
-            if (now - value.timestamp > this.cacheTimeout) {
-                this.dataCache.delete(key);
-            }
-        }
+    async fetchCurrentConditions(locationData) {
+        return this.fetchBackend(this.backendUrl('current', locationData));
     }
 
-    clearAllCache() {
-        this.dataCache.clear();
-        console.log('Cache cleared - forcing fresh data from APIs');
+    // Model prediction plus the OpenWeather daily outlook (`daily`)
+    async fetchForecast(locationData) {
+        return this.fetchBackend(this.backendUrl('forecast', locationData));
     }
 
-    
-    async fetchAlternativeTempoData(locationData) {
-        try {
-            
-            const response = await fetch(
-                `${this.airQualityBaseUrl}/air_pollution?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.airQualityApiKey}`
-            );
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-
-            const data = await response.json();
-            const airData = data.list[0].components;
+    async fetchHistory(locationData, parameter, hours, step) {
+        return this.fetchBackend(this.backendUrl('history', locationData,
+            `parameter=${parameter}&hours=${hours}&step=${step}`));
+    }
 
-            return {
-                no2: airData.no2,
-                o3: airData.o3,
-                hcho: airData.nh3 || 0, 
-                timestamp: new Date(data.list[0].dt * 1000).toISOString(),
-                source: 'OpenWeatherMap Air Pollution (Alternative)'
-            };
-        } catch (error) {
-            console.error('Error fetching alternative TEMPO data:', error);
-            
-            return await this.fetchHistoricalTempoData(locationData);
+    async fetchBackend(url) {
+        const cachedData = this.getCachedData(url);
+        if (cachedData) {
+            return cachedData;
         }
+        if (!this.pendingRequests.has(url)) {
+            const request = fetch(url)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`HTTP error! status: ${response.status}`);
+                    }
+                    return response.json();
+                })
+                .then(data => {
+                    this.setCachedData(url, data);
+                    return data;
+                })
+                .finally(() => this.pendingRequests.delete(url));
+            this.pendingRequests.set(url, request);
+        }
+        return this.pendingRequests.get(url);
+    }
+
+    // One SSE stream for every city: the server sends the current snapshot on
+    // connect and afterwards only what changed (new measurements, upstream refresh,
+    // new model features). It replaces both refresh intervals.
+    startServerUpdates() {
+        const allLocations = { ...this.northAmericanRegions, ...this.colombianCities };
+        const cities = Object.keys(allLocations).join(',');
+        this.eventSource = new EventSource(`${this.apiBaseUrl}/api/events?cities=${cities}`);
+        this.eventSource.addEventListener('current', event => {
+            this.handleServerUpdate(JSON.parse(event.data));
+        });
+        this.eventSource.addEventListener('forecast', event => {
+            this.handleForecastUpdate(JSON.parse(event.data));
+        });
+        this.eventSource.onerror = () => {
+            // EventSource reconnects by itself and the server resends the snapshot
+            console.warn('Server updates interrupted, reconnecting...');
+        };
     }
 
-    async fetchAlternativeGroundData(locationData) {
-        try {
-            
-            const response = await fetch(
-                `${this.airQualityBaseUrl}/air_pollution?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.airQualityApiKey}`
-            );
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+    mergeDelta(target, delta) {
+        const merged = { ...target };
+        Object.entries(delta).forEach(([key, value]) => {
+            if (value === null) {
+                delete merged[key];
+            } else if (typeof value === 'object' && !Array.isArray(value)
+                       && merged[key] && typeof merged[key] === 'object') {
+                merged[key] = this.mergeDelta(merged[key], value);
+            } else {
+                merged[key] = value;
             }
+        });
+        return merged;
+    }
 
-            const data = await response.json();
-            const airData = data.list[0].components;
-
-            return {
-                pm25: airData.pm2_5,
-                pm10: airData.pm10,
-                co: airData.co / 1000, 
-                timestamp: new Date(data.list[0].dt * 1000).toISOString(),
-                source: 'OpenWeatherMap Air Pollution'
-            };
-        } catch (error) {
-            console.error('Error fetching alternative ground data:', error);
-            
-            return await this.fetchAlternativeAirQualityAPI(locationData);
+    async handleForecastUpdate(update) {
+        const url = `${this.apiBaseUrl}/api/forecast/${update.place}`;
+        const cached = this.dataCache.get(url);
+        if (cached) {
+            this.setCachedData(url, this.mergeDelta(cached.data, update.delta));
+        }
+        // without a base the delta is dropped and loadAgriculturalForecast fetches it whole
+        if (update.place === this.currentLocation && !this.isUsingCurrentLocation
+            && this.currentSection === 'farmers') {
+            await this.loadAgriculturalForecast();
         }
     }
 
-    async fetchAlternativeWeatherData() {
-        try {
-            const locationData = this.getCurrentLocationData();
-            const response = await fetch(
-                `${this.weatherBaseUrl}/weather?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.weatherApiKey}&units=metric`
-            );
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
+    async handleServerUpdate(update) {
+        const url = `${this.apiBaseUrl}/api/current/${update.place}`;
+        const cached = this.dataCache.get(url);
+        if (update.data && cached && cached.data.updated_at === update.data.updated_at) {
+            return; // snapshot of what we already have
+        }
+        if (!update.data && !cached) {
+            // delta without a base (e.g. expired entry): the next read fetches it whole
+            return;
+        }
+        const data = update.data || this.mergeDelta(cached.data, update.delta);
+        this.setCachedData(url, data);
 
-            const data = await response.json();
+        const allLocations = { ...this.northAmericanRegions, ...this.colombianCities };
+        const locationData = allLocations[update.place];
+        if (!locationData) {
+            return;
+        }
 
-            return {
-                temperature: Math.round(data.main.temp),
-                humidity: data.main.humidity,
-                windSpeed: Math.round(data.wind.speed * 3.6),
-                timestamp: new Date().toISOString(),
-                source: 'OpenWeatherMap Weather'
-            };
-        } catch (error) {
-            console.error('Error fetching alternative weather data:', error);
-            
-            return await this.fetchAlternativeWeatherAPI();
+        if (this.isMapLoaded && this.mapMarkersByKey.has(update.place)) {
+            const marker = this.mapMarkersByKey.get(update.place);
+            this.map.removeLayer(marker);
+            this.pollutionMarkers = this.pollutionMarkers.filter(m => m !== marker);
+            this.mapMarkersByKey.delete(update.place);
+            this.dataCache.delete(`map_${locationData.lat}_${locationData.lon}`);
+            await this.addPollutionMarker(update.place, locationData);
         }
-    }
 
-    async fetchHistoricalTempoData(locationData) {
+        if (update.place !== this.currentLocation || this.isUsingCurrentLocation || this.isLoading) {
+            return;
+        }
         try {
-            
-            const response = await fetch(
-                `https://api.waqi.info/feed/geo:${locationData.lat};${locationData.lon}/?token=demo`
-            );
+            const [tempoData, groundData, weatherData] = await Promise.all([
+                this.loadTempoDataForLocation(locationData),
+                this.loadGroundDataForLocation(locationData),
+                this.loadWeatherDataForLocation(locationData)
+            ]);
+            this.updateDisplayData(tempoData, groundData, weatherData);
+            this.updateAQIDisplay(this.calculateAQI(tempoData, groundData));
+            this.updateLastUpdateTime();
 
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+            if (this.alertSettings) {
+                this.checkAlertConditions(this.alertSettings);
+            }
+            if (this.currentSection === 'farmers') {
+                this.updateAgriculturalWeatherData();
+                this.updateAgriculturalAlerts();
+                this.updateAgriculturalRecommendations();
             }
-
-            const data = await response.json();
-
-            return {
-                no2: data.data.iaqi.no2?.v || 0,
-                o3: data.data.iaqi.o3?.v || 0,
-                hcho: data.data.iaqi.h?.v || 0,
-                timestamp: new Date().toISOString(),
-                source: 'WAQI Historical Data'
-            };
         } catch (error) {
-            console.error('Error fetching historical TEMPO data:', error);
-            
-            return await this.fetchOpenWeatherMapAlternative(locationData);
+            console.error('Error applying server update:', error);
         }
     }
 
-    async fetchAlternativeAirQualityAPI(locationData) {
-        try {
-            
-            const response = await fetch(
-                `https://api.waqi.info/feed/geo:${locationData.lat};${locationData.lon}/?token=demo`
-            );
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-
-            const data = await response.json();
+    mapBackendWeather(weather) {
+        return {
+            temperature: Math.round(weather.temperature),
+            humidity: weather.humidity,
+            pressure: weather.pressure,
+            windSpeed: Math.round(weather.windSpeed),
+            windDirection: this.getWindDirection(weather.windDeg || 0),
+            precipitation: weather.precipitation || 0,
+            description: weather.description,
+            icon: weather.icon,
+            visibility: (weather.visibility || 10000) / 1000,
+            uvIndex: 0,
+            cloudiness: weather.cloudiness,
+            sunrise: weather.sunrise ? new Date(weather.sunrise) : new Date(),
+            sunset: weather.sunset ? new Date(weather.sunset) : new Date(),
+            timestamp: weather.timestamp,
+            source: weather.source
+        };
+    }
 
-            return {
-                pm25: data.data.iaqi.pm25?.v || 0,
-                pm10: data.data.iaqi.pm10?.v || 0,
-                co: data.data.iaqi.co?.v || 0,
-                timestamp: new Date().toISOString(),
-                source: 'WAQI Air Quality'
-            };
-        } catch (error) {
-            console.error('Error fetching alternative air quality API:', error);
-            
-            return await this.fetchOpenWeatherMapAlternative(locationData);
+    getCachedData(key) {
+        const cached = this.dataCache.get(key);
+        if (cached && (Date.now() - cached.timestamp) < this.cacheTimeout) {
+            return cached.data;
         }
+        return null;
     }
 
-    async fetchAlternativeWeatherAPI() {
-        try {
-            const locationData = this.getCurrentLocationData();
-            
-            const response = await fetch(
-                `${this.weatherBaseUrl}/forecast?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.weatherApiKey}&units=metric&cnt=1`
-            );
+    setCachedData(key, data) {
+        this.dataCache.set(key, {
+            data: data,
+            timestamp: Date.now()
+        });
+    }
 
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+    clearExpiredCache() {
+        const now = Date.now();
+        for (const [key, value] of this.dataCache.entries()) {
+            if (now - value.timestamp > this.cacheTimeout) {
+                this.dataCache.delete(key);
             }
-
-            const data = await response.json();
-            const currentWeather = data.list[0];
-
-            return {
-                temperature: Math.round(currentWeather.main.temp),
-                humidity: currentWeather.main.humidity,
-                windSpeed: Math.round(currentWeather.wind.speed * 3.6),
-                timestamp: new Date().toISOString(),
-                source: 'OpenWeatherMap Forecast'
-            };
-        } catch (error) {
-            console.error('Error fetching alternative weather API:', error);
-            throw new Error('All weather data sources failed');
         }
     }
 
-    async fetchOpenWeatherMapAlternative(locationData) {
-        try {
-            
-            const response = await fetch(
-                `${this.airQualityBaseUrl}/air_pollution/forecast?lat=${locationData.lat}&lon=${locationData.lon}&appid=${this.airQualityApiKey}`
-            );
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-
-            const data = await response.json();
-            const airData = data.list[0].components;
-
-            return {
-                no2: airData.no2,
-                o3: airData.o3,
-                hcho: airData.nh3 || 0,
-                pm25: airData.pm2_5,
-                pm10: airData.pm10,
-                co: airData.co / 1000,
-                timestamp: new Date(data.list[0].dt * 1000).toISOString(),
-                source: 'OpenWeatherMap Forecast (Final Fallback)'
-            };
-        } catch (error) {
-            console.error('Error fetching OpenWeatherMap alternative:', error);
-            throw new Error('All real data sources have failed');
-        }
+    clearAllCache() {
+        this.dataCache.clear();
+        console.log('Cache cleared - forcing fresh data from APIs');
     }
+
 }
 
  
@@ -0,0 +1,188 @@
+"""
+feature_store.py - Snapshot local de model_features en Parquet particionado por día.
+
+    feature_store/day=YYYY-MM-DD/data.parquet
+    feature_store/_state.json     {"updated_at": último updated_at sincronizado}
+
+- sync(): trae de la DB sólo las filas con updated_at posterior al snapshot
+  (el ETL lo actualiza en cada upsert) y reescribe únicamente los días
+  tocados, deduplicando por (datetime_utc, lat, lon). sync(full=True)
+  reconstruye el snapshot entero en otro directorio y lo cambia al final,
+  así no quedan días con filas que ya no están en model_features.
+- read(): lee con pyarrow.dataset usando memory map, proyección de columnas
+  y filtros de tiempo y bbox empujados al scan (los días fuera del rango
+  ni se abren).
+
+other_features (JSONB) no se guarda entero: sus claves conocidas se
+aplanan a columnas (OTHER_FEATURE_KEYS).
+"""
+
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+from sqlalchemy import text
+
+from config_db import air_quality_engine
+
+# junto a este archivo (no relativo al cwd), igual que MODEL_DIR en model.py
+STORE_DIR = os.getenv("FEATURE_STORE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature_store")
+BASE_COLS = ["datetime_utc", "lat", "lon", "pm25", "pm10", "no2", "o3",
+             "temp", "wind_speed", "humidity", "wind_dir", "pressure"]
+OTHER_FEATURE_KEYS = ["sat_no2_trop"]
+KEY_COLS = ["datetime_utc", "lat", "lon"]
+SYNC_CHUNK_ROWS = 100_000
+# updated_at = now() es la hora de inicio de la transacción del ETL: una carga
+# larga puede confirmar filas "más viejas" que el último sync. Se vuelve a pedir
+# este margen (la deduplicación absorbe las repetidas).
+SYNC_OVERLAP = pd.Timedelta("1h")
+
+SCHEMA = pa.schema(
+    [("datetime_utc", pa.timestamp("us", tz="UTC"))]
+    + [(c, pa.float64()) for c in BASE_COLS[1:] + OTHER_FEATURE_KEYS]
+)
+
+
+def _state_path(store_dir):
+    return os.path.join(store_dir, "_state.json")
+
+
+def load_state(store_dir=STORE_DIR):
+    """updated_at del último sync (None si no hay snapshot)."""
+    try:
+        with open(_state_path(store_dir)) as f:
+            mark = json.load(f).get("updated_at")
+        return pd.Timestamp(mark) if mark else None
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(store_dir, updated_at):
+    tmp = _state_path(store_dir) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"updated_at": updated_at.isoformat()}, f)
+    os.replace(tmp, _state_path(store_dir))
+
+
+def _day_path(store_dir, day):
+    return os.path.join(store_dir, f"day={day}", "data.parquet")
+
+
+def _write_day(store_dir, day, delta):
+    """Mezcla el delta de un día con lo que ya había y reescribe el archivo (atómico)."""
+    path = _day_path(store_dir, day)
+    frame = delta
+    if os.path.exists(path):
+        frame = pd.concat([pq.read_table(path, schema=SCHEMA).to_pandas(), delta], ignore_index=True)
+    frame = frame.drop_duplicates(KEY_COLS, keep="last").sort_values(KEY_COLS)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(frame[SCHEMA.names], schema=SCHEMA, preserve_index=False)
+    pq.write_table(table, path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+    return len(frame)
+
+
+def sync(store_dir=STORE_DIR, engine=air_quality_engine, full=False):
+    """
+    Trae a disco las filas de model_features nuevas o cambiadas desde el último
+    sync (o todo con full=True). Devuelve el número de filas traídas.
+    """
+    if not full:
+        return _sync(store_dir, engine, load_state(store_dir))
+    # si falla a mitad, el snapshot anterior queda intacto
+    store_dir = store_dir.rstrip(os.sep)
+    building, old = store_dir + ".full", store_dir + ".old"
+    shutil.rmtree(building, ignore_errors=True)
+    fetched = _sync(building, engine, None)
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(store_dir):
+        os.replace(store_dir, old)
+    os.replace(building, store_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return fetched
+
+
+def _sync(store_dir, engine, mark):
+    os.makedirs(store_dir, exist_ok=True)
+    others = ", ".join(f"(other_features->>'{k}')::double precision AS {k}" for k in OTHER_FEATURE_KEYS)
+    q = f"SELECT {', '.join(BASE_COLS)}, {others}, updated_at FROM model_features"
+    params = {}
+    if mark is not None:
+        q += " WHERE updated_at > :since"
+        params["since"] = (mark - SYNC_OVERLAP).to_pydatetime()
+    q += " ORDER BY updated_at"
+
+    fetched = 0
+    with engine.connect() as conn:
+        for chunk in pd.read_sql(text(q), conn, params=params, chunksize=SYNC_CHUNK_ROWS):
+            if chunk.empty:
+                continue
+            chunk["datetime_utc"] = pd.to_datetime(chunk["datetime_utc"], utc=True)
+            for c in SCHEMA.names[1:]:
+                chunk[c] = pd.to_numeric(chunk[c], errors="coerce").astype("float64")
+            days = chunk["datetime_utc"].dt.strftime("%Y-%m-%d")
+            for day, delta in chunk.groupby(days):
+                _write_day(store_dir, day, delta.drop(columns="updated_at"))
+            fetched += len(chunk)
+            newest = pd.Timestamp(chunk["updated_at"].max())
+            mark = newest if mark is None else max(mark, newest)
+            _save_state(store_dir, mark)
+    if fetched:
+        print(f"🗂️ Feature store: {fetched} filas sincronizadas hasta {mark}")
+    return fetched
+
+
+def _filter(start=None, end=None, bbox=None):
+    expr = None
+
+    def both(e):
+        return e if expr is None else expr & e
+
+    if start is not None:
+        start = pd.Timestamp(start)
+        start = start.tz_localize("UTC") if start.tzinfo is None else start.tz_convert("UTC")
+        expr = both((ds.field("day") >= start.strftime("%Y-%m-%d")) & (ds.field("datetime_utc") >= start))
+    if end is not None:
+        end = pd.Timestamp(end)
+        end = end.tz_localize("UTC") if end.tzinfo is None else end.tz_convert("UTC")
+        expr = both((ds.field("day") <= end.strftime("%Y-%m-%d")) & (ds.field("datetime_utc") <= end))
+    if bbox:
+        lat_min, lat_max, lon_min, lon_max = bbox
+        expr = both((ds.field("lat") >= lat_min) & (ds.field("lat") <= lat_max)
+                    & (ds.field("lon") >= lon_min) & (ds.field("lon") <= lon_max))
+    return expr
+
+
+def read(columns=None, start=None, end=None, bbox=None, store_dir=STORE_DIR):
+    """
+    DataFrame con `columns` (por defecto todas) de las filas en [start, end] y
+    dentro de bbox (lat_min, lat_max, lon_min, lon_max). Vacío si no hay snapshot.
+    """
+    columns = columns or SCHEMA.names
+    if not os.path.isdir(store_dir) or not any(n.startswith("day=") for n in os.listdir(store_dir)):
+        return pd.DataFrame(columns=columns)
+    dataset = ds.dataset(
+        os.path.abspath(store_dir), format="parquet",
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+        partitioning=ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive"),
+        schema=SCHEMA.append(pa.field("day", pa.string())),
+        exclude_invalid_files=True,
+    )
+    table = dataset.to_table(columns=[c for c in columns if c in SCHEMA.names],
+                             filter=_filter(start, end, bbox))
+    return table.to_pandas()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser()
+    p.add_argument("--full", action="store_true", help="reconstruye el snapshot completo")
+    args = p.parse_args()
+    n = sync(full=args.full)
+    print(f"✅ Feature store al día ({n} filas traídas, hasta {load_state()})")
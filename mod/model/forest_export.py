@@ -0,0 +1,233 @@
+"""
+forest_export.py - RandomForest aplanado en arrays NumPy que se abren con mmap.
+
+El .joblib guarda un objeto pickle por árbol: cargarlo es lento y cada worker
+termina con su propia copia del bosque. export_forest() concatena todos los
+árboles en arrays contiguos sin comprimir:
+
+    models/<target>_rf.flat/
+        feature.npy      intp    variable de cada nodo (0 en hojas)
+        threshold.npy    float64 umbral (x <= umbral -> izquierda)
+        children.npy     intp    [izquierdo, derecho] por nodo, índices globales
+                                 (una hoja apunta a sí misma)
+        missing_left.npy bool    NaN va a la izquierda
+        value.npy        float64 valor del nodo (el de la hoja es la predicción)
+        roots.npy        intp    nodo raíz de cada árbol
+        meta.json        features, profundidad máxima, mtime del .joblib de origen
+
+FlatForest los abre con np.load(mmap_mode="r"): la carga no lee el bosque y
+todos los procesos comparten las mismas páginas del page cache. predict()
+recorre todos los árboles a la vez por niveles y suma árbol por árbol en el
+mismo orden que sklearn con n_jobs=1, así que el resultado es idéntico bit a
+bit (con n_jobs>1 sklearn suma en el orden en que terminan los hilos).
+
+Uso:
+    python forest_export.py [pm25 no2 ...]          exporta los .joblib de models/
+    python forest_export.py pm25 --bench [--rows N]  compara carga, RSS y predicción
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+
+MODEL_DIR = os.getenv("MODEL_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+FLAT_ARRAYS = ["feature", "threshold", "children", "missing_left", "value", "roots"]
+PREDICT_BLOCK = 8192      # filas por bloque: acota los arrays (árboles x filas) del recorrido
+
+
+def flat_path(target, model_dir=MODEL_DIR):
+    return os.path.join(model_dir, f"{target}_rf.flat")
+
+
+def export_forest(model, features, path, source_mtime=None):
+    """Escribe el bosque `model` (RandomForestRegressor ajustado) en el directorio `path`."""
+    trees = [est.tree_ for est in model.estimators_]
+    if any(t.n_outputs != 1 for t in trees):
+        raise ValueError("Sólo se exportan bosques de regresión con un target")
+    sizes = np.array([t.node_count for t in trees])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    arrays = {k: [] for k in FLAT_ARRAYS if k != "roots"}
+    for t, off in zip(trees, offsets):
+        own = np.arange(t.node_count) + off
+        leaf = t.children_left == -1
+        arrays["feature"].append(np.where(leaf, 0, t.feature))
+        arrays["threshold"].append(np.where(leaf, 0.0, t.threshold))
+        arrays["children"].append(np.column_stack([np.where(leaf, own, t.children_left + off),
+                                                   np.where(leaf, own, t.children_right + off)]))
+        missing = getattr(t, "missing_go_to_left", None)
+        arrays["missing_left"].append(np.zeros(t.node_count, bool) if missing is None else missing.astype(bool))
+        arrays["value"].append(t.value[:, 0, 0])
+    # índices en intp: np.take / fancy indexing no tienen que convertirlos en cada nivel
+    dtypes = {"feature": np.intp, "threshold": np.float64, "children": np.intp,
+              "missing_left": np.bool_, "value": np.float64}
+
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, parts in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(np.concatenate(parts), dtype=dtypes[name]))
+    np.save(os.path.join(tmp, "roots.npy"), offsets.astype(np.intp))
+    meta = {"features": list(features), "n_trees": len(trees), "n_nodes": int(sizes.sum()),
+            "max_depth": int(max(t.max_depth for t in trees)), "n_features": int(model.n_features_in_),
+            "source_mtime": source_mtime}
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    # el directorio viejo se reemplaza entero; los procesos que lo tengan
+    # mapeado siguen leyendo sus archivos (ya desvinculados) sin problema
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+
+class FlatForest:
+    """Bosque exportado por export_forest, abierto con mmap. Interfaz mínima de sklearn: predict(X)."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        for name in FLAT_ARRAYS:
+            # np.asarray quita la subclase memmap (su __getitem__ es lento); sigue mapeado
+            setattr(self, name, np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")))
+        self.children = self.children.reshape(-1)
+        self.features = self.meta["features"]
+        self.n_features_in_ = self.meta["n_features"]
+
+    def _predict_block(self, X):
+        # Todos los árboles x todas las filas bajan un nivel por iteración.
+        # X llega en float32 como en sklearn; se compara contra el umbral en float64.
+        n = len(X)
+        xt = X.T.astype(np.float64).ravel()          # columna f de la fila i en f * n + i
+        rows = np.arange(n)
+        has_nan = np.isnan(xt).any()
+        nodes = np.repeat(self.roots[:, None], n, axis=1)
+        for _ in range(self.meta["max_depth"]):
+            x = xt[self.feature[nodes] * n + rows]
+            go_right = ~(x <= self.threshold[nodes])
+            if has_nan:
+                go_right &= ~(np.isnan(x) & self.missing_left[nodes])
+            nodes = self.children[2 * nodes + go_right]
+        values = self.value[nodes]
+        out = np.zeros(len(X), dtype=np.float64)
+        for tree_values in values:       # mismo orden de suma que sklearn
+            out += tree_values
+        out /= len(values)
+        return out
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X debe tener forma (n, {self.n_features_in_})")
+        out = np.empty(len(X), dtype=np.float64)
+        for i in range(0, len(X), PREDICT_BLOCK):
+            out[i:i + PREDICT_BLOCK] = self._predict_block(X[i:i + PREDICT_BLOCK])
+        return out
+
+
+def load_flat(target, model_dir=MODEL_DIR, source_mtime=None):
+    """FlatForest de `target` o None si no existe o quedó viejo respecto del .joblib."""
+    path = flat_path(target, model_dir)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    forest = FlatForest(path)
+    if source_mtime is not None and forest.meta.get("source_mtime") != source_mtime:
+        return None
+    return forest
+
+
+def export_target(target, model_dir=MODEL_DIR):
+    import joblib
+
+    src = os.path.join(model_dir, f"{target}_rf.joblib")
+    obj = joblib.load(src)
+    path = export_forest(obj["model"], obj["features"], flat_path(target, model_dir), os.path.getmtime(src))
+    size = sum(os.path.getsize(os.path.join(path, n)) for n in os.listdir(path))
+    print(f"✅ {src} -> {path} ({size / 1e6:.1f} MB sin comprimir, {os.path.getsize(src) / 1e6:.1f} MB el joblib)")
+    return path
+
+# ------------------ Benchmark ------------------
+
+_BENCH_CHILD = """
+import json, os, sys, time
+import numpy as np
+sys.path.insert(0, {here!r})
+kind, target, model_dir, rows, out = sys.argv[1:6]
+
+def mem():
+    # kB; Anonymous = memoria privada del proceso, Rss incluye páginas de archivos mapeados (compartibles)
+    with open("/proc/self/smaps_rollup") as f:
+        vals = dict(line.split()[:2] for line in f if line.split()[0] in ("Rss:", "Anonymous:"))
+    return {{k.rstrip(":"): int(v) / 1024 for k, v in vals.items()}}
+
+m0, t0 = mem(), time.perf_counter()
+if kind == "joblib":
+    import joblib, sklearn.ensemble
+else:
+    from forest_export import FlatForest, flat_path
+m1, t1 = mem(), time.perf_counter()
+if kind == "joblib":
+    model = joblib.load(os.path.join(model_dir, target + "_rf.joblib"))["model"]
+    model.set_params(n_jobs=1)
+else:
+    model = FlatForest(flat_path(target, model_dir))
+m2, t2 = mem(), time.perf_counter()
+X = (np.random.default_rng(0).normal(size=(int(rows), model.n_features_in_)) * 10).astype(np.float32)
+pred = model.predict(X)
+t3 = time.perf_counter()
+np.save(out, pred)
+print(json.dumps({{"import_s": t1 - t0, "load_s": t2 - t1, "predict_s": t3 - t2,
+                  "import_mb": m1["Anonymous"] - m0["Anonymous"], "model_mb": m2["Anonymous"] - m1["Anonymous"],
+                  "model_rss_mb": m2["Rss"] - m1["Rss"]}}))
+"""
+
+
+def bench(target, model_dir=MODEL_DIR, rows=20000):
+    """
+    Carga y predice en procesos nuevos con el .joblib y con el bosque plano:
+    tiempo de import/carga/predicción, memoria privada (Anonymous) y si las
+    predicciones son idénticas bit a bit.
+    """
+    import tempfile
+
+    code = _BENCH_CHILD.format(here=os.path.dirname(os.path.abspath(__file__)))
+    results, preds = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in ("joblib", "flat"):
+            out = os.path.join(tmp, kind + ".npy")
+            proc = subprocess.run([sys.executable, "-W", "ignore", "-c", code, kind, target, model_dir, str(rows), out],
+                                  capture_output=True, text=True, check=True)
+            results[kind] = json.loads(proc.stdout.strip().splitlines()[-1])
+            preds[kind] = np.load(out)
+    for kind, r in results.items():
+        print(f"⏱️ {kind:6s} import={r['import_s'] * 1000:7.1f} ms (+{r['import_mb']:.1f} MB)  "
+              f"carga={r['load_s'] * 1000:7.1f} ms (+{r['model_mb']:.1f} MB privados, "
+              f"RSS +{r['model_rss_mb']:.1f} MB)  predict({rows})={r['predict_s'] * 1000:7.1f} ms")
+    same = np.array_equal(preds["joblib"], preds["flat"])
+    print("✅ Predicciones idénticas bit a bit" if same else
+          f"❌ Difieren (máx {np.abs(preds['joblib'] - preds['flat']).max():.3g})")
+    return results, same
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("targets", nargs="*", help="por defecto, todos los *_rf.joblib de --model-dir")
+    p.add_argument("--model-dir", default=MODEL_DIR)
+    p.add_argument("--bench", action="store_true", help="mide carga/RSS/predicción joblib vs. plano")
+    p.add_argument("--rows", type=int, default=20000)
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    targets = args.targets or sorted(n[:-len("_rf.joblib")] for n in os.listdir(args.model_dir)
+                                     if n.endswith("_rf.joblib"))
+    for target in targets:
+        export_target(target, args.model_dir)
+        if args.bench:
+            bench(target, args.model_dir, args.rows)
@@ -8,25 +8,81 @@ model.py - Versión robusta y conectada a múltiples bases PostgreSQL
 
 import os
 import argparse
+import csv
+import io
+import json
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 import math
 import joblib
 import numpy as np
 import pandas as pd
+from scipy.interpolate import LinearNDInterpolator, NearestNDInterpolator
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import ParameterGrid, TimeSeriesSplit, train_test_split
 from sklearn.metrics import mean_squared_error, r2_score
 from sqlalchemy import text
 from config_db import air_quality_engine, predictions_engine  # tu archivo config_db.py
+from forest_export import export_forest, flat_path, load_flat
 
-MODEL_DIR = "models"
+# junto a este archivo (no relativo al cwd): app.py lo importa desde la raíz del repo
+MODEL_DIR = os.getenv("MODEL_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
 os.makedirs(MODEL_DIR, exist_ok=True)
 
+WEATHER_GRID_RES = 0.5                    # igual que WEATHER_GRID_RES en etl_air_quality.py
+WEATHER_TOLERANCE = pd.Timedelta("3h")    # igual que WEATHER_TOLERANCE en etl_air_quality.py
+WEATHER_COLS = ["temp", "humidity", "wind_speed", "wind_dir", "pressure"]
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "4"))   # modelos en memoria a la vez
+MODEL_VERSION = "v1.0"
+# Valores por defecto de las features cuando el caller no las manda (los de predict_for)
+DEFAULT_FEATURES = {"temp": 25, "wind_speed": 2, "no2": 10, "o3": 15,
+                    "humidity": 70, "sat_no2_trop": 5e-5}   # sat: mol/m², columna urbana típica
+
+CITY_BBOX = (4.45, 4.85, -74.25, -73.95)   # Bogotá: lat_min, lat_max, lon_min, lon_max
+GRID_RES = 0.002                          # grados (~220 m); el bbox de Bogotá da ~200x150 puntos
+GRID_CHUNK = 20000                        # puntos por model.predict
+GRID_DIR = os.path.join(MODEL_DIR, "grids")
+GRID_MARGIN = 0.5                         # grados extra alrededor del bbox para interpolar bordes
+STATION_WINDOW = pd.Timedelta("6h")       # antigüedad máxima de la última observación por estación
+SAT_GRID_RES = 0.05                       # igual que SAT_GRID_RES en etl_air_quality.py
+SAT_WINDOW = pd.Timedelta("24h")
+STATION_COLS = ["pm25", "pm10", "no2", "o3"]
+
+TRAIN_TARGETS = ["pm25", "no2", "o3"]
+CV_SPLITS = 3
+CV_CACHE_DIR = os.path.join(MODEL_DIR, "cv_cache")
+PARAM_GRID = {
+    "n_estimators": [200],
+    "max_depth": [8, 12, None],
+    "min_samples_leaf": [1, 5],
+}
+
+USE_FEATURE_STORE = os.getenv("USE_FEATURE_STORE", "1") != "0"   # snapshot Parquet de model_features
+
 # ------------------ Cargar datos ------------------
 
-def fetch_model_features(start_dt=None, end_dt=None, bbox=None, limit=None):
-    """Carga filas desde model_features usando SQLAlchemy (sin warnings)."""
-    q = "SELECT * FROM model_features"
+def fetch_model_features(start_dt=None, end_dt=None, bbox=None, limit=None, use_store=USE_FEATURE_STORE):
+    """
+    Carga filas de model_features. Con el feature store (Parquet) sólo se
+    pide a la DB el delta desde el último snapshot y se lee del disco; si
+    falla (sin pyarrow, sin updated_at, ...) se consulta la tabla directo.
+    """
+    if use_store:
+        try:
+            import feature_store
+            feature_store.sync()
+            df = feature_store.read(start=start_dt, end=end_dt, bbox=bbox)
+            if limit:
+                df = df.head(int(limit))
+            print(f"📊 Se cargaron {len(df)} filas desde el feature store")
+            return df
+        except Exception as e:
+            print(f"⚠️ Feature store no disponible ({e}); se lee model_features de la DB.")
+
+    # sat_no2_trop se aplana de other_features, igual que en el feature store
+    q = "SELECT *, (other_features->>'sat_no2_trop')::double precision AS sat_no2_trop FROM model_features"
     clauses = []
     params = {}
 
@@ -53,12 +109,59 @@ def fetch_model_features(start_dt=None, end_dt=None, bbox=None, limit=None):
     print(f"📊 Se cargaron {len(df)} filas desde model_features")
     return df
 
+def fetch_weather_hourly(start_dt=None, end_dt=None, res=WEATHER_GRID_RES):
+    """Carga weather_hourly (clima remuestreado por hora y celda) para el as-of join en memoria."""
+    q = "SELECT cell_i, cell_j, hour, " + ", ".join(WEATHER_COLS) + " FROM weather_hourly WHERE resolution = :res"
+    params = {"res": res}
+    if start_dt:
+        # margen de la tolerancia para que la primera fila también encuentre clima
+        q += " AND hour >= :start_dt"
+        params["start_dt"] = pd.Timestamp(start_dt) - WEATHER_TOLERANCE
+    if end_dt:
+        q += " AND hour <= :end_dt"
+        params["end_dt"] = pd.Timestamp(end_dt)
+
+    with air_quality_engine.connect() as conn:
+        return pd.read_sql(text(q + " ORDER BY hour"), conn, params=params)
+
+
+def merge_weather_asof(df, weather, res=WEATHER_GRID_RES, tolerance=WEATHER_TOLERANCE):
+    """
+    As-of join en memoria (mismo criterio que build_model_features en SQL):
+    para cada fila, la última hora de clima de su celda dentro de `tolerance`.
+    Sólo rellena valores de clima que vengan vacíos; conserva el orden de df.
+    """
+    if df.empty or weather.empty:
+        return df
+    left = df.assign(
+        cell_i=np.floor(df["lat"] / res).astype("int64"),
+        cell_j=np.floor(df["lon"] / res).astype("int64"),
+        _row=np.arange(len(df)),
+        datetime_utc=pd.to_datetime(df["datetime_utc"], utc=True),
+    ).sort_values("datetime_utc")
+    right = weather.rename(columns={c: f"{c}_asof" for c in WEATHER_COLS}).assign(
+        hour=lambda w: pd.to_datetime(w["hour"], utc=True),
+        cell_i=lambda w: w["cell_i"].astype("int64"),
+        cell_j=lambda w: w["cell_j"].astype("int64"),
+    ).sort_values("hour")
+
+    merged = pd.merge_asof(left, right, left_on="datetime_utc", right_on="hour",
+                           by=["cell_i", "cell_j"], direction="backward", tolerance=tolerance)
+    for c in WEATHER_COLS:
+        merged[c] = merged[c].fillna(merged[f"{c}_asof"]) if c in merged else merged[f"{c}_asof"]
+    extra = ["cell_i", "cell_j", "hour", "_row"] + [f"{c}_asof" for c in WEATHER_COLS]
+    return merged.sort_values("_row").drop(columns=extra).reset_index(drop=True)
+
 # ------------------ Preparación ------------------
 
 def prepare_X_y(df, target="pm25"):
-    """Prepara X e y asegurando que haya suficientes filas válidas."""
-    candidate_cols = ["temp", "wind_speed", "no2", "o3", "pm25", "lat", "lon"]
-    cols = [c for c in candidate_cols if c in df.columns]
+    """
+    Prepara X e y asegurando que haya suficientes filas válidas. Las columnas
+    candidatas sin ningún dato (p.ej. sat_no2_trop sin pasadas satelitales)
+    no entran como features.
+    """
+    candidate_cols = ["temp", "humidity", "wind_speed", "no2", "o3", "pm25", "sat_no2_trop", "lat", "lon"]
+    cols = [c for c in candidate_cols if c in df.columns and (c == target or df[c].notna().any())]
 
     if target not in cols:
         if target in df.columns:
@@ -80,13 +183,28 @@ def prepare_X_y(df, target="pm25"):
 
 # ------------------ Entrenamiento ------------------
 
-def train_model_for(target='pm25', days_history=180, bbox=None, test_size=0.2):
-    """Entrena un modelo RandomForest y lo guarda."""
+def load_training_data(days_history=180, bbox=None, label=None):
+    """model_features de los últimos `days_history` días con el clima completado por as-of join."""
     end_dt = datetime.now(timezone.utc)
     start_dt = end_dt - timedelta(days=days_history)
 
-    print(f"🔎 Cargando datos entre {start_dt.isoformat()} y {end_dt.isoformat()} (target={target})")
+    print(f"🔎 Cargando datos entre {start_dt.isoformat()} y {end_dt.isoformat()}"
+          + (f" (target={label})" if label else ""))
     df = fetch_model_features(start_dt=start_dt.isoformat(), end_dt=end_dt.isoformat(), bbox=bbox)
+    if df.empty:
+        return df
+
+    # Completar clima faltante con el as-of join por celda/hora
+    try:
+        df = merge_weather_asof(df, fetch_weather_hourly(start_dt, end_dt))
+    except Exception as e:
+        print(f"⚠️ Sin weather_hourly para el as-of join ({e}); se entrena con el clima de model_features.")
+    return df
+
+
+def train_model_for(target='pm25', days_history=180, bbox=None, test_size=0.2):
+    """Entrena un modelo RandomForest y lo guarda."""
+    df = load_training_data(days_history, bbox, label=target)
     if df.empty:
         print("⚠️ No se encontraron datos en model_features. Entrenamiento cancelado.")
         return None
@@ -105,7 +223,7 @@ def train_model_for(target='pm25', days_history=180, bbox=None, test_size=0.2):
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=42)
 
     print(f"📦 Entrenando RandomForest ({len(X_train)} train / {len(X_test)} test)...")
-    model = RandomForestRegressor(n_estimators=200, max_depth=12, random_state=42)
+    model = RandomForestRegressor(n_estimators=200, max_depth=12, random_state=42, n_jobs=-1)
     model.fit(X_train, y_train)
 
     y_pred = model.predict(X_test)
@@ -114,52 +232,427 @@ def train_model_for(target='pm25', days_history=180, bbox=None, test_size=0.2):
 
     model_path = os.path.join(MODEL_DIR, f"{target}_rf.joblib")
     joblib.dump({"model": model, "features": feature_names}, model_path)
+    export_forest(model, feature_names, flat_path(target, MODEL_DIR), os.path.getmtime(model_path))
 
     print(f"✅ Modelo guardado en {model_path}")
     print(f"📊 Métricas: RMSE={rmse:.4f}, R2={r2:.4f}")
 
     return {"rmse": rmse, "r2": r2, "features": feature_names}
 
+# ------------------ Búsqueda de hiperparámetros ------------------
+
+def _fold_scores(snapshot, params, n_splits, fold, X, y):
+    """
+    Ajusta y evalúa un fold de TimeSeriesSplit. Se memoiza en disco
+    (joblib.Memory) por (snapshot, params, n_splits, fold): X e y se ignoran
+    en la clave porque `snapshot` ya es el hash de los datos.
+    """
+    train_idx, test_idx = list(TimeSeriesSplit(n_splits=n_splits).split(X))[fold]
+    model = RandomForestRegressor(random_state=42, n_jobs=-1, **params)
+    model.fit(X.iloc[train_idx], y.iloc[train_idx])
+    y_pred = model.predict(X.iloc[test_idx])
+    return {"rmse": math.sqrt(mean_squared_error(y.iloc[test_idx], y_pred)),
+            "r2": r2_score(y.iloc[test_idx], y_pred)}
+
+
+_memory = joblib.Memory(CV_CACHE_DIR, verbose=0)
+_cached_fold_scores = _memory.cache(_fold_scores, ignore=["X", "y"])
+
+
+def cv_search(X, y, param_grid=PARAM_GRID, n_splits=CV_SPLITS):
+    """
+    Búsqueda en grilla con validación temporal (TimeSeriesSplit: cada fold
+    entrena con el pasado y evalúa con lo siguiente). X e y deben venir en
+    orden temporal. Devuelve (mejores params, métricas medias, resultados por config).
+    """
+    snapshot = joblib.hash((X, y))
+    results = []
+    cached = 0
+    for params in ParameterGrid(param_grid):
+        folds = []
+        for fold in range(n_splits):
+            args = (snapshot, params, n_splits, fold, X, y)
+            cached += _cached_fold_scores.check_call_in_cache(*args)
+            folds.append(_cached_fold_scores(*args))
+        results.append({"params": params,
+                        "rmse": float(np.mean([f["rmse"] for f in folds])),
+                        "r2": float(np.mean([f["r2"] for f in folds]))})
+    print(f"  → {cached}/{len(results) * n_splits} folds salieron de la caché")
+    best = min(results, key=lambda r: r["rmse"])
+    return best["params"], {"rmse": best["rmse"], "r2": best["r2"]}, results
+
+
+def train_targets(targets=TRAIN_TARGETS, days_history=180, bbox=None, param_grid=PARAM_GRID, n_splits=CV_SPLITS):
+    """
+    Entrena varios targets con una sola carga de model_features: para cada
+    uno, búsqueda con validación temporal (folds memoizados en CV_CACHE_DIR)
+    y ajuste final con los mejores parámetros sobre todos los datos.
+    Devuelve {target: resumen o None}.
+    """
+    df = load_training_data(days_history, bbox)
+    if df.empty:
+        print("⚠️ No se encontraron datos en model_features. Entrenamiento cancelado.")
+        return {t: None for t in targets}
+    df = df.sort_values("datetime_utc").reset_index(drop=True)
+
+    summary = {}
+    for target in targets:
+        t0 = time.perf_counter()
+        try:
+            X, y, feature_names = prepare_X_y(df, target=target)
+        except (RuntimeError, ValueError) as e:
+            print(f"⚠️ {target}: {e}. Se omite.")
+            summary[target] = None
+            continue
+        if len(X) < 2 * (n_splits + 1):
+            print(f"⚠️ {target}: muy pocos datos ({len(X)} filas) para {n_splits} folds. Se omite.")
+            summary[target] = None
+            continue
+        X, y = X.reset_index(drop=True), y.reset_index(drop=True)
+
+        print(f"📦 {target}: búsqueda sobre {len(ParameterGrid(param_grid))} configuraciones x {n_splits} folds "
+              f"({len(X)} filas)...")
+        params, cv, results = cv_search(X, y, param_grid, n_splits)
+
+        model = RandomForestRegressor(random_state=42, n_jobs=-1, **params)
+        model.fit(X, y)
+        model_path = os.path.join(MODEL_DIR, f"{target}_rf.joblib")
+        joblib.dump({"model": model, "features": feature_names, "params": params, "cv": cv}, model_path)
+        export_forest(model, feature_names, flat_path(target, MODEL_DIR), os.path.getmtime(model_path))
+
+        print(f"✅ {target}: {params} -> CV RMSE={cv['rmse']:.4f}, R2={cv['r2']:.4f} "
+              f"({time.perf_counter() - t0:.1f}s, guardado en {model_path})")
+        summary[target] = {"params": params, **cv, "features": feature_names, "search": results}
+    return summary
+
 # ------------------ Cargar modelo ------------------
 
+class ModelRegistry:
+    """
+    Modelos cargados en memoria, por target. Se vuelve a leer del disco sólo
+    si cambió el mtime del .joblib (p.ej. tras reentrenar); como mucho
+    `max_models` a la vez, se descarta el usado hace más tiempo.
+
+    Si hay un bosque plano exportado del mismo .joblib (forest_export.py) se
+    abre ese con mmap en vez de deserializar el pickle.
+    """
+
+    def __init__(self, max_models=MODEL_CACHE_SIZE):
+        self.max_models = max_models
+        self._models = OrderedDict()     # target -> (mtime, model, features)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, target):
+        path = os.path.join(MODEL_DIR, f"{target}_rf.joblib")
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            raise FileNotFoundError(f"No existe el modelo {path}")
+        with self._lock:
+            cached = self._models.get(target)
+            if cached and cached[0] == mtime:
+                self._models.move_to_end(target)
+                self.hits += 1
+                return cached[1], cached[2]
+        flat = load_flat(target, MODEL_DIR, source_mtime=mtime)
+        if flat is not None:
+            model, features = flat, flat.features
+        else:
+            obj = joblib.load(path)
+            model, features = obj['model'], obj['features']
+        with self._lock:
+            self.loads += 1
+            self._models[target] = (mtime, model, features)
+            self._models.move_to_end(target)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+        return model, features
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+MODELS = ModelRegistry()
+
+
 def load_model(target='pm25'):
-    path = os.path.join(MODEL_DIR, f"{target}_rf.joblib")
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"No existe el modelo {path}")
-    obj = joblib.load(path)
-    return obj['model'], obj['features']
+    return MODELS.get(target)
 
 # ------------------ Predicción ------------------
 
-def predict_for(lat, lon, dt_iso, target='pm25'):
+def _copy_rows(table, conn, keys, data_iter):
+    """method= de DataFrame.to_sql: inserta con COPY en vez de un INSERT por fila."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(data_iter)
+    buf.seek(0)
+    name = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+    columns = ", ".join(f'"{k}"' for k in keys)
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(f"COPY {name} ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def predict_batch(lat, lon, features=None, target='pm25', save=True, version=MODEL_VERSION):
+    """
+    Predice `target` para muchos puntos con un solo model.predict.
+
+    - lat, lon: arrays (o listas) del mismo largo. El modelo no usa features
+      temporales: el instante sólo importa al armar `features` (grid_features).
+    - features: dict o DataFrame con columnas de features por punto; las que
+      falten toman DEFAULT_FEATURES (o 0.0).
+    - save=True guarda todas las predicciones en `predictions` con COPY, en
+      una sola transacción.
+    Devuelve un array NumPy con las predicciones.
+    """
     model, feature_names = load_model(target)
-    X_row = pd.DataFrame([{"lat": lat, "lon": lon, "temp": 25, "wind_speed": 2, "no2": 10, "o3": 15}])
-    X_row = X_row.reindex(columns=feature_names, fill_value=0.0)
-    pred = model.predict(X_row)
-    val = float(pred[0])
-
-    # Guardar en base predictions
-    df_pred = pd.DataFrame([{
-        "timestamp": pd.Timestamp.now(),
-        "lat": lat,
-        "lon": lon,
-        f"{target}_pred": val,
-        "modelo_version": "v1.0"
-    }])
-    df_pred.to_sql("predictions", predictions_engine, if_exists="append", index=False)
+    lat = np.asarray(lat, dtype=np.float64).ravel()
+    lon = np.asarray(lon, dtype=np.float64).ravel()
+    if lat.shape != lon.shape:
+        raise ValueError("lat y lon deben tener el mismo largo")
+    n = len(lat)
+
+    given = pd.DataFrame(features) if features is not None and len(features) else pd.DataFrame(index=range(n))
+    if len(given) != n:
+        raise ValueError(f"features tiene {len(given)} filas y hay {n} puntos")
+    X = pd.DataFrame(index=range(n))
+    for c in feature_names:
+        if c == "lat":
+            X[c] = lat
+        elif c == "lon":
+            X[c] = lon
+        elif c in given:
+            X[c] = np.asarray(given[c], dtype=np.float64)
+        else:
+            X[c] = float(DEFAULT_FEATURES.get(c, 0.0))
+    pred = model.predict(X)
+
+    if save and n:
+        df_pred = pd.DataFrame({
+            "timestamp": pd.Timestamp.now(),
+            "lat": lat,
+            "lon": lon,
+            f"{target}_pred": pred,
+            "modelo_version": version,
+        })
+        with predictions_engine.begin() as conn:
+            df_pred.to_sql("predictions", conn, if_exists="append", index=False, method=_copy_rows)
+    return pred
+
+
+def predict_for(lat, lon, dt_iso, target='pm25'):
+    # dt_iso se conserva por compatibilidad de la firma; el modelo no usa el instante
+    val = float(predict_batch([lat], [lon], target=target)[0])
     print(f"💾 Predicción guardada en la base: {val:.4f}")
     return val
 
+# ------------------ Pronóstico en grilla ------------------
+
+def _latest_weather(at, bbox, cols, res=WEATHER_GRID_RES):
+    """Última hora de weather_hourly por celda (dentro de WEATHER_TOLERANCE), con el centro de la celda."""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    q = f"""
+        SELECT DISTINCT ON (cell_i, cell_j)
+               (cell_i + 0.5) * :res AS lat, (cell_j + 0.5) * :res AS lon, {", ".join(cols)}
+        FROM weather_hourly
+        WHERE resolution = :res AND hour <= :at AND hour > :since
+          AND cell_i BETWEEN floor(:lat_min / :res) AND floor(:lat_max / :res)
+          AND cell_j BETWEEN floor(:lon_min / :res) AND floor(:lon_max / :res)
+        ORDER BY cell_i, cell_j, hour DESC
+    """
+    params = {"res": res, "at": at, "since": at - WEATHER_TOLERANCE, "lat_min": lat_min - GRID_MARGIN,
+              "lat_max": lat_max + GRID_MARGIN, "lon_min": lon_min - GRID_MARGIN, "lon_max": lon_max + GRID_MARGIN}
+    with air_quality_engine.connect() as conn:
+        return pd.read_sql(text(q), conn, params=params)
+
+
+def _latest_stations(at, bbox, cols):
+    """Último valor no nulo de cada columna por punto de model_features dentro de STATION_WINDOW."""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    latest = ", ".join(
+        f"(array_agg({c} ORDER BY datetime_utc DESC) FILTER (WHERE {c} IS NOT NULL))[1] AS {c}" for c in cols)
+    q = f"""
+        SELECT lat, lon, {latest}
+        FROM model_features
+        WHERE datetime_utc <= :at AND datetime_utc > :since
+          AND lat BETWEEN :lat_min AND :lat_max AND lon BETWEEN :lon_min AND :lon_max
+        GROUP BY lat, lon
+    """
+    params = {"at": at, "since": at - STATION_WINDOW, "lat_min": lat_min - GRID_MARGIN,
+              "lat_max": lat_max + GRID_MARGIN, "lon_min": lon_min - GRID_MARGIN, "lon_max": lon_max + GRID_MARGIN}
+    with air_quality_engine.connect() as conn:
+        return pd.read_sql(text(q), conn, params=params)
+
+
+def _latest_satellite(at, bbox):
+    """Última pasada de NO₂ troposférico por celda de satellite_grid dentro de SAT_WINDOW."""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    q = """
+        SELECT DISTINCT ON (cell_i, cell_j) lat, lon, value_qa_mean AS sat_no2_trop
+        FROM satellite_grid
+        WHERE parameter = 'no2_tropospheric_column' AND resolution = :res
+          AND datetime_utc <= :at AND datetime_utc > :since
+          AND lat BETWEEN :lat_min AND :lat_max AND lon BETWEEN :lon_min AND :lon_max
+        ORDER BY cell_i, cell_j, datetime_utc DESC
+    """
+    params = {"res": SAT_GRID_RES, "at": at, "since": at - SAT_WINDOW, "lat_min": lat_min - GRID_MARGIN,
+              "lat_max": lat_max + GRID_MARGIN, "lon_min": lon_min - GRID_MARGIN, "lon_max": lon_max + GRID_MARGIN}
+    with air_quality_engine.connect() as conn:
+        return pd.read_sql(text(q), conn, params=params)
+
+
+def interpolate_points(points, values, lat, lon):
+    """
+    Interpola valores dispersos (points: N x 2 lat/lon) sobre los puntos
+    (lat, lon) de la grilla: lineal dentro del casco convexo y vecino más
+    cercano afuera (o si hay menos de 3 puntos). Devuelve None si no hay datos.
+    """
+    ok = np.isfinite(values)
+    points, values = points[ok], values[ok]
+    if len(values) == 0:
+        return None
+    if len(values) == 1:
+        return np.full(lat.shape, values[0], dtype=np.float64)
+    target = np.column_stack([lat, lon])
+    out = np.full(lat.shape, np.nan)
+    if len(values) >= 3:
+        try:
+            out = LinearNDInterpolator(points, values)(target)
+        except Exception:
+            pass   # puntos colineales: sólo vecino más cercano
+    missing = np.isnan(out)
+    if missing.any():
+        out[missing] = NearestNDInterpolator(points, values)(target[missing])
+    return out
+
+
+def grid_features(feature_names, lat, lon, at, bbox):
+    """
+    Features de la grilla a partir de lo último observado: clima de
+    weather_hourly, contaminantes de las estaciones (model_features) y
+    sat_no2_trop de satellite_grid. Sólo consulta las fuentes que el modelo
+    usa; lo que no tenga datos queda fuera (predict_batch usa DEFAULT_FEATURES).
+    Devuelve ({feature: array}, {feature: fuente}).
+    """
+    wanted = [c for c in feature_names if c not in ("lat", "lon")]
+    sources = [
+        ("weather_hourly", [c for c in wanted if c in WEATHER_COLS],
+         lambda cols: _latest_weather(at, bbox, cols)),
+        ("model_features", [c for c in wanted if c in STATION_COLS],
+         lambda cols: _latest_stations(at, bbox, cols)),
+        ("satellite_grid", [c for c in wanted if c == "sat_no2_trop"],
+         lambda cols: _latest_satellite(at, bbox)),
+    ]
+    feats, origin = {}, {}
+    for name, cols, load in sources:
+        if not cols:
+            continue
+        try:
+            obs = load(cols)
+        except Exception as e:
+            print(f"⚠️ Sin datos de {name} para la grilla ({e})")
+            continue
+        points = obs[["lat", "lon"]].to_numpy(dtype=np.float64)
+        for c in cols:
+            values = interpolate_points(points, obs[c].to_numpy(dtype=np.float64), lat, lon)
+            if values is not None:
+                feats[c], origin[c] = values, name
+    return feats, origin
+
+
+def ensure_forecast_table():
+    with predictions_engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS forecast_grids (
+                id             serial PRIMARY KEY,
+                created_at     timestamptz DEFAULT now(),
+                valid_at       timestamptz NOT NULL,
+                target         text NOT NULL,
+                lat_min        double precision, lat_max double precision,
+                lon_min        double precision, lon_max double precision,
+                res            double precision NOT NULL,
+                ny             integer NOT NULL,
+                nx             integer NOT NULL,
+                pred_min       double precision,
+                pred_mean      double precision,
+                pred_max       double precision,
+                pred_p95       double precision,
+                path           text NOT NULL,
+                modelo_version text,
+                features       jsonb
+            )
+        """))
+
+
+def predict_grid(bbox=CITY_BBOX, res=GRID_RES, target='pm25', at=None, chunk_size=GRID_CHUNK,
+                 out_dir=GRID_DIR, save=True):
+    """
+    Pronóstico de `target` en una malla lat/lon sobre `bbox` con paso `res`.
+    Las features salen de lo último observado (grid_features) y la malla se
+    predice en trozos de `chunk_size` puntos. Guarda un .npz comprimido
+    (pred float32 ny x nx, lats, lons) y una fila resumen en forecast_grids.
+    Devuelve (lats, lons, pred).
+    """
+    t0 = time.perf_counter()
+    at = pd.Timestamp(at or datetime.now(timezone.utc))
+    at = at.tz_localize("UTC") if at.tzinfo is None else at.tz_convert("UTC")
+    lat_min, lat_max, lon_min, lon_max = bbox
+    lats = np.arange(lat_min, lat_max + res / 2, res)
+    lons = np.arange(lon_min, lon_max + res / 2, res)
+    mesh_lat, mesh_lon = (a.ravel() for a in np.meshgrid(lats, lons, indexing="ij"))
+
+    _, feature_names = load_model(target)
+    feats, origin = grid_features(feature_names, mesh_lat, mesh_lon, at, bbox)
+    print(f"🗺️ Grilla {len(lats)}x{len(lons)} ({mesh_lat.size} puntos); features: "
+          + (", ".join(f"{c}<-{src}" for c, src in origin.items()) or "sólo valores por defecto"))
+
+    pred = np.empty(mesh_lat.size, dtype=np.float32)
+    for i in range(0, mesh_lat.size, chunk_size):
+        sl = slice(i, i + chunk_size)
+        pred[sl] = predict_batch(mesh_lat[sl], mesh_lon[sl], features={c: v[sl] for c, v in feats.items()},
+                                 target=target, save=False)
+    pred = pred.reshape(len(lats), len(lons))
+
+    if save:
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, f"{target}_grid_{at:%Y%m%dT%H%M}.npz")
+        np.savez_compressed(path, pred=pred, lats=lats, lons=lons)
+        ensure_forecast_table()
+        with predictions_engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO forecast_grids (valid_at, target, lat_min, lat_max, lon_min, lon_max, res, ny, nx,
+                                            pred_min, pred_mean, pred_max, pred_p95, path, modelo_version, features)
+                VALUES (:valid_at, :target, :lat_min, :lat_max, :lon_min, :lon_max, :res, :ny, :nx,
+                        :pmin, :pmean, :pmax, :p95, :path, :version, CAST(:features AS jsonb))
+            """), {"valid_at": at.to_pydatetime(), "target": target, "lat_min": lat_min, "lat_max": lat_max,
+                   "lon_min": lon_min, "lon_max": lon_max, "res": res, "ny": len(lats), "nx": len(lons),
+                   "pmin": float(pred.min()), "pmean": float(pred.mean()), "pmax": float(pred.max()),
+                   "p95": float(np.percentile(pred, 95)), "path": os.path.abspath(path),
+                   "version": MODEL_VERSION, "features": json.dumps(origin)})
+        print(f"💾 Grilla guardada en {path} ({os.path.getsize(path) / 1024:.0f} KB)")
+
+    print(f"✅ Grilla {target}: min={pred.min():.2f} media={pred.mean():.2f} max={pred.max():.2f} "
+          f"({time.perf_counter() - t0:.2f}s)")
+    return lats, lons, pred
+
 # ------------------ CLI ------------------
 
 def parse_args():
     p = argparse.ArgumentParser()
     p.add_argument('--train', action='store_true')
+    p.add_argument('--train-all', action='store_true',
+                   help='entrena --targets con búsqueda de hiperparámetros (validación temporal, folds cacheados)')
+    p.add_argument('--targets', nargs='+', default=TRAIN_TARGETS)
     p.add_argument('--predict', action='store_true')
     p.add_argument('--param', type=str, default='pm25')
     p.add_argument('--lat', type=float)
     p.add_argument('--lon', type=float)
     p.add_argument('--datetime', type=str)
+    p.add_argument('--grid', action='store_true', help='pronóstico en malla sobre --bbox')
+    p.add_argument('--bbox', type=float, nargs=4, metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'),
+                   default=CITY_BBOX)
+    p.add_argument('--res', type=float, default=GRID_RES, help='paso de la malla en grados')
     return p.parse_args()
 
 def main():
@@ -168,12 +661,17 @@ def main():
         res = train_model_for(target=args.param)
         if res:
             print("✅ Entrenamiento completado.")
+    if args.train_all:
+        res = train_targets(targets=args.targets)
+        print(f"✅ Entrenados {sum(r is not None for r in res.values())}/{len(res)} targets.")
     if args.predict:
         if args.lat is None or args.lon is None:
             raise ValueError("Faltan parámetros --lat y --lon")
         dt = args.datetime or datetime.now(timezone.utc).isoformat()
         val = predict_for(args.lat, args.lon, dt, target=args.param)
         print(f"Predicción {args.param} @ {args.lat},{args.lon} = {val:.4f}")
+    if args.grid:
+        predict_grid(bbox=tuple(args.bbox), res=args.res, target=args.param, at=args.datetime)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+"""
+update_events.py - Avisos de datos nuevos con LISTEN/NOTIFY de Postgres.
+
+El ETL llama notify_update() dentro de su transacción; Postgres sólo entrega
+el aviso si hay commit. El backend (app.py) los recibe con listen_updates() y
+empuja a los clientes suscritos (SSE) los cambios de las ciudades afectadas.
+Cada tipo corresponde a lo que lee un endpoint:
+
+- "measurements" (copy_measurements): estaciones -> /api/current y /api/history
+- "features" (build_model_features, refresh_weather_hourly,
+  insert_satellite_grid): entradas de grid_features -> /api/forecast
+
+Aviso: {"kind": "measurements" | "features", "bbox": [lat_min, lat_max, lon_min, lon_max], "until": ISO}
+"""
+
+import json
+import select
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+UPDATES_CHANNEL = "aq_updates"
+RECONNECT_DELAY = 5
+
+
+def notify_update(cur, kind, bbox, until=None):
+    """Encola el aviso en la transacción de `cur` (cursor psycopg2)."""
+    payload = {"kind": kind, "bbox": [float(v) for v in bbox],
+               "until": until.isoformat() if hasattr(until, "isoformat") else until}
+    cur.execute("SELECT pg_notify(%s, %s)", (UPDATES_CHANNEL, json.dumps(payload)))
+
+
+def _connect(engine):
+    # conexión propia (fuera del pool): queda tomada mientras se escucha
+    args, kwargs = engine.dialect.create_connect_args(engine.url)
+    conn = psycopg2.connect(*args, **kwargs)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {UPDATES_CHANNEL}")
+    return conn
+
+
+def listen_updates(on_batch, engines, stop=None, timeout=5.0):
+    """
+    Escucha UPDATES_CHANNEL en cada engine (p.ej. air_quality y predictions)
+    hasta que `stop` (threading.Event) se active. Los avisos que llegan juntos
+    se entregan en una sola llamada on_batch([aviso, ...]). Reconecta solo.
+    """
+    conns = {}
+    while not (stop and stop.is_set()):
+        try:
+            for engine in engines:
+                if engine not in conns:
+                    conns[engine] = _connect(engine)
+            ready, _, _ = select.select(list(conns.values()), [], [], timeout)
+            events = []
+            for conn in ready:
+                conn.poll()
+                while conn.notifies:
+                    note = conn.notifies.pop(0)
+                    try:
+                        events.append(json.loads(note.payload))
+                    except ValueError:
+                        print(f"⚠️ Aviso inválido en {UPDATES_CHANNEL}: {note.payload[:200]}")
+            if events:
+                on_batch(events)
+        except psycopg2.Error as e:
+            print(f"⚠️ LISTEN {UPDATES_CHANNEL} perdió la conexión ({e}); reintento en {RECONNECT_DELAY}s")
+            for conn in conns.values():
+                try:
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+            conns = {}
+            time.sleep(RECONNECT_DELAY)
+    for conn in conns.values():
+        conn.close()
@@ -0,0 +1,300 @@
+"""
+aggregates.py - Rollups horarios y diarios de measurements y satellite_grid.
+
+- measurements_hourly / measurements_daily: por estación, parámetro y bucket.
+- satellite_grid_hourly / satellite_grid_daily: por celda de grilla
+  (resolution, cell_i, cell_j), parámetro y bucket, sobre el valor medio de
+  cada pasada.
+
+Todas guardan n, mean, min, max y p95. Se mantienen:
+- incrementalmente (refresh_rollups): sólo se recalculan los buckets que
+  tienen filas con inserted_at en (since, until]; el watermark lo maneja
+  refresh_aggregates en etl_air_quality.py.
+- al compactar particiones viejas antes de borrarlas (partitions.py). Lo
+  compactado queda registrado en rollup_horizon: refresh_rollups no vuelve
+  a calcular esos buckets desde measurements (ya no tienen los datos crudos)
+  y las filas que lleguen tarde a ese rango se suman al rollup existente
+  cuando la retención compacta su partición (rollup_range(merge=True)).
+
+query_series elige el rollup más grueso que sirve para el paso pedido
+(p.ej. 6h sale de la tabla horaria, 7d de la diaria, 15min de measurements).
+"""
+
+from datetime import timedelta
+
+import pandas as pd
+
+ROLLUPS = {
+    # tabla -> unidad de date_trunc
+    "measurements_hourly": "hour",
+    "measurements_daily": "day",
+}
+
+GRID_ROLLUPS = {
+    "satellite_grid_hourly": "hour",
+    "satellite_grid_daily": "day",
+}
+
+UNIT_STEP = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+STAT_COLS = ["n", "mean", "min", "max", "p95"]
+
+ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        station_id integer NOT NULL,
+        parameter  text NOT NULL,
+        bucket     timestamptz NOT NULL,
+        n          integer NOT NULL,
+        mean       double precision,
+        min        double precision,
+        max        double precision,
+        p95        double precision,
+        PRIMARY KEY (station_id, parameter, bucket)
+    )
+"""
+
+GRID_ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        parameter  text NOT NULL,
+        resolution double precision NOT NULL,
+        cell_i     integer NOT NULL,
+        cell_j     integer NOT NULL,
+        bucket     timestamptz NOT NULL,
+        n          integer NOT NULL,
+        mean       double precision,
+        min        double precision,
+        max        double precision,
+        p95        double precision,
+        PRIMARY KEY (parameter, resolution, cell_i, cell_j, bucket)
+    )
+"""
+
+ROLLUP_HORIZON_DDL = """
+    CREATE TABLE IF NOT EXISTS rollup_horizon (
+        source          text PRIMARY KEY,
+        compacted_until timestamptz NOT NULL
+    )
+"""
+
+_STATS = """
+           count(*), avg({v}), min({v}), max({v}),
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY {v})
+"""
+
+_UPSERT = """
+    ON CONFLICT ({key}, bucket) DO UPDATE
+    SET n = EXCLUDED.n,
+        mean = EXCLUDED.mean,
+        min = EXCLUDED.min,
+        max = EXCLUDED.max,
+        p95 = EXCLUDED.p95
+"""
+
+# Suma un bucket nuevo al existente (p95: cota superior, como en query_series)
+_MERGE = """
+    ON CONFLICT ({key}, bucket) DO UPDATE
+    SET n = {table}.n + EXCLUDED.n,
+        mean = ({table}.mean * {table}.n + EXCLUDED.mean * EXCLUDED.n) / ({table}.n + EXCLUDED.n),
+        min = LEAST({table}.min, EXCLUDED.min),
+        max = GREATEST({table}.max, EXCLUDED.max),
+        p95 = GREATEST({table}.p95, EXCLUDED.p95)
+"""
+
+ROLLUP_SELECT = """
+    INSERT INTO {table} (station_id, parameter, bucket, n, mean, min, max, p95)
+    SELECT station_id, parameter, date_trunc('{unit}', datetime_utc, 'UTC'),
+""" + _STATS.format(v="value") + """
+    FROM measurements
+    WHERE datetime_utc >= %(start)s AND datetime_utc < %(end)s
+      AND station_id IS NOT NULL
+    GROUP BY 1, 2, 3
+"""
+
+# Recalcula completos los buckets que recibieron filas en (since, until].
+# El rango explícito sobre m.datetime_utc permite descartar particiones.
+REFRESH_SQL = """
+    WITH touched AS (
+        SELECT DISTINCT station_id, parameter, date_trunc('{unit}', datetime_utc, 'UTC') AS bucket
+        FROM measurements
+        WHERE inserted_at > %(since)s AND inserted_at <= %(until)s
+          AND station_id IS NOT NULL
+          -- lo ya compactado por la retención no se recalcula (ver rollup_horizon)
+          AND (%(horizon)s::timestamptz IS NULL OR datetime_utc >= %(horizon)s)
+    )
+    INSERT INTO {table} (station_id, parameter, bucket, n, mean, min, max, p95)
+    SELECT t.station_id, t.parameter, t.bucket,
+""" + _STATS.format(v="m.value") + """
+    FROM touched t
+    JOIN measurements m
+      ON m.station_id = t.station_id AND m.parameter = t.parameter
+     AND m.datetime_utc >= t.bucket AND m.datetime_utc < t.bucket + interval '1 {unit}'
+    WHERE m.datetime_utc >= (SELECT min(bucket) FROM touched)
+      AND m.datetime_utc < (SELECT max(bucket) FROM touched) + interval '1 {unit}'
+    GROUP BY 1, 2, 3
+""" + _UPSERT.format(key="station_id, parameter")
+
+GRID_REFRESH_SQL = """
+    WITH touched AS (
+        SELECT DISTINCT parameter, resolution, cell_i, cell_j,
+               date_trunc('{unit}', datetime_utc, 'UTC') AS bucket
+        FROM satellite_grid
+        WHERE inserted_at > %(since)s AND inserted_at <= %(until)s
+    )
+    INSERT INTO {table} (parameter, resolution, cell_i, cell_j, bucket, n, mean, min, max, p95)
+    SELECT t.parameter, t.resolution, t.cell_i, t.cell_j, t.bucket,
+""" + _STATS.format(v="g.value_mean") + """
+    FROM touched t
+    JOIN satellite_grid g
+      ON g.parameter = t.parameter AND g.resolution = t.resolution
+     AND g.cell_i = t.cell_i AND g.cell_j = t.cell_j
+     AND g.datetime_utc >= t.bucket AND g.datetime_utc < t.bucket + interval '1 {unit}'
+    GROUP BY 1, 2, 3, 4, 5
+""" + _UPSERT.format(key="parameter, resolution, cell_i, cell_j")
+
+
+def ensure_rollup_tables(cur):
+    for table in ROLLUPS:
+        cur.execute(ROLLUP_DDL.format(table=table))
+    for table in GRID_ROLLUPS:
+        cur.execute(GRID_ROLLUP_DDL.format(table=table))
+    cur.execute(ROLLUP_HORIZON_DDL)
+
+
+def compacted_until(cur):
+    """Fin del rango de measurements ya compactado y borrado por la retención (None si nunca)."""
+    cur.execute(ROLLUP_HORIZON_DDL)
+    cur.execute("SELECT compacted_until FROM rollup_horizon WHERE source = 'measurements'")
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def mark_compacted(cur, until):
+    """Avanza (nunca retrocede) el horizonte de compactación. No hace commit."""
+    cur.execute(ROLLUP_HORIZON_DDL)
+    cur.execute("""
+        INSERT INTO rollup_horizon (source, compacted_until) VALUES ('measurements', %s)
+        ON CONFLICT (source) DO UPDATE
+        SET compacted_until = GREATEST(rollup_horizon.compacted_until, EXCLUDED.compacted_until)
+    """, (until,))
+
+
+def rollup_range(cur, start, end, merge=False):
+    """
+    Recalcula los rollups horario y diario de [start, end) desde measurements.
+    Para que el diario sea exacto, start/end deben caer en límites de día (UTC).
+    merge=True suma los buckets a los existentes en vez de reemplazarlos (filas
+    tardías de un rango ya compactado, cuyos datos crudos ya no están).
+    Devuelve {tabla: filas}. No hace commit.
+    """
+    ensure_rollup_tables(cur)
+    out = {}
+    for table, unit in ROLLUPS.items():
+        upsert = (_MERGE if merge else _UPSERT).format(key="station_id, parameter", table=table)
+        cur.execute(ROLLUP_SELECT.format(table=table, unit=unit) + upsert, {"start": start, "end": end})
+        out[table] = cur.rowcount
+    return out
+
+
+def refresh_rollups(cur, source, since, until):
+    """
+    Refresco incremental: recalcula los buckets de `source` ("measurements" o
+    "satellite_grid") con filas insertadas en (since, until], salvo los de
+    measurements anteriores a compacted_until. Devuelve {tabla: filas}. No hace commit.
+    """
+    ensure_rollup_tables(cur)
+    if source == "measurements":
+        tables, sql = ROLLUPS, REFRESH_SQL
+    elif source == "satellite_grid":
+        tables, sql = GRID_ROLLUPS, GRID_REFRESH_SQL
+    else:
+        raise ValueError(f"source desconocida: {source}")
+    params = {"since": since, "until": until, "horizon": compacted_until(cur)}
+    out = {}
+    for table, unit in tables.items():
+        cur.execute(sql.format(table=table, unit=unit), params)
+        out[table] = cur.rowcount
+    return out
+
+
+# ------------- API de consulta -------------
+
+def _aligned(ts, size):
+    if ts is None:
+        return True
+    return pd.Timestamp(ts).timestamp() % size.total_seconds() == 0
+
+
+def pick_rollup(step, start=None, end=None, grid=False):
+    """
+    Rollup más grueso cuyo bucket divide exactamente `step` (timedelta o
+    string de pandas, p.ej. "6h", "1D") y en cuyos límites caen start/end
+    (si no, los buckets de los extremos incluirían datos fuera del rango).
+    Devuelve (tabla, unidad) o (None, None) si hay que ir a los datos crudos.
+    """
+    step = pd.Timedelta(step).to_pytimedelta()
+    tables = GRID_ROLLUPS if grid else ROLLUPS
+    best = (None, None)
+    for table, unit in tables.items():
+        size = UNIT_STEP[unit]
+        if step % size or not (_aligned(start, size) and _aligned(end, size)):
+            continue
+        if best[1] is None or size > UNIT_STEP[best[1]]:
+            best = (table, unit)
+    return best
+
+
+def _bucket_expr(col, step_s):
+    # equivalente portátil a date_bin (PG14+), alineado a la época UTC
+    return f"to_timestamp(floor(extract(epoch FROM {col}) / {step_s}) * {step_s})"
+
+
+def query_series(cur, parameter, start, end, step="1h", station_ids=None, cell=None):
+    """
+    Serie agregada de `parameter` en [start, end) con buckets de `step`.
+
+    - station_ids: lista de estaciones (por defecto todas) -> filas por estación.
+    - cell: (resolution, cell_i, cell_j) -> serie de esa celda de satellite_grid.
+
+    Lee del rollup más grueso que sirve (pick_rollup); si el paso es múltiplo
+    del rollup re-agrega: n suma, mean ponderada por n, min/max exactos y p95
+    como cota superior (máximo de los p95; exacto si step == bucket). Pasos
+    menores a una hora se calculan sobre measurements/satellite_grid.
+    Devuelve un DataFrame con station_id (o cell_i, cell_j), bucket, n, mean,
+    min, max, p95 y la columna `source` con la tabla usada.
+    """
+    step_td = pd.Timedelta(step).to_pytimedelta()
+    step_s = int(step_td.total_seconds())
+    if step_s <= 0:
+        raise ValueError("step debe ser positivo")
+    table, unit = pick_rollup(step_td, start, end, grid=cell is not None)
+    params = {"parameter": parameter, "start": start, "end": end}
+
+    if cell is not None:
+        keys = ["cell_i", "cell_j"]
+        params.update(zip(("res", "ci", "cj"), cell))
+        where = "parameter = %(parameter)s AND resolution = %(res)s AND cell_i = %(ci)s AND cell_j = %(cj)s"
+    else:
+        keys = ["station_id"]
+        where = "parameter = %(parameter)s"
+        if station_ids is not None:
+            where += " AND station_id = ANY(%(stations)s)"
+            params["stations"] = list(station_ids)
+
+    if table is None:
+        src, ts = ("satellite_grid" if cell is not None else "measurements"), "datetime_utc"
+        stats = _STATS.format(v="value_mean" if cell is not None else "value")
+    else:
+        src, ts = table, "bucket"
+        stats = "sum(n), sum(mean * n) / nullif(sum(n), 0), min(min), max(max), max(p95)"
+
+    k = ", ".join(keys)
+    cur.execute(f"""
+        SELECT {k}, {_bucket_expr(ts, step_s)} AS b, {stats}
+        FROM {src}
+        WHERE {where} AND {ts} >= %(start)s AND {ts} < %(end)s
+        GROUP BY {k}, b
+        ORDER BY {k}, b
+    """, params)
+    df = pd.DataFrame(cur.fetchall(), columns=keys + ["bucket"] + STAT_COLS)
+    df["source"] = src
+    return df
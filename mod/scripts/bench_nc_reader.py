@@ -0,0 +1,84 @@
+"""
+bench_nc_reader.py - Compara la lectura completa con xarray contra nc_reader.read_bbox.
+
+Cada camino corre en un proceso nuevo para que el pico de RSS sea comparable.
+Reporta bytes de datos leídos, bytes leídos del disco (/proc/self/io), RSS pico y tiempo.
+
+Uso: python bench_nc_reader.py archivo.nc [lat_min lat_max lon_min lon_max]
+"""
+
+import multiprocessing as mp
+import resource
+import sys
+import time
+
+VARS = ["nitrogendioxide_tropospheric_column", "qa_value"]
+
+
+def _io_read_bytes():
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _full_xarray(file_path, lat_bounds, lon_bounds):
+    """Camino original: xr.open_dataset + .values.flatten() de todo el orbit."""
+    import xarray as xr
+    ds = xr.open_dataset(file_path, group="PRODUCT")
+    arrays = [ds[n].values.flatten() for n in ["latitude", "longitude", *VARS]]
+    lat, lon = arrays[0], arrays[1]
+    mask = (lat >= lat_bounds[0]) & (lat <= lat_bounds[1]) & (lon >= lon_bounds[0]) & (lon <= lon_bounds[1])
+    return int(mask.sum()), sum(a.nbytes for a in arrays)
+
+
+def _lazy_bbox(file_path, lat_bounds, lon_bounds):
+    from nc_reader import read_bbox
+    arrays, info = read_bbox(file_path, VARS, lat_bounds, lon_bounds)
+    n = 0 if arrays is None else int(arrays["latitude"].size)
+    return n, info["bytes_read"]
+
+
+def _run(fn, file_path, lat_bounds, lon_bounds, out):
+    io0 = _io_read_bytes()
+    t0 = time.perf_counter()
+    pixels, data_bytes = fn(file_path, lat_bounds, lon_bounds)
+    elapsed = time.perf_counter() - t0
+    io1 = _io_read_bytes()
+    out.put({
+        "pixels": pixels,
+        "data_bytes": data_bytes,
+        "io_bytes": None if io0 is None else io1 - io0,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "seconds": elapsed,
+    })
+
+
+def bench(file_path, lat_bounds=(4, 6), lon_bounds=(-75, -73)):
+    ctx = mp.get_context("spawn")
+    results = {}
+    for name, fn in (("xarray completo", _full_xarray), ("read_bbox", _lazy_bbox)):
+        out = ctx.Queue()
+        p = ctx.Process(target=_run, args=(fn, file_path, lat_bounds, lon_bounds, out))
+        p.start()
+        results[name] = out.get()
+        p.join()
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 6):
+        print("⚠ Uso: python bench_nc_reader.py archivo.nc [lat_min lat_max lon_min lon_max]")
+        sys.exit(1)
+
+    file_path = sys.argv[1]
+    bounds = [float(x) for x in sys.argv[2:]] or [4, 6, -75, -73]
+    print(f"📂 Benchmark de lectura {file_path} bbox={bounds}\n")
+    for name, r in bench(file_path, tuple(bounds[:2]), tuple(bounds[2:])).items():
+        io_mb = "n/d" if r["io_bytes"] is None else f"{r['io_bytes'] / 1e6:.1f} MB"
+        print(f"- {name:16s} píxeles={r['pixels']:>9d}  datos={r['data_bytes'] / 1e6:8.2f} MB  "
+              f"disco={io_mb:>10s}  RSS pico={r['peak_rss_mb']:7.1f} MB  {r['seconds']:.2f}s")
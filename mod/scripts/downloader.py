@@ -0,0 +1,270 @@
+"""
+downloader.py - Descarga de granules con caché local direccionada por contenido.
+
+- Los archivos completos viven en <cache>/objects/<sha256[:2]>/<sha256>; una
+  misma granule bajada desde dos URLs se guarda una sola vez.
+- <cache>/refs/<hash de la URL>.json apunta de cada URL a su objeto, así que
+  volver a pedir una URL ya descargada no toca la red.
+- Las descargas a medias quedan en <cache>/partial/ y se reanudan con
+  Range + If-Range (si el servidor cambió el archivo, se empieza de cero).
+- Escrituras con buffer grande, verificación de tamaño (Content-Length) y
+  sha256 opcional; un pool acotado de hilos para varias descargas a la vez.
+
+Uso:
+    python downloader.py URL [URL ...] [--workers 4] [--dest DIR]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from rate_limit import get_limiter, retry_after_seconds
+
+CACHE_DIR = os.getenv("GRANULE_CACHE_DIR", os.path.expanduser("~/.cache/airbytes/granules"))
+CHUNK_SIZE = 1 << 20          # 1 MiB por lectura de la red
+WRITE_BUFFER = 8 << 20        # 8 MiB de buffer de escritura
+MAX_RETRIES = 5
+RETRY_BACKOFF = 2.0           # s; se duplica en cada intento (2, 4, 8, ...)
+DOWNLOAD_WORKERS = 4
+
+
+class DownloadError(Exception):
+    pass
+
+
+_url_locks = {}
+_url_locks_lock = threading.Lock()
+
+
+def _url_lock(url):
+    with _url_locks_lock:
+        return _url_locks.setdefault(url, threading.Lock())
+
+
+def _key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _paths(cache_dir, url):
+    key = _key(url)
+    return (os.path.join(cache_dir, "refs", key + ".json"),
+            os.path.join(cache_dir, "partial", key + ".part"),
+            os.path.join(cache_dir, "partial", key + ".json"))
+
+
+def object_path(sha256, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, "objects", sha256[:2], sha256)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _hash_file(path, h=None):
+    h = h or hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(WRITE_BUFFER), b""):
+            h.update(block)
+    return h
+
+
+def _materialize(path, dest):
+    """Deja una copia de `path` en `dest` (hardlink si se puede)."""
+    if not dest:
+        return path
+    if os.path.dirname(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.exists(dest):
+        if os.path.samefile(path, dest):
+            return dest
+        os.remove(dest)
+    try:
+        os.link(path, dest)
+    except OSError:
+        shutil.copyfile(path, dest)
+    return dest
+
+
+def cached(url, sha256=None, cache_dir=CACHE_DIR):
+    """Ruta del objeto en caché para `url` (o para `sha256`), o None."""
+    if sha256 and os.path.exists(object_path(sha256, cache_dir)):
+        return object_path(sha256, cache_dir)
+    ref = _read_json(_paths(cache_dir, url)[0])
+    if ref:
+        path = object_path(ref["sha256"], cache_dir)
+        if os.path.exists(path) and os.path.getsize(path) == ref["size"]:
+            if sha256 is None or sha256 == ref["sha256"]:
+                return path
+    return None
+
+
+def _download(url, part_path, meta_path, session, headers, timeout):
+    """
+    Baja (o reanuda) `url` en part_path. Devuelve (sha256 hexdigest, tamaño, etag).
+    Lanza requests.RequestException ante errores de red para reintentar.
+    """
+    meta = _read_json(meta_path) or {}
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    req_headers = dict(headers or {})
+    validator = meta.get("etag") or meta.get("last_modified")
+    if offset and validator:
+        req_headers["Range"] = f"bytes={offset}-"
+        req_headers["If-Range"] = validator
+    else:
+        offset = 0
+
+    get_limiter(url).acquire()
+    with session.get(url, headers=req_headers, stream=True, timeout=timeout, allow_redirects=True) as r:
+        if r.status_code == 416 and offset:
+            # el parcial ya tiene todo (o es basura): se valida abajo por tamaño
+            total = meta.get("size")
+            if total != offset:
+                os.remove(part_path)
+                raise requests.RequestException("416 con parcial inválido; se reinicia")
+            return _hash_file(part_path).hexdigest(), offset, meta.get("etag")
+        r.raise_for_status()
+        if "text/html" in r.headers.get("Content-Type", "") and not url.endswith((".html", ".htm")):
+            raise DownloadError(f"{url} devolvió HTML (¿login o página de confirmación?)")
+
+        if r.status_code == 206:
+            total = int(r.headers.get("Content-Range", "*/0").rsplit("/", 1)[-1] or 0) or None
+            h = _hash_file(part_path)
+            mode = "ab"
+        else:
+            # 200: el servidor ignoró el Range o el archivo cambió
+            offset = 0
+            total = int(r.headers["Content-Length"]) if "Content-Length" in r.headers else None
+            h = hashlib.sha256()
+            mode = "wb"
+
+        etag = r.headers.get("ETag")
+        _write_json(meta_path, {"url": url, "etag": etag,
+                                "last_modified": r.headers.get("Last-Modified"), "size": total})
+        size = offset
+        with open(part_path, mode, buffering=WRITE_BUFFER) as f:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                h.update(chunk)
+                size += len(chunk)
+
+    if total is not None and size != total:
+        raise requests.RequestException(f"descarga incompleta: {size}/{total} bytes")
+    return h.hexdigest(), size, etag
+
+
+def fetch(url, sha256=None, size=None, dest=None, session=None, headers=None,
+          cache_dir=CACHE_DIR, refresh=False, max_retries=MAX_RETRIES, timeout=60):
+    """
+    Devuelve la ruta local de `url`, descargándola sólo si no está en caché.
+
+    - sha256/size: valores esperados; si no coinciden se borra el parcial y
+      se lanza DownloadError.
+    - dest: además deja el archivo con ese nombre (hardlink al objeto).
+    - refresh=True ignora la referencia URL -> objeto y vuelve a bajar.
+    - session/headers: para autenticación (p.ej. Basic de Earthdata).
+
+    Errores de red y 5xx se reintentan con espera exponencial (RETRY_BACKOFF);
+    un 429 respeta Retry-After y un 4xx distinto falla de inmediato.
+    """
+    if not refresh:
+        hit = cached(url, sha256, cache_dir)
+        if hit:
+            return _materialize(hit, dest)
+
+    ref_path, part_path, meta_path = _paths(cache_dir, url)
+    session = session or requests.Session()
+    with _url_lock(url):
+        if not refresh:
+            hit = cached(url, sha256, cache_dir)
+            if hit:
+                return _materialize(hit, dest)
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+
+        last_error = None
+        for attempt in range(1, max_retries + 1):
+            try:
+                digest, got, etag = _download(url, part_path, meta_path, session, headers, timeout)
+                break
+            except requests.RequestException as e:
+                last_error = e
+                status = getattr(e.response, "status_code", None)
+                if status is not None and 400 <= status < 500 and status != 429:
+                    # 404, 401, 403...: reintentar no lo arregla
+                    raise DownloadError(f"No se pudo descargar {url}: {e}") from e
+                done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                print(f"  ↻ {url} intento {attempt}/{max_retries} ({done} bytes en disco): {e}")
+                if attempt < max_retries:
+                    wait = RETRY_BACKOFF * 2 ** (attempt - 1)
+                    if status == 429:
+                        wait = retry_after_seconds(e.response, wait)
+                        get_limiter(url).pause(wait)
+                    time.sleep(wait)
+        else:
+            raise DownloadError(f"No se pudo descargar {url}: {last_error}")
+
+        if (size is not None and got != size) or (sha256 is not None and digest != sha256):
+            os.remove(part_path)
+            os.remove(meta_path)
+            raise DownloadError(f"{url}: verificación fallida (tamaño {got}, sha256 {digest})")
+
+        final = object_path(digest, cache_dir)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(part_path, final)
+        os.remove(meta_path)
+        _write_json(ref_path, {"url": url, "sha256": digest, "size": got, "etag": etag})
+        print(f"⬇️ {url} -> {final} ({got / 1e6:.1f} MB)")
+        return _materialize(final, dest)
+
+
+def fetch_many(items, workers=DOWNLOAD_WORKERS, **kwargs):
+    """
+    Descarga varias URLs con a lo sumo `workers` en paralelo.
+    items: URLs o dicts con los argumentos de fetch (url, sha256, size, dest).
+    Devuelve {url: ruta o excepción}.
+    """
+    jobs = [{"url": it} if isinstance(it, str) else dict(it) for it in items]
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch, **{**kwargs, **job}): job["url"] for job in jobs}
+        for fut, url in futures.items():
+            try:
+                results[url] = fut.result()
+            except Exception as e:
+                results[url] = e
+    return results
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("urls", nargs="+")
+    p.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS)
+    p.add_argument("--dest", help="directorio donde dejar los archivos con su nombre original")
+    p.add_argument("--refresh", action="store_true", help="ignora la caché y vuelve a bajar")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    items = [{"url": u, "dest": os.path.join(args.dest, os.path.basename(u.split("?")[0])) if args.dest else None}
+             for u in args.urls]
+    for url, result in fetch_many(items, workers=args.workers, refresh=args.refresh).items():
+        print(("❌ " if isinstance(result, Exception) else "✅ ") + f"{url}: {result}")
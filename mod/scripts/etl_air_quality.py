@@ -1,4 +1,12 @@
 # etl_full_openaq.py
+import argparse
+import csv
+import glob
+import io
+import itertools
+import os
+import re
+import sys
 import requests
 import psycopg2
 import time
@@ -9,19 +17,36 @@ import xarray as xr
 import numpy as np
 import pandas as pd
 import psycopg2.extras
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+from config_db import dispose_after_fork, get_raw_conn, pool_stats  # noqa: E402
+from update_events import notify_update  # noqa: E402
+
+from aggregates import refresh_rollups
+from downloader import fetch
+from granule_catalog import CATALOG, NO2_CANDIDATES, describe_granule, detect_product, intersects
+from http_cache import ResponseCache
+from nc_reader import read_bbox
+from partitions import ensure_range, is_partitioned
+from rate_limit import get_limiter, retry_after_seconds
+from sat_grid import grid_batches
+from station_cache import StationRegistry
 
 # ============== CONFIG ==============
-DB_CONFIG = {
-    "dbname": "air_quality_db",
-    "user": "airbyter",
-    "password": "AirBytes2025",
-    "host": "192.168.2.8",
-    "port": 5432
-}
+# La conexión a air_quality_db (URL y tamaño del pool) vive en mod/model/config_db.py
 
 OPENAQ_KEY = "523eb1251f97abc8f75087ea19ba06a04b2e6c04f4d128ef68862bf3a5b93a92"
 OPENAQ_LOCATIONS = "https://api.openaq.org/v3/locations"
-OPENAQ_MEASUREMENTS = "https://api.openaq.org/v3/measurements"
+OPENAQ_MEASUREMENTS = "https://api.openaq.org/v3/sensors/{sensor_id}/measurements"  # v3: por sensor
+OPENAQ_WORKERS = 4   # páginas en vuelo; el ritmo lo limita rate_limit.RATE_LIMITS
+OPENAQ_QUEUE_PAGES = 32      # páginas parseadas esperando escritura (backpressure)
+OPENAQ_BATCH_ROWS = 20000    # filas por COPY/commit del backfill
+OPENAQ_PUT_TIMEOUT = 1.0     # s; los productores bloqueados revisan cada tanto si hay que parar
 
 OPENWEATHER_KEY = "851fc0b7aecc41c3eed4ceb24d129f82"
 OPENWEATHER_CURRENT = "https://api.openweathermap.org/data/2.5/weather"
@@ -31,6 +56,11 @@ COUNTRY = "CO"
 LAT = 4.7110
 LON = -74.0721
 RADIUS = 50000   # metros (50km)
+SAT_LAT_BOUNDS = (4, 6)      # bbox satelital (ajusta para tu región)
+SAT_LON_BOUNDS = (-75, -73)
+SAT_GRID_RES = 0.05          # grados por celda de la grilla satelital
+WEATHER_GRID_RES = 0.5       # grados por celda de weather_hourly (cubre Bogotá con una o dos celdas)
+WEATHER_TOLERANCE = "3 hours"  # antigüedad máxima del clima en el as-of join
 # ====================================
 
 
@@ -42,239 +72,510 @@ def clean_str(value):
 
 #-------------- CONECT TO DB ------------
 def get_conn():
-    return psycopg2.connect(**DB_CONFIG)
+    """Conexión del pool compartido (config_db); conn.close() la devuelve al pool."""
+    return get_raw_conn()
 
 
-# ---------------- SATELLITE NRT (TEMPO + TROPOMI) ----------------
+# ------------- WATERMARKS (ETL incremental) -------------
+# source -> último dato cargado con éxito. Claves: "openweather:current",
+# "satellite:tropomi", "satellite:tempo". OpenAQ lleva su watermark por
+# location/sensor en openaq_checkpoints.
+ETL_WATERMARKS_DDL = """
+    CREATE TABLE IF NOT EXISTS etl_watermarks (
+        source      text PRIMARY KEY,
+        watermark   timestamptz NOT NULL,
+        last_run_at timestamptz DEFAULT now()
+    )
+"""
 
-def download_file(url, out_path):
-    import requests, os
-    if os.path.exists(out_path):
-        return out_path
-    print(f"⬇️ Downloading {url} ...")
-    r = requests.get(url, stream=True)
-    r.raise_for_status()
-    with open(out_path, "wb") as f:
-        for chunk in r.iter_content(chunk_size=8192):
-            f.write(chunk)
-    return out_path
-
-def insert_measurements(rows):
-    """Inserta filas satelitales como measurements."""
-    if not rows:
-        print("⚠ No hay filas satelitales para insertar en measurements")
-        return
 
+# inserted_at/updated_at = now() es la hora de inicio de la transacción: una
+# carga larga puede confirmar filas "más viejas" que un watermark ya guardado.
+# Los procesos que recorren por inserted_at vuelven a pedir este margen (sus
+# upserts son idempotentes, así que lo repetido no cambia nada).
+WATERMARK_OVERLAP = timedelta(hours=1)
+
+
+def load_watermarks():
+    """Devuelve {source: watermark} (crea la tabla si no existe)."""
     conn = get_conn()
     cur = conn.cursor()
-    inserted = 0
-    for r in rows:
-        try:
-            # asegurar estación dummy (TROPOMI/TEMPO)
-            cur.execute("""
-                INSERT INTO stations (nombre, lat, lon, tipo, fuente)
-                VALUES (%s,%s,%s,%s,%s)
-                ON CONFLICT (nombre) DO NOTHING
-            """, (r["station_id"], r["latitude"], r["longitude"], "satellite", "NASA/ESA"))
+    try:
+        cur.execute(ETL_WATERMARKS_DDL)
+        cur.execute("SELECT source, watermark FROM etl_watermarks")
+        marks = dict(cur.fetchall())
+        conn.commit()
+        return marks
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_watermark(source):
+    return load_watermarks().get(source)
+
+
+SET_WATERMARK_SQL = """
+    INSERT INTO etl_watermarks (source, watermark) VALUES (%s, %s)
+    ON CONFLICT (source) DO UPDATE
+    SET watermark = GREATEST(etl_watermarks.watermark, EXCLUDED.watermark),
+        last_run_at = now()
+"""
+
+
+def set_watermark(source, value, cur=None):
+    """
+    Avanza el watermark de `source` (nunca retrocede). Con `cur` se ejecuta en
+    la transacción del caller (sin commit) para que datos y watermark sean atómicos.
+    """
+    if cur is not None:
+        cur.execute(ETL_WATERMARKS_DDL)
+        cur.execute(SET_WATERMARK_SQL, (source, value))
+        return
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(ETL_WATERMARKS_DDL)
+        cur.execute(SET_WATERMARK_SQL, (source, value))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# ---------------- SATELLITE NRT (TEMPO + TROPOMI) ----------------
+
+def download_file(url, out_path, sha256=None):
+    """Baja `url` a `out_path` vía la caché de granules (reanudable y verificada)."""
+    return fetch(url, sha256=sha256, dest=out_path)
+
+# ------------- BULK LOADER (COPY + merge) -------------
+MEASUREMENTS_STAGE_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS measurements_stage (
+        station_id   integer,
+        datetime_utc timestamptz,
+        parameter    text,
+        value        double precision,
+        unit         text,
+        provider     text
+    ) ON COMMIT DELETE ROWS
+"""
+
+MEASUREMENTS_MERGE_SQL = """
+    INSERT INTO measurements (station_id, datetime_utc, parameter, value, unit, provider)
+    SELECT station_id, datetime_utc, parameter, value, unit, provider
+    FROM measurements_stage
+    ON CONFLICT (station_id, datetime_utc, parameter) DO NOTHING
+"""
+
+
+def _copy_buffer(rows):
+    """Serializa tuplas a CSV en memoria para COPY (None -> NULL). Devuelve (buffer, n)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    n = 0
+    for row in rows:
+        writer.writerow(["" if v is None else v for v in row])
+        n += 1
+    buf.seek(0)
+    return buf, n
+
+
+def _cells_buffer(station_pks, dt, parameter, values, unit="mol/m2", provider="Satellite"):
+    """Serializa las celdas de un granule (arrays NumPy) a CSV para COPY sin crear objetos por fila."""
+    n = len(values)
+    frame = pd.DataFrame({
+        "station_id": np.asarray(station_pks, dtype=np.int64),
+        "datetime_utc": dt.isoformat(),
+        "parameter": parameter,
+        "value": values,
+        "unit": unit,
+        "provider": provider,
+    })
+    buf = io.StringIO()
+    frame.to_csv(buf, header=False, index=False)
+    buf.seek(0)
+    return buf, n
+
+
+STATIONS = StationRegistry()
+
+
+def resolve_station_ids(cur, stations):
+    """
+    Devuelve {nombre: id} desde el registro en memoria; sólo las estaciones
+    nuevas llegan a la DB (un INSERT ... RETURNING en bloque). No hace commit:
+    si el caller hace rollback debe llamar a STATIONS.invalidate().
+    stations: dict nombre -> (lat, lon, tipo, fuente)
+    """
+    if not stations:
+        return {}
+    cleaned = {clean_str(n): meta for n, meta in stations.items()}
+    ids = STATIONS.resolve(cur, cleaned)
+    return {n: ids[clean_str(n)] for n in stations if clean_str(n) in ids}
 
+
+def copy_measurements(conn, chunks):
+    """
+    Carga trozos CSV (buffer, n) de tuplas
+    (station_id, datetime_utc, parameter, value, unit, provider)
+    con COPY a una tabla staging y hace un único upsert set-based.
+    Si entra algo, avisa a app.py (NOTIFY, se entrega con el commit).
+    Devuelve (insertadas, omitidas). No hace commit.
+    """
+    cur = conn.cursor()
+    staged = 0
+    try:
+        cur.execute(MEASUREMENTS_STAGE_DDL)
+        for buf, n in chunks:
+            cur.copy_expert("""
+                COPY measurements_stage (station_id, datetime_utc, parameter, value, unit, provider)
+                FROM STDIN WITH (FORMAT csv)
+            """, buf)
+            staged += n
+        if is_partitioned(cur):
+            # backfills pueden caer en meses sin partición: se crean antes del merge
+            cur.execute("SELECT min(datetime_utc), max(datetime_utc) FROM measurements_stage")
+            ensure_range(cur, *cur.fetchone())
+        cur.execute(MEASUREMENTS_MERGE_SQL)
+        inserted = cur.rowcount
+        if inserted:
             cur.execute("""
-                INSERT INTO measurements (station_id, datetime_utc, parameter, value, unit, provider)
-                SELECT s.id, %s, %s, %s, %s, %s
-                FROM stations s WHERE s.nombre = %s
-                ON CONFLICT (station_id, datetime_utc, parameter) DO NOTHING
-            """, (
-                r["datetime"], r["parameter"], r["value"], "mol/m2", "Satellite",
-                r["station_id"]
-            ))
-            inserted += 1
-        except Exception as e:
-            print("  ❌ Error insertando sat measurement:", e)
+                SELECT min(s.lat), max(s.lat), min(s.lon), max(s.lon), max(st.datetime_utc)
+                FROM measurements_stage st JOIN stations s ON s.id = st.station_id
+            """)
+            lat_min, lat_max, lon_min, lon_max, until = cur.fetchone()
+            if lat_min is not None:
+                notify_update(cur, "measurements", (lat_min, lat_max, lon_min, lon_max), until)
+        # ON COMMIT DELETE ROWS sólo limpia al commit; vaciamos por si el caller agrupa varios lotes
+        cur.execute("TRUNCATE measurements_stage")
+    finally:
+        cur.close()
+    return inserted, staged - inserted
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    print(f"✅ Insertadas {inserted} mediciones satelitales en measurements")
+
+def cell_station_name(product, res, i, j):
+    """Estación virtual de la celda (i, j) de la grilla satelital de `res` grados."""
+    return f"{product}:{res:g}:{i}:{j}"
+
+
+def insert_measurements(batches, res=SAT_GRID_RES):
+    """
+    Inserta lotes satelitales columnares (ver _make_batch) como measurements.
+    La clave de measurements es (station_id, datetime_utc, parameter) y todos
+    los píxeles de un granule comparten hora: cada celda de `res` grados es una
+    estación ("TROPOMI:0.05:i:j") y su valor es la media de sus píxeles, así
+    que no se pierde ningún píxel como "duplicado". Devuelve (insertadas, omitidas).
+    """
+    t0 = time.perf_counter()
+    grids = grid_batches(batches, res)
+    conn = get_conn()
+
+    def chunks():
+        cur = conn.cursor()
+        try:
+            for (product, parameter, dt), g in grids:
+                names = [cell_station_name(product, res, i, j)
+                         for i, j in zip(g["cell_i"].tolist(), g["cell_j"].tolist())]
+                ids = resolve_station_ids(cur, {
+                    name: (lat, lon, "satellite", "NASA/ESA")
+                    for name, lat, lon in zip(names, g["lat"].tolist(), g["lon"].tolist())
+                })
+                yield _cells_buffer([ids[n] for n in names], dt, parameter, g["mean"])
+        finally:
+            cur.close()
+
+    try:
+        inserted, skipped = copy_measurements(conn, chunks())
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        STATIONS.invalidate()
+        print("  ❌ Error insertando sat measurements:", e)
+        return 0, 0
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - t0
+    if inserted + skipped == 0:
+        print("⚠ No hay filas satelitales para insertar en measurements")
+    else:
+        print(f"✅ Insertadas {inserted} mediciones satelitales en measurements "
+              f"({skipped} omitidas por duplicado, {elapsed:.2f}s)")
+    return inserted, skipped
+
+
+# ------------- SATELLITE GRID (celdas agregadas) -------------
+SATELLITE_GRID_DDL = """
+    CREATE TABLE IF NOT EXISTS satellite_grid (
+        datetime_utc  timestamptz NOT NULL,
+        product       text NOT NULL,
+        parameter     text NOT NULL,
+        resolution    double precision NOT NULL,
+        cell_i        integer NOT NULL,
+        cell_j        integer NOT NULL,
+        lat           double precision NOT NULL,
+        lon           double precision NOT NULL,
+        n_pixels      integer NOT NULL,
+        value_mean    double precision,
+        value_std     double precision,
+        value_qa_mean double precision,
+        inserted_at   timestamptz DEFAULT now(),
+        PRIMARY KEY (parameter, resolution, cell_i, cell_j, datetime_utc, product)
+    )
+"""
+
+
+def insert_satellite_grid(batches, res=SAT_GRID_RES):
+    """
+    Agrega los lotes satelitales en celdas de `res` grados (sat_grid) y guarda
+    sólo las celdas en satellite_grid (mean/std/count + media ponderada por QA).
+    Devuelve (celdas guardadas, píxeles agregados).
+    """
+    t0 = time.perf_counter()
+    grids = grid_batches(batches, res)
+    rows = []
+    pixels = 0
+    for (product, parameter, dt), g in grids:
+        pixels += int(g["n_pixels"].sum())
+        rows.extend(zip(
+            itertools.repeat(dt), itertools.repeat(product), itertools.repeat(parameter),
+            itertools.repeat(res), g["cell_i"].tolist(), g["cell_j"].tolist(),
+            g["lat"].tolist(), g["lon"].tolist(), g["n_pixels"].tolist(),
+            g["mean"].tolist(), g["std"].tolist(), g["qa_mean"].tolist(),
+        ))
+    if not rows:
+        print("⚠ No hay píxeles satelitales para agregar en la grilla")
+        return 0, 0
+
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(SATELLITE_GRID_DDL)
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO satellite_grid
+            (datetime_utc, product, parameter, resolution, cell_i, cell_j, lat, lon,
+             n_pixels, value_mean, value_std, value_qa_mean)
+            VALUES %s
+            ON CONFLICT (parameter, resolution, cell_i, cell_j, datetime_utc, product) DO UPDATE
+            SET n_pixels = EXCLUDED.n_pixels,
+                value_mean = EXCLUDED.value_mean,
+                value_std = EXCLUDED.value_std,
+                value_qa_mean = EXCLUDED.value_qa_mean,
+                inserted_at = now()   -- para que refresh_aggregates vuelva a agregar la celda
+        """, rows, page_size=1000)
+        lats, lons = [r[6] for r in rows], [r[7] for r in rows]
+        notify_update(cur, "features", (min(lats), max(lats), min(lons), max(lons)), max(r[0] for r in rows))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print("  ❌ Error insertando grilla satelital:", e)
+        return 0, 0
+    finally:
+        cur.close()
+        conn.close()
+
+    print(f"✅ {pixels} píxeles agregados en {len(rows)} celdas de {res}° "
+          f"({time.perf_counter() - t0:.2f}s)")
+    return len(rows), pixels
 
 
 def guess_pollutant_var(ds):
     """
     Intenta adivinar el nombre de la variable de NO₂ en el NetCDF.
     """
-    candidates = [
-        "nitrogendioxide_tropospheric_column",
-        "nitrogendioxide_total_column",
-        "nitrogendioxide_slant_column",
-        "nitrogendioxide_column_number_density",  # otro nombre común
-        "NO2_column_number_density"              # a veces así
-    ]
+    candidates = NO2_CANDIDATES
     for var in candidates:
         if var in ds.variables:
             return var
     return None
 
-import gdown
 from datetime import datetime
 
 # ==========================
 # Procesadores
 # ==========================
-def process_tropomi_l2(file_path: str, qa_threshold: float = 0.75,
-                       lat_bounds=None, lon_bounds=None) -> list:
-    """
-    Procesa Sentinel-5P TROPOMI L2 NO₂ troposférico y devuelve registros listos para measurements.
-    DEMO: siempre limita a 50 filas para no sobrecargar la DB.
-    """
-    import xarray as xr
-    import pandas as pd
-    from datetime import datetime, timezone
+DEMO_LIMIT = 50           # filas por producto en modo demo (--full lo desactiva)
+SAT_CHUNK_SIZE = 256      # scanlines (o filas de la grilla) por lote en memoria
 
-    try:
-        ds = xr.open_dataset(file_path, group="PRODUCT")
 
-        dt_str = ds.attrs.get("time_coverage_start")
-        now = datetime.fromisoformat(dt_str.replace("Z", "+00:00")) if dt_str else datetime.now(timezone.utc)
+def _coverage_start(ds):
+    return _parse_coverage(ds.attrs.get("time_coverage_start"))
 
-        lat = ds["latitude"].values.flatten()
-        lon = ds["longitude"].values.flatten()
-        no2 = ds["nitrogendioxide_tropospheric_column"].values.flatten()
-        qa = ds["qa_value"].values.flatten()
 
-        df = pd.DataFrame({
-            "latitude": lat,
-            "longitude": lon,
-            "value": no2,
-            "qa_value": qa
-        })
+def _parse_coverage(dt_str):
+    return datetime.fromisoformat(dt_str.replace("Z", "+00:00")) if dt_str else datetime.now(timezone.utc)
 
-        df = df[df["qa_value"] >= qa_threshold]
-
-        # bounding box opcional
-        if lat_bounds and lon_bounds:
-            filtered = df[
-                (df["latitude"] >= lat_bounds[0]) & (df["latitude"] <= lat_bounds[1]) &
-                (df["longitude"] >= lon_bounds[0]) & (df["longitude"] <= lon_bounds[1])
-            ]
-            if not filtered.empty:
-                df = filtered
-
-        # ⚡ DEMO: limitar a 50 filas
-        df = df.head(50)
-
-        records = []
-        for _, row in df.iterrows():
-            records.append({
-                "station_id": "TROPOMI",
-                "parameter": "no2_tropospheric_column",
-                "value": float(row["value"]),
-                "datetime": now,
-                "latitude": float(row["latitude"]),
-                "longitude": float(row["longitude"])
-            })
 
-        return records
+def _valid_mask(lat, lon, value, qa=None, qa_threshold=None,
+                lat_bounds=None, lon_bounds=None, fill_value=None):
+    """Máscara booleana vectorizada: NaN/fill, QA y bounding box."""
+    mask = np.isfinite(value) & np.isfinite(lat) & np.isfinite(lon)
+    if fill_value is not None:
+        mask &= value != fill_value
+    if qa is not None and qa_threshold is not None:
+        mask &= qa >= qa_threshold
+    if lat_bounds and lon_bounds:
+        mask &= (lat >= lat_bounds[0]) & (lat <= lat_bounds[1])
+        mask &= (lon >= lon_bounds[0]) & (lon <= lon_bounds[1])
+    return mask
+
+
+def _make_batch(station_id, parameter, dt, lat, lon, value, qa=None, mask=None):
+    """Lote columnar: metadatos escalares + arrays NumPy alineados."""
+    if mask is not None:
+        lat, lon, value = lat[mask], lon[mask], value[mask]
+        qa = qa[mask] if qa is not None else None
+    return {
+        "station_id": station_id,
+        "parameter": parameter,
+        "datetime": dt,
+        "latitude": lat.astype(np.float64, copy=False),
+        "longitude": lon.astype(np.float64, copy=False),
+        "value": value.astype(np.float64, copy=False),
+        "qa_value": qa,
+    }
+
+
+def _iter_pixel_chunks(ds, lat_name, lon_name, var_names, chunk_size=SAT_CHUNK_SIZE):
+    """
+    Recorre el dataset en bloques de `chunk_size` a lo largo de la primera dimensión
+    espacial, devolviendo arrays planos (lat, lon, *vars). xarray sólo lee de disco
+    el bloque pedido, así que la memoria pico no depende del tamaño del granule.
+    Funciona tanto con L2 (lat/lon 2D) como con L3 (ejes 1D) gracias a xr.broadcast.
+    """
+    ref = ds[var_names[0]] if var_names else ds[lat_name]
+    dim = next((d for d in ref.dims if ds.sizes[d] > 1), ref.dims[0])
+    names = (lat_name, lon_name, *var_names)
+    for start in range(0, ds.sizes[dim], chunk_size):
+        parts = [
+            ds[n].isel({dim: slice(start, start + chunk_size)}) if dim in ds[n].dims else ds[n]
+            for n in names
+        ]
+        yield [a.values.ravel() for a in xr.broadcast(*parts)]
+
+
+def _take(batches, limit):
+    """Corta el flujo de lotes tras `limit` filas (None = sin límite)."""
+    if limit is None:
+        yield from batches
+        return
+    remaining = limit
+    for batch in batches:
+        if remaining <= 0:
+            return
+        n = len(batch["value"])
+        if n > remaining:
+            keep = slice(0, remaining)
+            batch = dict(batch, latitude=batch["latitude"][keep], longitude=batch["longitude"][keep],
+                         value=batch["value"][keep],
+                         qa_value=batch["qa_value"][keep] if batch["qa_value"] is not None else None)
+            n = remaining
+        remaining -= n
+        yield batch
+
+
+def process_tropomi_l2(file_path: str, qa_threshold: float = 0.75,
+                       lat_bounds=None, lon_bounds=None,
+                       limit=DEMO_LIMIT, chunk_size=SAT_CHUNK_SIZE, roles=None) -> Iterator[dict]:
+    """
+    Procesa Sentinel-5P TROPOMI L2 NO₂ troposférico y genera lotes columnares
+    listos para insert_measurements. QA, bbox y NaN/fill se filtran con NumPy.
+    Con bbox usa nc_reader.read_bbox y sólo lee las scanlines que cubren la región.
+    DEMO: por defecto limita a DEMO_LIMIT filas; limit=None procesa el granule completo.
+    roles: variables ya resueltas por granule_catalog (si no, el nombre estándar).
+    Los errores de lectura se propagan: un granule leído a medias no cuenta como cargado.
+    """
+    var = (roles or {}).get("data") or "nitrogendioxide_tropospheric_column"
+
+    def bbox_batches():
+        # Lectura perezosa: sólo lat/lon completos + el hyperslab del bbox
+        arrays, info = read_bbox(file_path, [var, "qa_value"], lat_bounds, lon_bounds)
+        if arrays is None:
+            print("  → El granule no intersecta el bbox, se omite.")
+            return
+        lat, lon, no2, qa = (arrays[k].ravel() for k in ("latitude", "longitude", var, "qa_value"))
+        mask = _valid_mask(lat, lon, no2, qa=qa, qa_threshold=qa_threshold,
+                           lat_bounds=lat_bounds, lon_bounds=lon_bounds)
+        if mask.any():
+            yield _make_batch("TROPOMI", "no2_tropospheric_column", _parse_coverage(info["time_coverage_start"]),
+                              lat, lon, no2, qa=qa, mask=mask)
+
+    def batches():
+        with xr.open_dataset(file_path, group="PRODUCT") as ds:
+            now = _coverage_start(ds)
+            for lat, lon, no2, qa in _iter_pixel_chunks(ds, "latitude", "longitude",
+                                                        [var, "qa_value"], chunk_size):
+                mask = _valid_mask(lat, lon, no2, qa=qa, qa_threshold=qa_threshold,
+                                   lat_bounds=lat_bounds, lon_bounds=lon_bounds)
+                if mask.any():
+                    yield _make_batch("TROPOMI", "no2_tropospheric_column", now,
+                                      lat, lon, no2, qa=qa, mask=mask)
+
+    return _take(bbox_batches() if lat_bounds and lon_bounds else batches(), limit)
 
-    except Exception as e:
-        print(f"⚠ Error procesando TROPOMI L2: {e}")
-        return []
 
 def process_tempo(file_path: str,
-                  lat_bounds=None, lon_bounds=None) -> list:
+                  lat_bounds=None, lon_bounds=None,
+                  limit=DEMO_LIMIT, chunk_size=SAT_CHUNK_SIZE, roles=None) -> Iterator[dict]:
     """
-    Procesa TEMPO L3 y devuelve registros listos para measurements.
-    DEMO: siempre limita a 50 filas (dummy si no hay variables útiles).
+    Procesa TEMPO L3 y genera lotes columnares listos para insert_measurements.
+    Grupo, lat/lon y variable salen del catálogo de granules (roles), así que
+    el archivo no se vuelve a sondear en cada corrida.
+    DEMO: por defecto limita a DEMO_LIMIT filas (dummy si no hay variables útiles).
+    Los errores de lectura se propagan, como en process_tropomi_l2.
     """
-    import xarray as xr
-    import pandas as pd
-    from datetime import datetime, timezone
+    def batches():
+        r = roles or CATALOG.get(file_path, "tempo")["roles"]
+        with xr.open_dataset(file_path, group=r["group"] or None) as ds:
+            now = _coverage_start(ds)
 
-    try:
-        try:
-            ds = xr.open_dataset(file_path, group="geolocation")
-        except Exception:
-            ds = xr.open_dataset(file_path)
-
-        dt_str = ds.attrs.get("time_coverage_start")
-        now = datetime.fromisoformat(dt_str.replace("Z", "+00:00")) if dt_str else datetime.now(timezone.utc)
-
-        lat, lon = None, None
-        for v in ds.variables:
-            if "lat" in v.lower() and lat is None:
-                lat = ds[v].values.flatten()
-            if "lon" in v.lower() and lon is None:
-                lon = ds[v].values.flatten()
-
-        if lat is None or lon is None:
-            print("⚠ TEMPO sin lat/lon válidos")
-            return []
-
-        # Buscar variable
-        data = None
-        param = "cloud_fraction"
-        for var in ds.variables:
-            if "cloud" in var.lower() and "fraction" in var.lower():
-                data = ds[var].values.flatten()
-                break
-        if data is None:
-            for var in ds.variables:
-                if "no2" in var.lower() and "column" in var.lower():
-                    data = ds[var].values.flatten()
-                    param = var
-                    break
-        if data is None:
-            data = [0.0] * len(lat)
-            param = "cloud_fraction_dummy"
-
-        df = pd.DataFrame({
-            "latitude": lat,
-            "longitude": lon,
-            "value": data
-        })
+            lat_name, lon_name = r["lat"], r["lon"]
+            if lat_name is None or lon_name is None:
+                print("⚠ TEMPO sin lat/lon válidos")
+                return
 
-        # bounding box opcional
-        if lat_bounds and lon_bounds:
-            filtered = df[
-                (df["latitude"] >= lat_bounds[0]) & (df["latitude"] <= lat_bounds[1]) &
-                (df["longitude"] >= lon_bounds[0]) & (df["longitude"] <= lon_bounds[1])
-            ]
-            if not filtered.empty:
-                df = filtered
-
-        # ⚡ DEMO: limitar a 50 filas
-        df = df.head(50)
-
-        records = []
-        for _, row in df.iterrows():
-            records.append({
-                "station_id": "TEMPO",
-                "parameter": param,
-                "value": float(row["value"]) if row["value"] is not None else 0.0,
-                "datetime": now,
-                "latitude": float(row["latitude"]),
-                "longitude": float(row["longitude"])
-            })
+            var, param = r["data"], r["parameter"]
+            fill_value = ds[var].attrs.get("_FillValue") if var else None
 
-        return records
+            for arrays in _iter_pixel_chunks(ds, lat_name, lon_name, [var] if var else [], chunk_size):
+                lat, lon = arrays[0], arrays[1]
+                data = arrays[2] if var else np.zeros_like(lat, dtype=np.float64)
+                mask = _valid_mask(lat, lon, data, lat_bounds=lat_bounds, lon_bounds=lon_bounds,
+                                   fill_value=fill_value)
+                if mask.any():
+                    yield _make_batch("TEMPO", param, now, lat, lon, data, mask=mask)
 
-    except Exception as e:
-        print(f"⚠ Error procesando TEMPO: {e}")
-        return []
+    return _take(batches(), limit)
 
 # ==========================
 # Utilidad descarga
 # ==========================
+GDRIVE_URL = "https://drive.usercontent.google.com/download?id={file_id}&export=download&confirm=t"
+
+
 def download_from_gdrive(file_id, output):
-    url = f"https://drive.google.com/uc?id={file_id}"
+    """Baja un archivo público de Drive; si ya está en la caché no vuelve a bajarlo."""
     print(f"⬇ Descargando {output} desde Google Drive...")
-    gdown.download(url, output, quiet=False, fuzzy=True)
-    return output
+    return fetch(GDRIVE_URL.format(file_id=file_id), dest=output)
 
 
 # ==========================
 # Fetch principal
 # ==========================
-def fetch_tempo_and_tropomi():
-    """Descarga y procesa archivos de TROPOMI (Sentinel-5P) y TEMPO (NASA)"""
-    rows_all = []
+def fetch_tempo_and_tropomi(full=False, raw=False):
+    """
+    Descarga y procesa archivos de TROPOMI (Sentinel-5P) y TEMPO (NASA).
+    Los lotes van directo del procesador al loader (generadores), sin acumularse.
+    full=True quita el límite DEMO_LIMIT y procesa los granules completos.
+    Por defecto se guardan celdas de grilla (satellite_grid); raw=True guarda
+    la media de cada celda como measurements de una estación por celda.
+    Sólo se cargan granules más nuevos que el watermark de cada producto; en
+    modo demo (sin full) el watermark no avanza, porque el granule no se leyó entero.
+    """
+    limit = None if full else DEMO_LIMIT
+    load = insert_measurements if raw else insert_satellite_grid
+    inserted_all = 0
 
     try:
         # ==========================
@@ -285,13 +586,19 @@ def fetch_tempo_and_tropomi():
             "1Leyz9VtQw_ezob6PzUYCobSOIDGsW9fx",  # ID de Drive
             "tropomi_sample.nc"
         )
-        print(f"📌 Procesando {tropomi_file} como TROPOMI L2 NO₂...")
-        tropomi_rows = process_tropomi_l2(
-            tropomi_file,
-            lat_bounds=(4, 6),   # ajusta para tu región
-            lon_bounds=(-75, -73)
-        )
-        rows_all.extend(tropomi_rows)
+        entry = CATALOG.get(tropomi_file, "tropomi")
+        if intersects(entry, SAT_LAT_BOUNDS, SAT_LON_BOUNDS):
+            print(f"📌 Procesando {tropomi_file} como TROPOMI L2 NO₂...")
+            inserted, _ = load_incremental(load, process_tropomi_l2(
+                tropomi_file,
+                lat_bounds=SAT_LAT_BOUNDS,
+                lon_bounds=SAT_LON_BOUNDS,
+                limit=limit,
+                roles=entry["roles"]
+            ), advance=limit is None)
+            inserted_all += inserted
+        else:
+            print(f"  → {tropomi_file} no intersecta el bbox, se omite.")
 
     except Exception as e:
         print(f"⚠ Error procesando TROPOMI: {e}")
@@ -305,64 +612,298 @@ def fetch_tempo_and_tropomi():
             "1w4aufwFEnBxqZso4B7wtTivDG96Yqb7r",  # ID de Drive
             "tempo_sample.nc"
         )
-        print(f"📌 Procesando {tempo_file} como TEMPO...")
-        tempo_rows = process_tempo(
-            tempo_file,
-            lat_bounds=(4, 6),   # ajusta para tu región
-            lon_bounds=(-75, -73)
-        )
-        rows_all.extend(tempo_rows)
+        entry = CATALOG.get(tempo_file, "tempo")
+        if intersects(entry, SAT_LAT_BOUNDS, SAT_LON_BOUNDS):
+            print(f"📌 Procesando {tempo_file} como TEMPO...")
+            inserted, _ = load_incremental(load, process_tempo(
+                tempo_file,
+                lat_bounds=SAT_LAT_BOUNDS,
+                lon_bounds=SAT_LON_BOUNDS,
+                limit=limit,
+                roles=entry["roles"]
+            ), advance=limit is None)
+            inserted_all += inserted
+        else:
+            print(f"  → {tempo_file} no intersecta el bbox, se omite.")
 
     except Exception as e:
         print(f"⚠ Error procesando TEMPO: {e}")
 
-    # ==========================
-    # Guardar en DB
-    # ==========================
-    if rows_all:
-        insert_measurements(rows_all)  # usa tu función que mete a measurements
-        print(f"✅ Insertadas {len(rows_all)} filas en measurements")
-    else:
+    if not inserted_all:
         print("⚠ No se insertaron filas de satélites (TROPOMI/TEMPO)")
 
 
-def request_with_retries(url, params=None, headers=None, max_retries=3, backoff=1.5):
+def load_incremental(load, batches, skip_old=True, advance=True, failed=None):
+    """
+    Pasa a `load` sólo los lotes más nuevos que el watermark satellite:<producto>
+    (skip_old=False deja pasar todo, p.ej. en backfills) y, si la carga tuvo
+    éxito, avanza el watermark al último granule cargado. advance=False (granules
+    recortados a DEMO_LIMIT) carga sin mover el watermark: una corrida completa
+    posterior no debe darlos por cubiertos.
+    failed: {source: [inicio de cada granule que no se pudo leer]} que el
+    generador de lotes va llenando. El watermark queda antes del granule fallido
+    más viejo (None = inicio desconocido, no se avanza), así la próxima corrida
+    lo reintenta aunque haya granules más nuevos cargados.
+    """
+    marks = load_watermarks()
+    seen = {}
+    old = {"batches": 0}
+    failed = {} if failed is None else failed
+
+    def fresh():
+        for batch in batches:
+            source = f"satellite:{batch['station_id'].lower()}"
+            mark = marks.get(source)
+            if skip_old and mark is not None and batch["datetime"] <= mark:
+                old["batches"] += 1
+                continue
+            seen.setdefault(source, set()).add(batch["datetime"])
+            yield batch
+
+    result = load(fresh())
+    if old["batches"]:
+        print(f"  → {old['batches']} lotes omitidos: ya cubiertos por el watermark")
+    # los loaders devuelven (0, 0) si fallan; con filas cargadas la suma es > 0
+    if advance and seen and sum(result) > 0:
+        for source, starts in seen.items():
+            bad = failed.get(source, [])
+            if None in bad:
+                print(f"  → {source}: granule fallido sin fecha, el watermark no avanza")
+                continue
+            done = [d for d in starts if not bad or d < min(bad)]
+            if done:
+                set_watermark(source, max(done))
+    return result
+
+
+# ==========================
+# Ingesta multi-granule (backfill)
+# ==========================
+GRANULE_PROCESSORS = {
+    "tropomi": process_tropomi_l2,
+    "tempo": process_tempo,
+}
+
+
+def granule_start(path):
+    """Inicio de cobertura según el nombre (…_20251002T143110_…), o None."""
+    m = re.search(r"(\d{8}T\d{6})", os.path.basename(path))
+    return datetime.strptime(m.group(1), "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc) if m else None
+
+
+def list_granules(sources):
+    """Expande directorios y archivos sueltos en una lista ordenada de .nc."""
+    paths = []
+    for src in sources:
+        if os.path.isdir(src):
+            paths.extend(sorted(glob.glob(os.path.join(src, "*.nc"))))
+        else:
+            paths.append(src)
+    return paths
+
+
+def _decode_granule(path, product, entry, lat_bounds, lon_bounds, limit):
+    """
+    Worker: decodifica y filtra un granule (CPU) y devuelve sus lotes ya materializados.
+    Si el granule no estaba catalogado lo describe aquí (entry=None) y devuelve
+    la entrada para que el proceso padre la guarde.
+    """
+    t0 = time.perf_counter()
+    product = product or detect_product(path)
+    entry = entry or describe_granule(path, product)
+    if not intersects(entry, lat_bounds, lon_bounds):
+        return path, [], time.perf_counter() - t0, entry
+    process = GRANULE_PROCESSORS[product]
+    batches = list(process(path, lat_bounds=lat_bounds, lon_bounds=lon_bounds, limit=limit,
+                           roles=entry["roles"]))
+    return path, batches, time.perf_counter() - t0, entry
+
+
+def ingest_granules(sources, product=None, workers=None,
+                    lat_bounds=SAT_LAT_BOUNDS, lon_bounds=SAT_LON_BOUNDS, full=True, raw=False,
+                    incremental=False):
+    """
+    Ingiere muchos granules: la decodificación corre en un pool de procesos y
+    todos los lotes pasan por una sola conexión del loader (insert_satellite_grid,
+    o insert_measurements con raw=True).
+    Como mucho hay 2 x workers granules decodificados esperando en memoria.
+    incremental=True descarta, sin abrirlos, los granules cuyo inicio (según el
+    catálogo o el nombre) no supera el watermark del producto. El watermark se avanza
+    sólo con full=True (granules leídos enteros) y nunca más allá de un granule
+    que falló al decodificarse.
+    Los granules ya catalogados que no intersectan el bbox se descartan sin abrirlos.
+    """
+    paths = list_granules(sources)
+    known = {p: CATALOG.lookup(p) for p in paths}
+    outside = {p for p in paths if known[p] and not intersects(known[p], lat_bounds, lon_bounds)}
+    if outside:
+        paths = [p for p in paths if p not in outside]
+        print(f"  → {len(outside)} granules fuera del bbox (según el catálogo)")
+    if incremental:
+        marks = load_watermarks()
+
+        def is_new(path):
+            entry = known[path]
+            start = _parse_coverage(entry["time_start"]) if entry and entry["time_start"] else granule_start(path)
+            mark = marks.get(f"satellite:{product or detect_product(path)}")
+            return start is None or mark is None or start > mark
+
+        before = len(paths)
+        paths = [p for p in paths if is_new(p)]
+        print(f"  → {before - len(paths)} granules omitidos por watermark")
+    if not paths:
+        print("⚠ No se encontraron granules para ingerir")
+        return 0, 0
+    workers = workers or os.cpu_count() or 1
+    limit = None if full else DEMO_LIMIT
+    print(f"🛰️ Ingestando {len(paths)} granules con {workers} workers...")
+
+    t0 = time.perf_counter()
+    stats = {"done": 0, "decode_s": 0.0}
+
+    failed = {}
+
+    def decoded_batches(pool):
+        pending = deque()
+        todo = iter(paths)
+        def submit(path):
+            pending.append((path, pool.submit(_decode_granule, path, product, known[path],
+                                              lat_bounds, lon_bounds, limit)))
+
+        for path in itertools.islice(todo, 2 * workers):
+            submit(path)
+        while pending:
+            path, fut = pending.popleft()
+            try:
+                path, batches, seconds, entry = fut.result()
+            except Exception as e:
+                print(f"  ❌ Error decodificando {os.path.basename(path)}: {e}")
+                batches, seconds = [], 0.0
+                # el watermark no debe pasar este granule: la próxima corrida lo reintenta
+                entry = known[path]
+                start = _parse_coverage(entry["time_start"]) if entry and entry["time_start"] else granule_start(path)
+                failed.setdefault(f"satellite:{product or detect_product(path)}", []).append(start)
+            else:
+                if known[path] is None:
+                    CATALOG.put(entry)
+                print(f"  → {os.path.basename(path)}: {sum(len(b['value']) for b in batches)} píxeles ({seconds:.2f}s)")
+            for nxt in itertools.islice(todo, 1):
+                submit(nxt)
+            stats["done"] += 1
+            stats["decode_s"] += seconds
+            yield from batches
+
+    load = insert_measurements if raw else insert_satellite_grid
+    with ProcessPoolExecutor(max_workers=workers, initializer=dispose_after_fork) as pool:
+        inserted, skipped = load_incremental(load, decoded_batches(pool), skip_old=incremental,
+                                             advance=limit is None, failed=failed)
+
+    elapsed = time.perf_counter() - t0
+    rate = stats["done"] / elapsed * 60 if elapsed else 0.0
+    print(f"✅ {stats['done']} granules en {elapsed:.1f}s ({rate:.1f} granules/min, "
+          f"{stats['decode_s']:.1f}s de CPU de decodificación)")
+    return inserted, skipped
+
+
+_http = threading.local()
+
+
+def _session():
+    """requests.Session por hilo (reutiliza conexiones keep-alive)."""
+    if not hasattr(_http, "session"):
+        _http.session = requests.Session()
+    return _http.session
+
+
+HTTP_CACHE = ResponseCache()
+
+
+def request_with_retries(url, params=None, headers=None, max_retries=3, backoff=1.5, limiter=None,
+                         cache=HTTP_CACHE):
+    """
+    GET con reintentos pasando por el token bucket del host (rate_limit.get_limiter).
+    Un 429 congela el bucket durante Retry-After para todos los hilos.
+    Las respuestas pasan por la caché en disco (http_cache): dentro del TTL no
+    se toca la red y, vencidas, se revalidan con ETag/Last-Modified (304).
+    """
     headers = headers or {}
+    state, cached_data, validators = cache.lookup(url, params)
+    if state == "fresh":
+        return cached_data
+    if validators:
+        headers = {**headers, **validators}
+    limiter = limiter or get_limiter(url)
     for attempt in range(1, max_retries + 1):
+        limiter.acquire()
         try:
-            r = requests.get(url, params=params, headers=headers, timeout=20)
+            r = _session().get(url, params=params, headers=headers, timeout=20)
+            if r.status_code == 304 and state == "stale":
+                cache.revalidated(url, params)
+                return cached_data
+            if r.status_code == 429:
+                wait = retry_after_seconds(r, default=backoff * attempt * 10)
+                limiter.pause(wait)
+                print(f"  ⚠ Rate limit (429), pausando {wait:.0f}s (attempt {attempt})")
             r.raise_for_status()
-            return r.json()
+            data = r.json()
+            cache.store(url, params, r, data)
+            return data
         except Exception as e:
             print(f"  ⚠ request error (attempt {attempt}) -> {e}")
             if attempt == max_retries:
                 raise
-            time.sleep(backoff * attempt)
+            if getattr(getattr(e, "response", None), "status_code", None) != 429:
+                time.sleep(backoff * attempt)
+
+
+def fetch_pages(url, params, headers=None, max_pages=None, workers=OPENAQ_WORKERS, stop_statuses=()):
+    """
+    Pagina `url` pidiendo `workers` páginas en paralelo por ventana; el ritmo real
+    lo marca el token bucket compartido. Para en la primera página vacía o corta,
+    o en un HTTPError con status en `stop_statuses`.
+    """
+    limit = params.get("limit")
+    results = []
+    page = 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while max_pages is None or page <= max_pages:
+            last = page + workers if max_pages is None else min(page + workers, max_pages + 1)
+            window = range(page, last)
+            futures = [pool.submit(request_with_retries, url, {**params, "page": p}, headers) for p in window]
+            done = False
+            for p, fut in zip(window, futures):
+                try:
+                    data = fut.result()
+                except requests.exceptions.HTTPError as e:
+                    status = e.response.status_code if e.response is not None else None
+                    if status in stop_statuses:
+                        print(f"⚠ Paginación detenida en página {p} (status={status})")
+                        done = True
+                        break
+                    raise
+                page_results = data.get("results", [])
+                if not page_results:
+                    done = True
+                    break
+                results.extend(page_results)
+                print(f"  → página {p}, acumuladas {len(results)} estaciones")
+                if limit and len(page_results) < limit:
+                    done = True
+                    break
+            if done:
+                for fut in futures:
+                    fut.cancel()
+                break
+            page = last
+    return results
+
 
 def fetch_locations_by_country(country=COUNTRY, limit=100, max_pages=5):
     """Intenta listar locations por city/country. Devuelve lista de locations (dicts)."""
     print(f"🔎 Buscando estaciones por country={country} ...")
-    results = []
-    page = 1
     headers = {"x-api-key": OPENAQ_KEY} if OPENAQ_KEY else {}
-    while page <= max_pages:
-        params = {"country": country, "limit": limit, "page": page}
-        try:
-            data = request_with_retries(OPENAQ_LOCATIONS, params=params, headers=headers)
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:
-                print("⚠ Rate limit alcanzado, esperando 30s...")
-                time.sleep(30)   # backoff
-                continue
-            else:
-                raise
-        page_results = data.get("results", [])
-        if not page_results:
-            break
-        results.extend(page_results)
-        print(f"  → página {page}, acumuladas {len(results)} estaciones")
-        page += 1
-        time.sleep(2)  # rate-limit friendly
+    params = {"country": country, "limit": limit}
+    results = fetch_pages(OPENAQ_LOCATIONS, params, headers=headers, max_pages=max_pages)
     print(f"  → Encontradas {len(results)} estaciones por city.")
     return results
 
@@ -383,78 +924,156 @@ def filter_active_locations(locations, days=60):
                 pass
     return active
 
-def fetch_locations_by_coords(lat=LAT, lon=LON, radius=RADIUS, limit=100):
+def fetch_locations_by_coords(lat=LAT, lon=LON, radius=RADIUS, limit=100, max_pages=20):
     print(f"🔎 Buscando estaciones por coords {lat},{lon} distance={radius}m ...")
-    results = []
-    page = 1
     headers = {"x-api-key": OPENAQ_KEY} if OPENAQ_KEY else {}
-    while True:
-        params = {"coordinates": f"{lat},{lon}", "distance": radius, "limit": limit, "page": page}
-        try:
-            data = request_with_retries(OPENAQ_LOCATIONS, params=params, headers=headers)
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code in (404, 500):
-                print(f"⚠ No se pudieron obtener estaciones (status={e.response.status_code}) → abortando fallback coords.")
-                break
-            else:
-                raise
-        page_results = data.get("results", [])
-        if not page_results:
-            break
-        results.extend(page_results)
-        page += 1
+    params = {"coordinates": f"{lat},{lon}", "distance": radius, "limit": limit}
+    results = fetch_pages(OPENAQ_LOCATIONS, params, headers=headers, max_pages=max_pages,
+                          stop_statuses=(404, 500))
     print(f"  → Encontradas {len(results)} estaciones por coords.")
     return results
 
 def save_locations_to_db(locations):
+    stations = {}
+    for loc in locations:
+        loc_id = loc.get("id") or loc.get("locationId") or loc.get("name")
+        name = loc.get("name") or loc.get("location") or loc.get("city") or str(loc_id)
+        coords = loc.get("coordinates") or {}
+        stations[name] = (coords.get("latitude"), coords.get("longitude"), "station", "OpenAQ")
     conn = get_conn()
     cur = conn.cursor()
-    inserted = 0
-    for loc in locations:
-        try:
-            loc_id = loc.get("id") or loc.get("locationId") or loc.get("name")
-            name = loc.get("name") or loc.get("location") or loc.get("city") or str(loc_id)
-            coords = loc.get("coordinates") or {}
-            lat = coords.get("latitude")
-            lon = coords.get("longitude")
-            cur.execute("""
-                INSERT INTO stations (nombre, lat, lon, tipo, fuente)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (nombre) DO NOTHING
-            """, (clean_str(name), lat, lon, "station", "OpenAQ"))
-            inserted += 1
-        except Exception as e:
-            print("  ❌ Error insert station:", e)
-    conn.commit()
-    cur.close()
-    conn.close()
-    print(f"  → Guardadas {inserted} estaciones en DB (ON CONFLICT DO NOTHING).")
+    try:
+        ids = resolve_station_ids(cur, stations)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        STATIONS.invalidate()
+        print("  ❌ Error insert station:", e)
+        ids = {}
+    finally:
+        cur.close()
+        conn.close()
+    print(f"  → Guardadas {len(ids)} estaciones en DB (sólo las nuevas se insertan).")
 
 # ======================
 # INSERT STATION seguro
 # ======================
 def insert_station(conn, loc_id, name, city, country, lat, lon):
-    """Inserta una estación en la DB, maneja rollback si hay error"""
-    conn = get_conn()
+    """
+    Asegura una estación usando `conn` (o una del pool si es None) y devuelve su id.
+    Si ya está en el registro en memoria no toca la DB.
+    """
+    own = conn is None
+    conn = conn or get_conn()
     cur = conn.cursor()
     try:
-        cur.execute("""
-            INSERT INTO stations (nombre, lat, lon, tipo, fuente)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (nombre) DO NOTHING
-        """, (clean_str(name), lat, lon, "station", "OpenAQ"))
+        sid = resolve_station_ids(cur, {name: (lat, lon, "station", "OpenAQ")}).get(name)
         conn.commit()
+        return sid
     except Exception as e:
         print(f"  ❌ Error insert station {loc_id}: {e}")
         conn.rollback()
+        STATIONS.invalidate()
     finally:
         cur.close()
+        if own:
+            conn.close()
 
 
 # ================================
-# MAIN OpenAQ con resumen debug
+# OpenAQ histórico: pipeline streaming + checkpoints
 # ================================
-def populate_openaq_historical(days=60):
+OPENAQ_CHECKPOINTS_DDL = """
+    CREATE TABLE IF NOT EXISTS openaq_checkpoints (
+        location_id   integer NOT NULL,
+        sensor_id     integer NOT NULL,
+        last_datetime timestamptz NOT NULL,
+        updated_at    timestamptz DEFAULT now(),
+        PRIMARY KEY (location_id, sensor_id)
+    )
+"""
+
+
+def _location_name(loc):
+    return clean_str(loc.get("name") or loc.get("location") or loc.get("city") or loc.get("id"))
+
+
+def _parse_openaq_measurements(results, station_pk, parameter, unit):
+    """Generador de tuplas para copy_measurements a partir de una página de /sensors/{id}/measurements."""
+    for m in results:
+        period = m.get("period") or {}
+        dt = (period.get("datetimeTo") or {}).get("utc") or (period.get("datetimeFrom") or {}).get("utc")
+        value = m.get("value")
+        if dt is None or value is None:
+            continue
+        yield (station_pk, dt, parameter, value, unit, "OpenAQ")
+
+
+def _sensor_pages(sensor_id, date_from, date_to, headers, limit=1000, max_pages=500):
+    """Generador de páginas (listas de resultados) de un sensor, en orden temporal."""
+    url = OPENAQ_MEASUREMENTS.format(sensor_id=sensor_id)
+    for page in range(1, max_pages + 1):
+        params = {"datetime_from": date_from, "datetime_to": date_to, "limit": limit, "page": page}
+        results = request_with_retries(url, params=params, headers=headers).get("results", [])
+        if not results:
+            return
+        yield results
+        if len(results) < limit:
+            return
+
+
+def _put(q, item, stop):
+    """q.put que se rinde si `stop` se activa (el consumidor ya no va a vaciar la cola)."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=OPENAQ_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce_sensor(q, task, date_to, headers, stop):
+    """Worker: baja las páginas de un sensor y las empuja a la cola acotada hasta que `stop` se active."""
+    key = (task["location_id"], task["sensor_id"])
+    try:
+        for results in _sensor_pages(task["sensor_id"], task["date_from"], date_to, headers):
+            if stop.is_set():
+                return
+            rows = list(_parse_openaq_measurements(results, task["station_pk"], task["parameter"], task["unit"]))
+            if rows and not _put(q, (key, rows, max(r[1] for r in rows)), stop):
+                return
+    except Exception as e:
+        print(f"  ❌ Error bajando sensor {task['sensor_id']} ({task['parameter']}): {e}")
+    finally:
+        _put(q, (key, None, None), stop)
+
+
+def _flush_openaq(conn, rows, checkpoints):
+    """COPY + upsert de las filas y avance de los checkpoints en la misma transacción."""
+    inserted, _ = copy_measurements(conn, [_copy_buffer(rows)])
+    cur = conn.cursor()
+    try:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO openaq_checkpoints (location_id, sensor_id, last_datetime)
+            VALUES %s
+            ON CONFLICT (location_id, sensor_id) DO UPDATE
+            SET last_datetime = GREATEST(openaq_checkpoints.last_datetime, EXCLUDED.last_datetime),
+                updated_at = now()
+        """, [(loc, sensor, dt) for (loc, sensor), dt in checkpoints.items()])
+    finally:
+        cur.close()
+    conn.commit()
+    return inserted
+
+
+def populate_openaq_historical(days=60, workers=OPENAQ_WORKERS):
+    """
+    Backfill de measurements OpenAQ como pipeline streaming:
+    hilos productores (uno por sensor en vuelo) -> cola acotada -> COPY por lotes.
+    Cada sensor guarda su checkpoint en openaq_checkpoints junto con sus filas,
+    así que una corrida interrumpida retoma desde el último dato confirmado.
+    """
     print(f"📌 Iniciando ETL OpenAQ histórico (últimos {days} días)...")
     locs = fetch_locations_by_country()
     print(f"→ Encontradas {len(locs)} estaciones por city.")
@@ -468,31 +1087,109 @@ def populate_openaq_historical(days=60):
         print("❌ No se encontraron estaciones OpenAQ cerca. Revisa parámetros.")
         return
 
-    conn = get_conn()
-    for loc in locs:
-        loc_id = loc.get("id") or loc.get("locationId") or loc.get("name")
-        name = loc.get("name") or loc.get("location")
-        city = loc.get("city")
-        country = loc.get("country")
-        coords = loc.get("coordinates", {})
-        lat = coords.get("latitude")
-        lon = coords.get("longitude")
-        insert_station(conn, loc_id, name, city, country, lat, lon)
-    conn.close()
-
-    print(f"→ Guardadas {len(locs)} estaciones en DB (ON CONFLICT DO NOTHING).")
-
     # Fechas ISO
     date_to = datetime.now(timezone.utc)
     date_from = date_to - timedelta(days=days)
     df, dt = date_from.isoformat(), date_to.isoformat()
-    print(f"📅 Bajando measurements desde {df} hasta {dt} ...")
 
+    conn = get_conn()
+    cur = conn.cursor()
+    ready = False
+    try:
+        station_ids = resolve_station_ids(cur, {
+            _location_name(loc): ((loc.get("coordinates") or {}).get("latitude"),
+                                  (loc.get("coordinates") or {}).get("longitude"), "station", "OpenAQ")
+            for loc in locs
+        })
+        cur.execute(OPENAQ_CHECKPOINTS_DDL)
+        cur.execute("SELECT location_id, sensor_id, last_datetime FROM openaq_checkpoints")
+        checkpoints = {(loc, sensor): last for loc, sensor, last in cur.fetchall()}
+        conn.commit()
+        ready = True
+    except BaseException:
+        conn.rollback()
+        STATIONS.invalidate()
+        raise
+    finally:
+        cur.close()
+        if not ready:
+            conn.close()   # si todo salió bien la conexión sigue para el pipeline de abajo
+    print(f"→ Guardadas {len(station_ids)} estaciones en DB (sólo las nuevas se insertan).")
+
+    tasks = []
+    up_to_date = skipped_sensors = 0
+    for loc in locs:
+        station_pk = station_ids.get(_location_name(loc))
+        if station_pk is None or loc.get("id") is None:
+            continue
+        loc_last = (loc.get("datetimeLast") or {}).get("utc")
+        loc_last = datetime.fromisoformat(loc_last.replace("Z", "+00:00")) if loc_last else None
+        for sensor in loc.get("sensors") or []:
+            param = sensor.get("parameter") or {}
+            if sensor.get("id") is None or not param.get("name"):
+                # measurements.parameter es NOT NULL: una fila así haría fallar todo el COPY del lote
+                skipped_sensors += 1
+                continue
+            last = checkpoints.get((loc["id"], sensor["id"]))
+            if last and loc_last and loc_last <= last:
+                up_to_date += 1   # la location no reporta nada posterior al checkpoint
+                continue
+            tasks.append({
+                "location_id": loc["id"],
+                "sensor_id": sensor["id"],
+                "station_pk": station_pk,
+                "parameter": param["name"],
+                "unit": param.get("units"),
+                "date_from": max(last, date_from).isoformat() if last else df,
+            })
+    resumed = sum(1 for t in tasks if t["date_from"] != df)
+    print(f"📅 Bajando measurements desde {df} hasta {dt} "
+          f"({len(tasks)} sensores, {resumed} retomados desde checkpoint, {up_to_date} al día, "
+          f"{skipped_sensors} sin id o parámetro) ...")
+
+    headers = {"x-api-key": OPENAQ_KEY} if OPENAQ_KEY else {}
+    q = queue.Queue(maxsize=OPENAQ_QUEUE_PAGES)
     total = 0
-    with_data = 0
-    empty = 0
+    rows_by_location = {}
+    batch, batch_checkpoints = [], {}
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    t0 = time.perf_counter()
+    try:
+        for task in tasks:
+            pool.submit(_produce_sensor, q, task, dt, headers, stop)
+        finished = 0
+        while finished < len(tasks):
+            key, rows, last_dt = q.get()
+            if rows is None:
+                finished += 1
+            else:
+                batch.extend(rows)
+                batch_checkpoints[key] = max(last_dt, batch_checkpoints.get(key, last_dt))
+                rows_by_location[key[0]] = rows_by_location.get(key[0], 0) + len(rows)
+            if batch and (len(batch) >= OPENAQ_BATCH_ROWS or finished == len(tasks)):
+                total += _flush_openaq(conn, batch, batch_checkpoints)
+                batch, batch_checkpoints = [], {}
+        pool.shutdown()
+    except BaseException:
+        # error de escritura o Ctrl-C: los productores paran, se libera la cola
+        # (los bloqueados en put salen) y no se arrancan los sensores pendientes.
+        # Lo ya confirmado queda en openaq_checkpoints y la próxima corrida retoma.
+        stop.set()
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                break
+        pool.shutdown(cancel_futures=True)
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
-    print(f"✅ OpenAQ: total records inserted = {total}")
+    with_data = len(rows_by_location)
+    empty = len({t["location_id"] for t in tasks}) - with_data
+    print(f"✅ OpenAQ: total records inserted = {total} ({time.perf_counter() - t0:.1f}s)")
     print(f"📊 Resumen estaciones → con datos: {with_data}, sin datos: {empty}")
 
 # ------------- OPENWEATHER helpers -------------
@@ -503,10 +1200,15 @@ def fetch_openweather_current():
         print("⚠ OpenWeather current unexpected:", data)
         return
     ts = datetime.fromtimestamp(data["dt"], tz=timezone.utc)
-    insert_weather_safe(ts, data["main"].get("temp"), data["main"].get("humidity"),
-                        data.get("wind", {}).get("speed"), data.get("wind", {}).get("deg", 0),
-                        data["main"].get("pressure"), "OpenWeather")
-    print("✅ OpenWeather current saved:", ts)
+    mark = get_watermark("openweather:current")
+    if mark is not None and ts <= mark:
+        print("→ OpenWeather sin observación nueva desde", mark)
+        return
+    if insert_weather_safe(ts, data["main"].get("temp"), data["main"].get("humidity"),
+                           data.get("wind", {}).get("speed"), data.get("wind", {}).get("deg", 0),
+                           data["main"].get("pressure"), "OpenWeather"):
+        set_watermark("openweather:current", ts)
+        print("✅ OpenWeather current saved:", ts)
 
 
 def insert_weather_safe(timestamp, temp, humidity, wind_speed, wind_dir, pressure, source="OpenWeather"):
@@ -520,69 +1222,370 @@ def insert_weather_safe(timestamp, temp, humidity, wind_speed, wind_dir, pressur
             ON CONFLICT DO NOTHING
         """, (timestamp, LAT, LON, temp, humidity, wind_speed, wind_dir, pressure, clean_str(source)))
         conn.commit()
+        return True
     except Exception as e:
         print("  ❌ Error insert weather:", e)
+        return False
     finally:
         if 'cur' in locals(): cur.close()
         if 'conn' in locals(): conn.close()
 
+# ------------- WEATHER horario (as-of join) -------------
+# weather_hourly: observaciones remuestreadas por hora y celda de WEATHER_GRID_RES.
+# El PK (resolution, cell_i, cell_j, hour) hace que el as-of join de
+# build_model_features sea un index scan hacia atrás con LIMIT 1.
+WEATHER_HOURLY_DDL = """
+    CREATE TABLE IF NOT EXISTS weather_hourly (
+        resolution  double precision NOT NULL,
+        cell_i      integer NOT NULL,
+        cell_j      integer NOT NULL,
+        hour        timestamptz NOT NULL,
+        temp        double precision,
+        humidity    double precision,
+        wind_speed  double precision,
+        wind_dir    double precision,
+        pressure    double precision,
+        n_obs       integer NOT NULL,
+        last_obs_at timestamptz NOT NULL,
+        PRIMARY KEY (resolution, cell_i, cell_j, hour)
+    )
+"""
+
+
+def ensure_weather_schema(cur):
+    """
+    Migra weather_observations.datetime_utc de timestamp a timestamptz y crea
+    weather_hourly. Los valores naive se guardaron al convertir timestamptz a la
+    zona de la sesión, así que se reinterpretan con esa misma zona.
+    """
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'weather_observations' AND column_name = 'datetime_utc'
+    """)
+    row = cur.fetchone()
+    if row and row[0] == "timestamp without time zone":
+        cur.execute("""
+            ALTER TABLE weather_observations
+            ALTER COLUMN datetime_utc TYPE timestamptz USING datetime_utc::timestamptz
+        """)
+        print("→ weather_observations.datetime_utc migrada a timestamptz")
+    cur.execute("CREATE INDEX IF NOT EXISTS weather_observations_datetime_idx ON weather_observations (datetime_utc)")
+    # inserted_at: refresh_weather_hourly recalcula las horas que recibieron observaciones nuevas,
+    # aunque lleguen tarde y sean más viejas que lo ya agregado
+    cur.execute("ALTER TABLE weather_observations ADD COLUMN IF NOT EXISTS inserted_at timestamptz DEFAULT now()")
+    cur.execute("CREATE INDEX IF NOT EXISTS weather_observations_inserted_at_idx ON weather_observations (inserted_at)")
+    cur.execute(WEATHER_HOURLY_DDL)
+
+
+def refresh_weather_hourly(cur, res=WEATHER_GRID_RES):
+    """
+    Recalcula completas las (celda, hora) de weather_hourly que recibieron
+    observaciones desde el watermark "weather_hourly" (sobre inserted_at, menos
+    WATERMARK_OVERLAP), sin importar cuán vieja sea la observación. No hace commit.
+    """
+    ensure_weather_schema(cur)
+    cur.execute(ETL_WATERMARKS_DDL)
+    cur.execute("SELECT max(inserted_at) FROM weather_observations")
+    until = cur.fetchone()[0]
+    cur.execute("SELECT watermark FROM etl_watermarks WHERE source = 'weather_hourly'")
+    row = cur.fetchone()
+    since = row[0] - WATERMARK_OVERLAP if row else datetime(1970, 1, 1, tzinfo=timezone.utc)
+    if until is None or until <= since:
+        return 0
+    cur.execute("""
+        WITH touched AS (
+            SELECT DISTINCT floor(lat / %(res)s)::int AS cell_i, floor(lon / %(res)s)::int AS cell_j,
+                   date_trunc('hour', datetime_utc) AS hour
+            FROM weather_observations
+            WHERE inserted_at > %(since)s AND inserted_at <= %(until)s
+              AND lat IS NOT NULL AND lon IS NOT NULL
+        )
+        INSERT INTO weather_hourly
+        (resolution, cell_i, cell_j, hour, temp, humidity, wind_speed, wind_dir, pressure, n_obs, last_obs_at)
+        SELECT %(res)s, t.cell_i, t.cell_j, t.hour,
+               avg(o.temp), avg(o.humidity), avg(o.wind_speed),
+               -- media circular para la dirección del viento
+               (degrees(atan2(avg(sin(radians(o.wind_dir))), avg(cos(radians(o.wind_dir))))) + 360)::numeric %% 360,
+               avg(o.pressure), count(*), max(o.datetime_utc)
+        FROM touched t
+        JOIN weather_observations o
+          ON floor(o.lat / %(res)s)::int = t.cell_i AND floor(o.lon / %(res)s)::int = t.cell_j
+         AND o.datetime_utc >= t.hour AND o.datetime_utc < t.hour + interval '1 hour'
+        WHERE o.datetime_utc >= (SELECT min(hour) FROM touched)
+          AND o.datetime_utc < (SELECT max(hour) FROM touched) + interval '1 hour'
+        GROUP BY 2, 3, 4
+        ON CONFLICT (resolution, cell_i, cell_j, hour) DO UPDATE
+        SET temp = EXCLUDED.temp,
+            humidity = EXCLUDED.humidity,
+            wind_speed = EXCLUDED.wind_speed,
+            wind_dir = EXCLUDED.wind_dir,
+            pressure = EXCLUDED.pressure,
+            n_obs = EXCLUDED.n_obs,
+            last_obs_at = EXCLUDED.last_obs_at
+    """, {"res": res, "since": since, "until": until})
+    hours = cur.rowcount
+    if hours:
+        # el clima es feature del pronóstico de app.py
+        cur.execute("""
+            SELECT min(lat), max(lat), min(lon), max(lon), max(datetime_utc) FROM weather_observations
+            WHERE inserted_at > %s AND inserted_at <= %s AND lat IS NOT NULL AND lon IS NOT NULL
+        """, (since, until))
+        lat_min, lat_max, lon_min, lon_max, last = cur.fetchone()
+        if lat_min is not None:
+            notify_update(cur, "features", (lat_min, lat_max, lon_min, lon_max), last)
+    set_watermark("weather_hourly", until, cur=cur)
+    return hours
+
+
 # ------------- SATELLITE helper (local NetCDF CSV) -------------
-def insert_tropomi_from_csv(csv_path):
-    """Inserta CSV con columnas datetime, lat, lon, pollutant, value, unit, product"""
-    df = pd.read_csv(csv_path)
+CSV_CHUNK_ROWS = 100_000
+
+# datetime_utc viaja como microsegundos desde epoch: formatear enteros es mucho
+# más barato que formatear timestamps, y lat/lon/value pasan tal cual vienen del CSV.
+SATELLITE_OBS_STAGE_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS satellite_observations_stage (
+        epoch_us  bigint,
+        lat       double precision,
+        lon       double precision,
+        product   text,
+        pollutant text,
+        value     double precision,
+        unit      text,
+        raw_path  text
+    ) ON COMMIT DELETE ROWS
+"""
+
+SATELLITE_OBS_STAGE_COLS = ["epoch_us", "lat", "lon", "product", "pollutant", "value", "unit", "raw_path"]
+
+SATELLITE_OBS_MERGE_SQL = """
+    INSERT INTO satellite_observations
+    (datetime_utc, lat, lon, product, pollutant, value, unit, raw_path)
+    SELECT timestamptz 'epoch' + epoch_us * interval '1 microsecond',
+           lat, lon, product, pollutant, value, unit, raw_path
+    FROM satellite_observations_stage
+    ON CONFLICT DO NOTHING
+"""
+
+
+def _satellite_csv_chunk(chunk, csv_path):
+    """
+    Valida un chunk del CSV (leído como texto) de forma vectorizada.
+    Devuelve (frame listo para COPY, descartadas).
+    """
+    dt = pd.to_datetime(chunk["datetime"], utc=True, errors="coerce", format="ISO8601")
+    numeric = chunk[["lat", "lon", "value"]].apply(pd.to_numeric, errors="coerce")
+    valid = dt.notna() & numeric.notna().all(axis=1)
+    frame = pd.DataFrame({
+        "epoch_us": 0,
+        "lat": chunk["lat"],
+        "lon": chunk["lon"],
+        "product": chunk.get("product"),
+        "pollutant": chunk.get("pollutant"),
+        "value": chunk["value"],
+        "unit": chunk.get("unit"),
+        "raw_path": csv_path,
+    }, index=chunk.index, columns=SATELLITE_OBS_STAGE_COLS)[valid]
+    frame["epoch_us"] = dt[valid].dt.as_unit("us").astype("int64")
+    return frame, int((~valid).sum())
+
+
+def insert_tropomi_from_csv(csv_path, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Inserta CSV con columnas datetime, lat, lon, pollutant, value, unit, product.
+    Lee de a `chunk_rows` filas (memoria constante sin importar el tamaño del
+    archivo), parsea fechas por chunk y carga cada uno con COPY a staging +
+    INSERT ... ON CONFLICT DO NOTHING, con commit por chunk.
+    Devuelve (insertadas, omitidas).
+    """
+    t0 = time.perf_counter()
     conn = get_conn()
     cur = conn.cursor()
-    inserted = 0
-    for _, row in df.iterrows():
-        try:
+    inserted = skipped = read = 0
+    try:
+        cur.execute(SATELLITE_OBS_STAGE_DDL)
+        conn.commit()
+        reader = pd.read_csv(csv_path, chunksize=chunk_rows, dtype=str, encoding_errors="replace")
+        for chunk in reader:
+            frame, bad = _satellite_csv_chunk(chunk, csv_path)
+            read += len(chunk)
+            buf = io.StringIO()
+            frame.to_csv(buf, header=False, index=False)
+            buf.seek(0)
+            cur.copy_expert(f"""
+                COPY satellite_observations_stage ({", ".join(SATELLITE_OBS_STAGE_COLS)})
+                FROM STDIN WITH (FORMAT csv)
+            """, buf)
+            cur.execute(SATELLITE_OBS_MERGE_SQL)
+            inserted += cur.rowcount
+            skipped += bad + len(frame) - cur.rowcount
+            conn.commit()
+            elapsed = time.perf_counter() - t0
+            print(f"  … {read} filas leídas, {inserted} insertadas ({read / elapsed:,.0f} filas/s)")
+    except Exception as e:
+        conn.rollback()
+        print(f"  ❌ sat insert error (chunk desde la fila {read}): {e}")
+    finally:
+        cur.close()
+        conn.close()
+    elapsed = time.perf_counter() - t0
+    print(f"✅ Satellite inserted {inserted} rows from {csv_path} "
+          f"({skipped} omitidas, {elapsed:.1f}s, {read / elapsed if elapsed else 0:,.0f} filas/s)")
+    return inserted, skipped
+
+# ------------- MODEL FEATURES builder (incremental) -------------
+# Pivot de parámetros con una sola agregación condicional sobre las
+# (estación, datetime) tocadas desde el último build (measurements.inserted_at).
+MODEL_FEATURES_SQL = """
+    WITH touched AS (
+        SELECT DISTINCT station_id, datetime_utc
+        FROM measurements
+        WHERE inserted_at > %(since)s AND inserted_at <= %(until)s
+    ),
+    pivot AS (
+        SELECT m.station_id, m.datetime_utc,
+               avg(m.value) FILTER (WHERE m.parameter = 'pm25') AS pm25,
+               avg(m.value) FILTER (WHERE m.parameter = 'pm10') AS pm10,
+               avg(m.value) FILTER (WHERE m.parameter = 'no2')  AS no2,
+               avg(m.value) FILTER (WHERE m.parameter = 'o3')   AS o3
+        FROM measurements m
+        JOIN touched t ON t.station_id = m.station_id AND t.datetime_utc = m.datetime_utc
+        -- rango explícito para que el planner descarte particiones fuera de lo tocado
+        WHERE m.datetime_utc BETWEEN (SELECT min(datetime_utc) FROM touched)
+                                 AND (SELECT max(datetime_utc) FROM touched)
+        GROUP BY m.station_id, m.datetime_utc
+    )
+    INSERT INTO model_features(datetime_utc, lat, lon, pm25, pm10, no2, o3,
+                               temp, wind_speed, humidity, wind_dir, pressure, other_features)
+    SELECT DISTINCT ON (p.datetime_utc, s.lat, s.lon)
+        p.datetime_utc, s.lat, s.lon,
+        p.pm25, p.pm10, p.no2, p.o3,
+        w.temp, w.wind_speed, w.humidity, w.wind_dir, w.pressure,
+        jsonb_strip_nulls(jsonb_build_object('sat_no2_trop', sat.value_qa_mean))
+    FROM pivot p
+    JOIN stations s ON s.id = p.station_id
+    -- as-of: última hora de weather_hourly en la celda de la estación dentro de la tolerancia
+    LEFT JOIN LATERAL (
+        SELECT wh.temp, wh.wind_speed, wh.humidity, wh.wind_dir, wh.pressure
+        FROM weather_hourly wh
+        WHERE wh.resolution = %(wres)s
+          AND wh.cell_i = floor(s.lat / %(wres)s)::int
+          AND wh.cell_j = floor(s.lon / %(wres)s)::int
+          AND wh.hour <= p.datetime_utc
+          AND wh.hour > p.datetime_utc - %(tolerance)s::interval
+        ORDER BY wh.hour DESC
+        LIMIT 1
+    ) w ON true
+    -- sat_no2_trop: celda de satellite_grid que contiene la estación, último paso ≤ 24 h
+    LEFT JOIN LATERAL (
+        SELECT sg.value_qa_mean
+        FROM satellite_grid sg
+        WHERE sg.parameter = 'no2_tropospheric_column'
+          AND sg.resolution = %(res)s
+          AND sg.cell_i = floor(s.lat / %(res)s)::int
+          AND sg.cell_j = floor(s.lon / %(res)s)::int
+          AND sg.datetime_utc BETWEEN p.datetime_utc - interval '24 hours' AND p.datetime_utc
+        ORDER BY sg.datetime_utc DESC
+        LIMIT 1
+    ) sat ON true
+    WHERE p.pm25 IS NOT NULL OR p.pm10 IS NOT NULL OR p.no2 IS NOT NULL OR p.o3 IS NOT NULL
+    ORDER BY p.datetime_utc, s.lat, s.lon, p.station_id
+    ON CONFLICT (datetime_utc, lat, lon) DO UPDATE
+    SET pm25 = EXCLUDED.pm25,
+        pm10 = EXCLUDED.pm10,
+        no2 = EXCLUDED.no2,
+        o3 = EXCLUDED.o3,
+        temp = EXCLUDED.temp,
+        wind_speed = EXCLUDED.wind_speed,
+        humidity = EXCLUDED.humidity,
+        wind_dir = EXCLUDED.wind_dir,
+        pressure = EXCLUDED.pressure,
+        other_features = EXCLUDED.other_features,
+        updated_at = now()
+"""
+
+
+def build_model_features(full=False):
+    """
+    Construye model_features sólo para las (estación, datetime) con measurements
+    insertadas desde el último build (watermark "model_features" sobre
+    inserted_at, menos WATERMARK_OVERLAP). full=True reconstruye todo el histórico.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(SATELLITE_GRID_DDL)
+        cur.execute(ETL_WATERMARKS_DDL)
+        cur.execute("CREATE INDEX IF NOT EXISTS measurements_inserted_at_idx ON measurements (inserted_at)")
+        # updated_at: el feature store (mod/model/feature_store.py) sincroniza sólo lo nuevo o cambiado
+        cur.execute("ALTER TABLE model_features ADD COLUMN IF NOT EXISTS updated_at timestamptz DEFAULT now()")
+        cur.execute("CREATE INDEX IF NOT EXISTS model_features_updated_at_idx ON model_features (updated_at)")
+        refresh_weather_hourly(cur)
+        cur.execute("SELECT max(inserted_at) FROM measurements")
+        until = cur.fetchone()[0]
+        cur.execute("SELECT watermark FROM etl_watermarks WHERE source = 'model_features'")
+        row = cur.fetchone()
+        since = row[0] - WATERMARK_OVERLAP if row and not full else datetime(1970, 1, 1, tzinfo=timezone.utc)
+        if until is None or until <= since:
+            conn.commit()
+            print("→ model_features al día, nada nuevo en measurements")
+            return 0
+
+        cur.execute(MODEL_FEATURES_SQL, {"since": since, "until": until, "res": SAT_GRID_RES,
+                                         "wres": WEATHER_GRID_RES, "tolerance": WEATHER_TOLERANCE})
+        rows = cur.rowcount
+        if rows:
+            # updated_at = now() es la hora de esta transacción: justo lo recién construido
             cur.execute("""
-                INSERT INTO satellite_observations
-                (datetime_utc, lat, lon, product, pollutant, value, unit, raw_path)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-                ON CONFLICT DO NOTHING
-            """, (pd.to_datetime(row['datetime']).to_pydatetime(), float(row['lat']), float(row['lon']),
-                  clean_str(row.get('product')), clean_str(row.get('pollutant')), float(row['value']), clean_str(row.get('unit')), csv_path))
-            inserted += 1
-        except Exception as e:
-            print("  ❌ sat insert error:", e)
-    conn.commit()
-    cur.close()
-    conn.close()
-    print(f"✅ Satellite inserted {inserted} rows from {csv_path}")
+                SELECT min(lat), max(lat), min(lon), max(lon), max(datetime_utc)
+                FROM model_features WHERE updated_at = now()
+            """)
+            lat_min, lat_max, lon_min, lon_max, last = cur.fetchone()
+            if lat_min is not None:
+                notify_update(cur, "features", (lat_min, lat_max, lon_min, lon_max), last)
+        set_watermark("model_features", until, cur=cur)
+        conn.commit()
+        print(f"✅ Features construidas en model_features ({rows} filas desde {since.isoformat()})")
+        return rows
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Error build_model_features: {e}")
+        return 0
+    finally:
+        cur.close()
+        conn.close()
+
+# ------------- AGGREGATES (rollups horarios/diarios, incremental) -------------
+AGGREGATE_SOURCES = ("measurements", "satellite_grid")
 
-# ------------- MODEL FEATURES builder (arreglado) -------------
-def build_model_features():
+
+def refresh_aggregates(full=False):
+    """
+    Refresca los rollups de aggregates.py sólo para los buckets con filas
+    insertadas desde la última corrida (watermark "aggregates:<tabla>" sobre
+    inserted_at, menos WATERMARK_OVERLAP). full=True los recalcula desde el inicio.
+    """
     conn = get_conn()
     cur = conn.cursor()
     try:
-        cur.execute("""
-            INSERT INTO model_features(datetime_utc, lat, lon, pm25, no2, o3, temp, wind_speed, other_features)
-            SELECT DISTINCT ON (g.datetime_utc, s.lat, s.lon)
-                g.datetime_utc, s.lat, s.lon,
-                g_pm25.value AS pm25,
-                g_no2.value AS no2,
-                g_o3.value AS o3,
-                w.temp,
-                w.wind_speed,
-                '{}'::jsonb
-            FROM measurements g
-            JOIN stations s ON g.station_id = s.id
-            LEFT JOIN measurements g_pm25 ON g_pm25.station_id = s.id AND g_pm25.parameter = 'pm25' AND g_pm25.datetime_utc = g.datetime_utc
-            LEFT JOIN measurements g_no2 ON g_no2.station_id = s.id AND g_no2.parameter = 'no2' AND g_no2.datetime_utc = g.datetime_utc
-            LEFT JOIN measurements g_o3 ON g_o3.station_id = s.id AND g_o3.parameter = 'o3' AND g_o3.datetime_utc = g.datetime_utc
-            LEFT JOIN weather_observations w ON w.datetime_utc = g.datetime_utc
-            ON CONFLICT (datetime_utc, lat, lon) DO UPDATE
-            SET pm25 = EXCLUDED.pm25,
-                no2 = EXCLUDED.no2,
-                o3 = EXCLUDED.o3,
-                temp = EXCLUDED.temp,
-                wind_speed = EXCLUDED.wind_speed;
-        """)
+        cur.execute(SATELLITE_GRID_DDL)
+        cur.execute(ETL_WATERMARKS_DDL)
+        for source in AGGREGATE_SOURCES:
+            cur.execute(f"SELECT max(inserted_at) FROM {source}")
+            until = cur.fetchone()[0]
+            cur.execute("SELECT watermark FROM etl_watermarks WHERE source = %s", (f"aggregates:{source}",))
+            row = cur.fetchone()
+            since = row[0] - WATERMARK_OVERLAP if row and not full else datetime(1970, 1, 1, tzinfo=timezone.utc)
+            if until is None or until <= since:
+                print(f"→ rollups de {source} al día")
+                continue
+            counts = refresh_rollups(cur, source, since, until)
+            set_watermark(f"aggregates:{source}", until, cur=cur)
+            conn.commit()
+            print(f"✅ Rollups de {source}: " + ", ".join(f"{t}={n}" for t, n in counts.items()))
         conn.commit()
-        print("✅ Features construidas en model_features")
     except Exception as e:
         conn.rollback()
-        print(f"❌ Error build_model_features: {e}")
+        print(f"❌ Error refresh_aggregates: {e}")
     finally:
         cur.close()
         conn.close()
@@ -592,21 +1595,45 @@ def ensure_openweather_station():
     conn = get_conn()
     cur = conn.cursor()
     try:
-        cur.execute("""
-            INSERT INTO stations (nombre, lat, lon, tipo, fuente)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (nombre) DO NOTHING
-        """, ("OpenWeather_air", LAT, LON, "virtual", "OpenWeather"))
+        resolve_station_ids(cur, {"OpenWeather_air": (LAT, LON, "virtual", "OpenWeather")})
         conn.commit()
         print("✅ Estación OpenWeather_air creada/verificada en DB")
     except Exception as e:
         print("❌ Error creando estación OpenWeather_air:", e)
         conn.rollback()
+        STATIONS.invalidate()
     finally:
         cur.close()
         conn.close()
 
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument('--full', action='store_true',
+                   help='procesa los granules de muestra completos (sin el límite demo de 50 filas); '
+                        '--granules siempre los procesa completos')
+    p.add_argument('--granules', nargs='+',
+                   help='archivos .nc o directorios a ingerir (backfill) en lugar de las muestras de Drive')
+    p.add_argument('--product', choices=sorted(GRANULE_PROCESSORS),
+                   help='fuerza el producto de --granules (por defecto se deduce del nombre)')
+    p.add_argument('--workers', type=int, default=None,
+                   help='procesos para decodificar granules (por defecto: núcleos disponibles)')
+    p.add_argument('--incremental', action='store_true',
+                   help='con --granules, omite los granules ya cubiertos por el watermark del producto')
+    p.add_argument('--rebuild-features', action='store_true',
+                   help='reconstruye model_features completo en vez de sólo lo nuevo')
+    p.add_argument('--rebuild-aggregates', action='store_true',
+                   help='recalcula los rollups horarios/diarios completos en vez de sólo lo nuevo')
+    p.add_argument('--no-http-cache', action='store_true',
+                   help='ignora la caché de respuestas de OpenAQ/OpenWeather (siempre va a la red)')
+    p.add_argument('--raw', action='store_true',
+                   help='guarda las celdas satelitales en measurements (una estación por celda) '
+                        'en vez de satellite_grid')
+    return p.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    HTTP_CACHE.enabled = not args.no_http_cache
     print("📌 Iniciando ETL OpenAQ + Weather + Satellite (local CSV + NRT) ...")
 
     # 0) Asegurar estación OpenWeather dummy
@@ -624,10 +1651,24 @@ if __name__ == "__main__":
     except Exception as e:
         print("⚠ OpenWeather falló:", e)
 
-    # 4) Satélite NRT real (TEMPO + TROPOMI)
-    fetch_tempo_and_tropomi()
+    # 4) Satélite NRT real (TEMPO + TROPOMI) o backfill de granules locales
+    if args.granules:
+        ingest_granules(args.granules, product=args.product, workers=args.workers,
+                        raw=args.raw, incremental=args.incremental)
+    else:
+        fetch_tempo_and_tropomi(full=args.full, raw=args.raw)
+
+    # 5) Features (sólo lo insertado desde el último build)
+    build_model_features(full=args.rebuild_features)
 
-    # 5) Features
-    build_model_features()
+    # 6) Rollups horarios/diarios para dashboard y entrenamiento
+    refresh_aggregates(full=args.rebuild_aggregates)
 
+    stats = pool_stats()["air_quality"]
+    print(f"📊 Pool DB: {stats['connects']} conexiones físicas para {stats['checkouts']} checkouts "
+          f"(en uso={stats['checked_out']}, libres={stats['checked_in']}); "
+          f"{STATIONS.queries} consultas de estaciones")
+    http = HTTP_CACHE.stats()
+    print(f"📊 Caché HTTP: {http['hits']} hits, {http['revalidated']} revalidadas (304), "
+          f"{http['misses']} misses, {http['evictions']} desalojadas")
     print("✅ ETL finalizado.")
\ No newline at end of file
@@ -0,0 +1,246 @@
+"""
+granule_catalog.py - Catálogo (SQLite) de metadatos de los granules descargados.
+
+Cada granule se abre una sola vez (h5netcdf, recorrido de inspect_nc_filtered)
+y se guarda: producto, grupos, variables con shape/dtype, cobertura temporal,
+bounding box y los "roles" ya resueltos (grupo a abrir, lat, lon, variable de
+datos, qa). La entrada se invalida si cambian el tamaño o el mtime del archivo.
+
+Con el catálogo los procesadores no repiten heurísticas sobre ds.variables y
+los granules que no tocan la región se descartan sin abrirlos.
+
+Uso:
+    python granule_catalog.py archivo.nc|directorio ... [--bbox lat_min lat_max lon_min lon_max]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import h5netcdf
+import numpy as np
+
+from inspect_nc_filtered import walk
+
+CATALOG_PATH = os.getenv("GRANULE_CATALOG_PATH", os.path.expanduser("~/.cache/airbytes/granule_catalog.sqlite"))
+
+NO2_CANDIDATES = [
+    "nitrogendioxide_tropospheric_column",
+    "nitrogendioxide_total_column",
+    "nitrogendioxide_slant_column",
+    "nitrogendioxide_column_number_density",  # otro nombre común
+    "NO2_column_number_density"              # a veces así
+]
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS granules (
+        path        TEXT PRIMARY KEY,
+        size        INTEGER NOT NULL,
+        mtime       REAL NOT NULL,
+        product     TEXT NOT NULL,
+        time_start  TEXT,
+        time_end    TEXT,
+        lat_min     REAL,
+        lat_max     REAL,
+        lon_min     REAL,
+        lon_max     REAL,
+        groups      TEXT NOT NULL,
+        variables   TEXT NOT NULL,
+        roles       TEXT NOT NULL,
+        indexed_at  REAL NOT NULL
+    )
+"""
+
+
+def detect_product(path):
+    """Deduce el producto por el nombre del archivo (S5P_* -> tropomi, TEMPO_* -> tempo)."""
+    name = os.path.basename(path).upper()
+    if "TEMPO" in name:
+        return "tempo"
+    return "tropomi"
+
+
+def _attr(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, np.ndarray):
+        return _attr(value.item()) if value.size == 1 else value.tolist()
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _in_group(variables, group):
+    """Nombres de las variables que cuelgan directamente de `group` ("" = raíz)."""
+    prefix = group + "/" if group else ""
+    return [v[len(prefix):] for v in variables if v.startswith(prefix) and "/" not in v[len(prefix):]]
+
+
+def resolve_roles(product, variables, groups):
+    """
+    Mismas reglas que usaban los procesadores sobre ds.variables, aplicadas
+    una vez al indexar. Devuelve {"group", "lat", "lon", "data", "qa", "parameter"}
+    con nombres relativos al grupo (None si no hay).
+    """
+    if product == "tropomi":
+        names = _in_group(variables, "PRODUCT")
+        data = next((c for c in NO2_CANDIDATES if c in names), None)
+        return {"group": "PRODUCT",
+                "lat": "latitude" if "latitude" in names else None,
+                "lon": "longitude" if "longitude" in names else None,
+                "data": data, "qa": "qa_value" if "qa_value" in names else None,
+                "parameter": "no2_tropospheric_column"}
+
+    # TEMPO: grupo geolocation si existe, si no la raíz
+    group = "geolocation" if "geolocation" in groups else ""
+    names = _in_group(variables, group)
+    lat = next((v for v in names if "lat" in v.lower()), None)
+    lon = next((v for v in names if "lon" in v.lower()), None)
+    parameter = "cloud_fraction"
+    data = next((v for v in names if "cloud" in v.lower() and "fraction" in v.lower()), None)
+    if data is None:
+        data = next((v for v in names if "no2" in v.lower() and "column" in v.lower()), None)
+        parameter = data
+    if data is None:
+        parameter = "cloud_fraction_dummy"
+    return {"group": group, "lat": lat, "lon": lon, "data": data, "qa": None, "parameter": parameter}
+
+
+def describe_granule(path, product=None):
+    """Abre el granule una vez y arma su entrada de catálogo (dict)."""
+    product = product or detect_product(path)
+    st = os.stat(path)
+    with h5netcdf.File(path, "r") as f:
+        variables, groups = {}, []
+        for full_name, var in walk(f):
+            variables[full_name] = {"shape": list(var.shape), "dtype": str(var.dtype)}
+            group = full_name.rpartition("/")[0]
+            if group and group not in groups:
+                groups.append(group)
+        roles = resolve_roles(product, variables, groups)
+        attrs = {k: _attr(v) for k, v in f.attrs.items()}
+
+        bbox = [None] * 4
+        if roles["lat"] and roles["lon"]:
+            grp = f[roles["group"]] if roles["group"] else f
+            lat = np.asarray(grp.variables[roles["lat"]][...], dtype=np.float64)
+            lon = np.asarray(grp.variables[roles["lon"]][...], dtype=np.float64)
+            lat, lon = lat[np.isfinite(lat) & (np.abs(lat) <= 90)], lon[np.isfinite(lon) & (np.abs(lon) <= 180)]
+            if lat.size and lon.size:
+                bbox = [float(lat.min()), float(lat.max()), float(lon.min()), float(lon.max())]
+
+    return {
+        "path": os.path.abspath(path), "size": st.st_size, "mtime": st.st_mtime, "product": product,
+        "time_start": attrs.get("time_coverage_start"), "time_end": attrs.get("time_coverage_end"),
+        "lat_min": bbox[0], "lat_max": bbox[1], "lon_min": bbox[2], "lon_max": bbox[3],
+        "groups": groups, "variables": variables, "roles": roles,
+    }
+
+
+def intersects(entry, lat_bounds=None, lon_bounds=None):
+    """¿El bbox del granule toca la región? Sin bbox conocido se asume que sí."""
+    if not (lat_bounds and lon_bounds) or entry["lat_min"] is None:
+        return True
+    return (entry["lat_min"] <= lat_bounds[1] and entry["lat_max"] >= lat_bounds[0]
+            and entry["lon_min"] <= lon_bounds[1] and entry["lon_max"] >= lon_bounds[0])
+
+
+class GranuleCatalog:
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.opened = 0     # granules abiertos para indexar en este proceso
+
+    def _conn(self):
+        # una conexión SQLite no debe cruzar un fork (workers de ingest_granules)
+        if self._db is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(SCHEMA)
+            self._db.execute("CREATE INDEX IF NOT EXISTS granules_time_idx ON granules (product, time_start)")
+        return self._db
+
+    def lookup(self, path):
+        """Entrada vigente de `path` (mismo tamaño y mtime) o None, sin abrir el archivo."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn().execute("SELECT * FROM granules WHERE path = ?", (os.path.abspath(path),)).fetchone()
+            cols = [c[0] for c in self._conn().execute("SELECT * FROM granules LIMIT 0").description]
+        if row is None:
+            return None
+        entry = dict(zip(cols, row))
+        if entry["size"] != st.st_size or entry["mtime"] != st.st_mtime:
+            return None
+        for key in ("groups", "variables", "roles"):
+            entry[key] = json.loads(entry[key])
+        return entry
+
+    def put(self, entry):
+        row = {**entry, **{k: json.dumps(entry[k]) for k in ("groups", "variables", "roles")},
+               "indexed_at": time.time()}
+        cols = list(row)
+        with self._lock:
+            self._conn().execute(
+                f"INSERT OR REPLACE INTO granules ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                [row[c] for c in cols])
+
+    def get(self, path, product=None):
+        """Entrada del catálogo; indexa (abre el archivo) sólo si falta o cambió."""
+        entry = self.lookup(path)
+        if entry is None:
+            entry = describe_granule(path, product)
+            self.opened += 1
+            self.put(entry)
+        return entry
+
+    def search(self, product=None, lat_bounds=None, lon_bounds=None, start=None, end=None):
+        """Granules catalogados que intersectan la región y el rango de tiempo."""
+        q, params = "SELECT path FROM granules WHERE 1=1", []
+        if product:
+            q += " AND product = ?"
+            params.append(product)
+        if start:
+            q += " AND (time_end IS NULL OR time_end >= ?)"
+            params.append(start)
+        if end:
+            q += " AND (time_start IS NULL OR time_start <= ?)"
+            params.append(end)
+        with self._lock:
+            paths = [r[0] for r in self._conn().execute(q + " ORDER BY time_start, path", params)]
+        entries = [self.lookup(p) for p in paths]
+        return [e for e in entries if e and intersects(e, lat_bounds, lon_bounds)]
+
+
+CATALOG = GranuleCatalog()
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("sources", nargs="+", help="archivos .nc o directorios")
+    p.add_argument("--bbox", nargs=4, type=float, metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"))
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    paths = []
+    for src in args.sources:
+        paths.extend(sorted(glob.glob(os.path.join(src, "*.nc"))) if os.path.isdir(src) else [src])
+    lat_bounds, lon_bounds = (args.bbox[:2], args.bbox[2:]) if args.bbox else (None, None)
+    for path in paths:
+        entry = CATALOG.get(path)
+        hit = "✅" if intersects(entry, lat_bounds, lon_bounds) else "—"
+        bbox = (entry["lat_min"], entry["lat_max"], entry["lon_min"], entry["lon_max"])
+        print(f"{hit} {os.path.basename(path)} [{entry['product']}] {entry['time_start']} bbox={bbox} "
+              f"roles={entry['roles']}")
+    print(f"📂 {len(paths)} granules, {CATALOG.opened} abiertos para indexar")
@@ -0,0 +1,163 @@
+"""
+http_cache.py - Caché persistente (SQLite) de respuestas JSON de las APIs.
+
+- Clave: URL + parámetros normalizados (ordenados, como texto).
+- TTL por endpoint (CACHE_TTLS): dentro del TTL la respuesta sale del disco
+  sin tocar la red; vencida, se revalida con If-None-Match/If-Modified-Since
+  y un 304 sólo renueva la entrada. TTL None = no se guarda.
+- Tamaño acotado: al pasar `max_bytes` se borran las entradas menos usadas
+  recientemente (LRU por accessed_at).
+- Contadores hits / misses / revalidated / stores / evictions en `stats()`.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.getenv("HTTP_CACHE_PATH", os.path.expanduser("~/.cache/airbytes/http_cache.sqlite"))
+CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(256 << 20)))
+
+# (patrón de URL, segundos de TTL); gana el primero que coincide
+CACHE_TTLS = [
+    # datetimeLast de /locations decide qué sensores se bajan en la corrida incremental
+    # (populate_openaq_historical): el TTL debe quedar por debajo del intervalo del ETL (1 h).
+    # Vencida, la revalidación con ETag suele ser un 304 barato.
+    (r"api\.openaq\.org/v3/locations", 600),
+    # datetime_to = ahora y datetime_from = checkpoint: la clave cambia en cada corrida, nunca
+    # habría hit; guardarlas sólo desalojaría (LRU) las de /locations
+    (r"api\.openaq\.org/v3/sensors/\d+/measurements", None),
+    (r"api\.openweathermap\.org/data/2\.5/", 600),      # OpenWeather actualiza cada ~10 min
+]
+DEFAULT_TTL = 300
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key           TEXT PRIMARY KEY,
+        url           TEXT NOT NULL,
+        etag          TEXT,
+        last_modified TEXT,
+        stored_at     REAL NOT NULL,
+        accessed_at   REAL NOT NULL,
+        size          INTEGER NOT NULL,
+        body          BLOB NOT NULL
+    )
+"""
+
+
+def cache_key(url, params=None):
+    items = sorted((str(k), str(v)) for k, v in (params or {}).items() if v is not None)
+    return hashlib.sha256(json.dumps([url, items]).encode("utf-8")).hexdigest()
+
+
+def ttl_for(url):
+    for pattern, ttl in CACHE_TTLS:
+        if re.search(pattern, url):
+            return ttl
+    return DEFAULT_TTL
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, enabled=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.counters = {"hits": 0, "misses": 0, "revalidated": 0, "stores": 0, "evictions": 0}
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(SCHEMA)
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_idx ON responses (accessed_at)")
+        return self._db
+
+    def lookup(self, url, params=None):
+        """
+        Devuelve (estado, datos, validadores):
+        - ("fresh", json, None): dentro del TTL, no hace falta red.
+        - ("stale", json, {"If-None-Match": ...}): hay que revalidar.
+        - ("miss", None, None).
+        """
+        if not self.enabled or ttl_for(url) is None:
+            return "miss", None, None
+        key = cache_key(url, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT etag, last_modified, stored_at, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return "miss", None, None
+            etag, last_modified, stored_at, body = row
+            self._conn().execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            data = json.loads(body)
+            if now - stored_at < ttl_for(url):
+                self.counters["hits"] += 1
+                return "fresh", data, None
+        validators = {}
+        if etag:
+            validators["If-None-Match"] = etag
+        if last_modified:
+            validators["If-Modified-Since"] = last_modified
+        if not validators:
+            with self._lock:
+                self.counters["misses"] += 1
+            return "miss", None, None
+        return "stale", data, validators
+
+    def revalidated(self, url, params=None):
+        """El servidor respondió 304: la entrada vuelve a estar fresca."""
+        with self._lock:
+            self.counters["revalidated"] += 1
+            now = time.time()
+            self._conn().execute("UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?",
+                                 (now, now, cache_key(url, params)))
+
+    def store(self, url, params, response, data):
+        if not self.enabled or ttl_for(url) is None or "no-store" in response.headers.get("Cache-Control", ""):
+            return
+        body = json.dumps(data).encode("utf-8")
+        now = time.time()
+        with self._lock:
+            self.counters["stores"] += 1
+            db = self._conn()
+            db.execute("""
+                INSERT OR REPLACE INTO responses (key, url, etag, last_modified, stored_at, accessed_at, size, body)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (cache_key(url, params), url, response.headers.get("ETag"),
+                  response.headers.get("Last-Modified"), now, now, len(body), body))
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT coalesce(sum(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed, victims = 0, []
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            victims.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        db.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.counters["evictions"] += len(victims)
+
+    def clear(self):
+        with self._lock:
+            self._conn().execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+            if self._db is not None:
+                out["entries"], out["bytes"] = self._db.execute(
+                    "SELECT count(*), coalesce(sum(size), 0) FROM responses").fetchone()
+        return out
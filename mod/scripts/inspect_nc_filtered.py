@@ -9,18 +9,20 @@ TARGETS = [
     "latitude", "longitude"
 ]
 
+def walk(grp, prefix=""):
+    """Recorre el árbol HDF5 y genera (ruta completa, variable) de cada variable."""
+    # Variables en este grupo
+    for name, var in grp.variables.items():
+        yield prefix + name, var
+    # Subgrupos
+    for subgrp_name, subgrp in grp.groups.items():
+        yield from walk(subgrp, prefix + subgrp_name + "/")
+
 def walk_and_filter(filename, group="/"):
     with h5netcdf.File(filename, "r") as f:
-        def recurse(grp, prefix=""):
-            # Variables en este grupo
-            for name, var in grp.variables.items():
-                full_name = prefix + name
-                if any(t in full_name.lower() for t in TARGETS):
-                    print(f"- {full_name} (shape={var.shape})")
-            # Subgrupos
-            for subgrp_name, subgrp in grp.groups.items():
-                recurse(subgrp, prefix + subgrp_name + "/")
-        recurse(f, "")
+        for full_name, var in walk(f):
+            if any(t in full_name.lower() for t in TARGETS):
+                print(f"- {full_name} (shape={var.shape})")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
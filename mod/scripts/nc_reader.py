@@ -0,0 +1,84 @@
+"""
+nc_reader.py - Lector NetCDF "perezoso" limitado a un bounding box.
+
+Usa h5netcdf (igual que inspect_nc_filtered.py) para leer primero sólo
+latitude/longitude, calcula el rango de scanlines / ground pixels que cae
+dentro de lat_bounds / lon_bounds y luego lee únicamente ese hyperslab de
+las variables de datos. Para Bogotá eso es una fracción mínima del orbit.
+"""
+
+import h5netcdf
+import numpy as np
+
+
+def _decode(var, raw):
+    """Aplica _FillValue / scale_factor / add_offset (h5netcdf entrega valores crudos)."""
+    attrs = var.attrs
+    data = raw.astype(np.float64) if raw.dtype.kind in "iu" or "scale_factor" in attrs else raw
+    fill = attrs.get("_FillValue")
+    if fill is not None:
+        data = np.where(raw == fill, np.nan, data)
+    if "scale_factor" in attrs:
+        data = data * attrs["scale_factor"]
+    if "add_offset" in attrs:
+        data = data + attrs["add_offset"]
+    return data
+
+
+def _read(var, rows=slice(None), cols=slice(None)):
+    """Lee var[..., rows, cols] descartando dimensiones iniciales (p.ej. time=1)."""
+    lead = (0,) * (var.ndim - 2)
+    return var[lead + (rows, cols)]
+
+
+def bbox_slices(lat, lon, lat_bounds, lon_bounds):
+    """
+    Devuelve (rows, cols) como slices mínimos que cubren los píxeles dentro del
+    bbox, o None si el granule no intersecta la región.
+    """
+    inside = (
+        (lat >= lat_bounds[0]) & (lat <= lat_bounds[1]) &
+        (lon >= lon_bounds[0]) & (lon <= lon_bounds[1])
+    )
+    rows = np.flatnonzero(inside.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(inside.any(axis=0))
+    return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+
+def read_bbox(file_path, variables, lat_bounds, lon_bounds, group="PRODUCT",
+              lat_name="latitude", lon_name="longitude"):
+    """
+    Lee sólo el hyperslab de `variables` que cubre el bbox.
+
+    Devuelve (arrays, info): arrays es un dict nombre -> ndarray 2D decodificado
+    (incluye lat/lon recortados) y info trae time_coverage_start, los slices y
+    bytes_read (bytes de datos leídos del archivo). Si el bbox no intersecta,
+    arrays es None.
+    """
+    with h5netcdf.File(file_path, "r") as f:
+        grp = f[group] if group else f
+        lat_var, lon_var = grp.variables[lat_name], grp.variables[lon_name]
+        lat_raw, lon_raw = _read(lat_var), _read(lon_var)
+        bytes_read = lat_raw.nbytes + lon_raw.nbytes
+        lat, lon = _decode(lat_var, lat_raw), _decode(lon_var, lon_raw)
+
+        coverage = grp.attrs.get("time_coverage_start") or f.attrs.get("time_coverage_start")
+        if isinstance(coverage, bytes):
+            coverage = coverage.decode()
+        info = {"time_coverage_start": coverage, "bytes_read": bytes_read, "slices": None}
+
+        slices = bbox_slices(lat, lon, lat_bounds, lon_bounds)
+        if slices is None:
+            return None, info
+        rows, cols = slices
+        info["slices"] = slices
+
+        arrays = {lat_name: lat[rows, cols], lon_name: lon[rows, cols]}
+        for name in variables:
+            var = grp.variables[name]
+            raw = _read(var, rows, cols)
+            info["bytes_read"] += raw.nbytes
+            arrays[name] = _decode(var, raw)
+    return arrays, info
@@ -0,0 +1,273 @@
+"""
+partitions.py - Particionado por rango de measurements.datetime_utc, retención y compactación.
+
+- migrate: convierte la tabla heap `measurements` en una tabla particionada
+  (PARTITION BY RANGE datetime_utc) y copia los datos.
+- premake: crea por adelantado las particiones de los próximos meses/días.
+- retention: compacta en rollups horarios/diarios (aggregates.py) las
+  particiones más viejas que la retención y luego las separa (DETACH) o borra.
+
+Las particiones se llaman measurements_pYYYY_MM (mensual) o
+measurements_pYYYY_MM_DD (diaria). copy_measurements llama a ensure_range
+antes de cada merge, así que un backfill nunca cae fuera de una partición.
+La granularidad elegida en --migrate no se guarda aparte: se deduce de las
+particiones existentes (current_granularity).
+
+Uso:
+    python partitions.py --migrate
+    python partitions.py --premake 3
+    python partitions.py --retention-days 400 [--detach-only]
+"""
+
+import argparse
+import re
+from datetime import datetime, timedelta, timezone
+
+from aggregates import compacted_until, mark_compacted, rollup_range
+
+GRANULARITY = "month"   # "month" o "day"; sólo para --migrate (después manda la tabla)
+_NAME_RE = re.compile(r"^measurements_p(\d{4})_(\d{2})(?:_(\d{2}))?$")
+_known = set()           # particiones confirmadas (creadas por transacciones ya commiteadas)
+_partitioned = None
+_granularity = None
+
+
+def _floor(dt, granularity=GRANULARITY):
+    dt = dt.astimezone(timezone.utc)
+    if granularity == "day":
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next(dt, granularity=GRANULARITY):
+    if granularity == "day":
+        return dt + timedelta(days=1)
+    return (dt.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_name(start, granularity=GRANULARITY):
+    if granularity == "day":
+        return f"measurements_p{start:%Y_%m_%d}"
+    return f"measurements_p{start:%Y_%m}"
+
+
+def partition_bounds(name):
+    """(inicio, fin) de una partición según su nombre, o None si no sigue el patrón."""
+    m = _NAME_RE.match(name)
+    if not m:
+        return None
+    year, month, day = int(m.group(1)), int(m.group(2)), m.group(3)
+    start = datetime(year, month, int(day) if day else 1, tzinfo=timezone.utc)
+    return start, _next(start, "day" if day else "month")
+
+
+def is_partitioned(cur):
+    global _partitioned
+    if _partitioned is None:
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_partitioned_table p
+                JOIN pg_class c ON c.oid = p.partrelid
+                WHERE c.relname = 'measurements'
+            )
+        """)
+        _partitioned = cur.fetchone()[0]
+    return _partitioned
+
+
+def current_granularity(cur):
+    """Granularidad de las particiones existentes (la de la más reciente); GRANULARITY si no hay."""
+    global _granularity
+    if _granularity is None:
+        parts = [(partition_bounds(n)[0], n) for n in list_partitions(cur) if partition_bounds(n)]
+        if not parts:
+            return GRANULARITY
+        _granularity = "day" if _NAME_RE.match(max(parts)[1]).group(3) else "month"
+    return _granularity
+
+
+def ensure_range(cur, start, end, granularity=None):
+    """
+    Crea (si faltan) las particiones que cubren [start, end] con la granularidad
+    de la tabla. No-op si measurements no está particionada. No hace commit.
+    """
+    if start is None or end is None or not is_partitioned(cur):
+        return []
+    granularity = granularity or current_granularity(cur)
+    created = []
+    bucket = _floor(start, granularity)
+    while bucket <= end:
+        upper = _next(bucket, granularity)
+        name = partition_name(bucket, granularity)
+        if name not in _known:
+            # mine = la creó esta transacción (xmin de pg_class): no se cachea, porque
+            # si el caller hace rollback desaparece. NULL = existe y ya está commiteada.
+            cur.execute("""
+                SELECT c.xmin::text::bigint = txid_current_if_assigned() %% 4294967296
+                FROM pg_class c WHERE c.oid = to_regclass(%s)
+            """, (name,))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute(
+                    f"CREATE TABLE {name} PARTITION OF measurements FOR VALUES FROM (%s) TO (%s)",
+                    (bucket, upper),
+                )
+                created.append(name)
+            elif not row[0]:
+                _known.add(name)
+        bucket = upper
+    return created
+
+
+def premake(cur, ahead=2, granularity=None):
+    """Crea la partición actual y `ahead` períodos hacia adelante."""
+    granularity = granularity or current_granularity(cur)
+    now = datetime.now(timezone.utc)
+    end = _floor(now, granularity)
+    for _ in range(ahead):
+        end = _next(end, granularity)
+    return ensure_range(cur, now, end, granularity)
+
+
+def list_partitions(cur):
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'measurements'
+        ORDER BY c.relname
+    """)
+    return [r[0] for r in cur.fetchall()]
+
+
+def apply_retention(conn, keep_days, detach_only=False):
+    """
+    Para cada partición que termina antes de now - keep_days: compacta sus datos
+    en measurements_hourly/measurements_daily y luego DETACH (+ DROP salvo
+    detach_only). Una transacción por partición. Una partición que cae antes
+    del horizonte ya compactado (se recreó por filas tardías) se suma a los
+    rollups existentes en vez de reemplazarlos.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=keep_days)
+    cur = conn.cursor()
+    done = []
+    try:
+        horizon = compacted_until(cur)
+        for name in list_partitions(cur):
+            bounds = partition_bounds(name)
+            if bounds is None or bounds[1] > cutoff:
+                continue
+            rows = rollup_range(cur, *bounds, merge=horizon is not None and bounds[0] < horizon)
+            mark_compacted(cur, bounds[1])
+            cur.execute(f"ALTER TABLE measurements DETACH PARTITION {name}")
+            if not detach_only:
+                cur.execute(f"DROP TABLE {name}")
+            conn.commit()
+            _known.discard(name)
+            done.append(name)
+            print(f"🗜️ {name}: {rows} filas de rollup, {'separada' if detach_only else 'borrada'}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return done
+
+
+MIGRATE_SQL = """
+    ALTER TABLE measurements RENAME TO measurements_legacy;
+    ALTER TABLE measurements_legacy RENAME CONSTRAINT measurements_pkey TO measurements_legacy_pkey;
+    ALTER INDEX IF EXISTS measurements_station_id_datetime_utc_parameter_key
+        RENAME TO measurements_legacy_station_id_datetime_utc_parameter_key;
+    ALTER INDEX IF EXISTS measurements_inserted_at_idx RENAME TO measurements_legacy_inserted_at_idx;
+    ALTER TABLE measurements_legacy DROP CONSTRAINT IF EXISTS measurements_station_id_fkey;
+
+    CREATE TABLE measurements (
+        id           bigint DEFAULT nextval('measurements_id_seq') NOT NULL,
+        station_id   integer REFERENCES stations(id) ON DELETE CASCADE,
+        datetime_utc timestamptz NOT NULL,
+        parameter    text NOT NULL,
+        value        double precision NOT NULL,
+        unit         text,
+        provider     text,
+        inserted_at  timestamptz DEFAULT now(),
+        CONSTRAINT measurements_pkey PRIMARY KEY (id, datetime_utc)
+    ) PARTITION BY RANGE (datetime_utc);
+
+    CREATE UNIQUE INDEX measurements_station_id_datetime_utc_parameter_key
+        ON measurements (station_id, datetime_utc, parameter);
+    CREATE INDEX measurements_inserted_at_idx ON measurements (inserted_at);
+    ALTER SEQUENCE measurements_id_seq OWNED BY measurements.id;
+"""
+
+
+def migrate(conn, granularity=GRANULARITY, ahead=2):
+    """Convierte measurements en tabla particionada, en una sola transacción."""
+    global _partitioned, _granularity
+    cur = conn.cursor()
+    try:
+        if is_partitioned(cur):
+            print("→ measurements ya está particionada")
+            return False
+        cur.execute("SELECT min(datetime_utc), max(datetime_utc), count(*) FROM measurements")
+        first, last, total = cur.fetchone()
+        cur.execute(MIGRATE_SQL)
+        _partitioned, _granularity = True, granularity
+        now = datetime.now(timezone.utc)
+        ensure_range(cur, first or now, max(last or now, now), granularity)
+        premake(cur, ahead, granularity)
+        cur.execute("""
+            INSERT INTO measurements (id, station_id, datetime_utc, parameter, value, unit, provider, inserted_at)
+            SELECT id, station_id, datetime_utc, parameter, value, unit, provider, inserted_at
+            FROM measurements_legacy
+        """)
+        cur.execute("DROP TABLE measurements_legacy")
+        conn.commit()
+        print(f"✅ measurements particionada por {granularity}: {total} filas migradas, "
+              f"{len(list_partitions(cur))} particiones")
+        return True
+    except Exception:
+        conn.rollback()
+        _partitioned = _granularity = None
+        _known.clear()
+        raise
+    finally:
+        cur.close()
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument('--migrate', action='store_true', help='convierte measurements en tabla particionada')
+    p.add_argument('--granularity', choices=['month', 'day'],
+                   help=f'con --migrate (por defecto {GRANULARITY}); si no, la de las particiones existentes')
+    p.add_argument('--premake', type=int, metavar='N', help='crea las particiones de los próximos N períodos')
+    p.add_argument('--retention-days', type=int, metavar='D',
+                   help='compacta y elimina particiones que terminan hace más de D días')
+    p.add_argument('--detach-only', action='store_true', help='con --retention-days: DETACH sin DROP')
+    return p.parse_args()
+
+
+def main():
+    from etl_air_quality import get_conn
+
+    args = parse_args()
+    conn = get_conn()
+    try:
+        if args.migrate:
+            migrate(conn, granularity=args.granularity or GRANULARITY)
+        if args.premake:
+            cur = conn.cursor()
+            created = premake(cur, args.premake, args.granularity)
+            conn.commit()
+            cur.close()
+            print(f"✅ Particiones creadas: {created or 'ninguna (ya existían)'}")
+        if args.retention_days is not None:
+            done = apply_retention(conn, args.retention_days, detach_only=args.detach_only)
+            print(f"✅ Retención aplicada a {len(done)} particiones")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
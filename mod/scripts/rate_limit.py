@@ -0,0 +1,87 @@
+"""
+rate_limit.py - Token bucket compartido entre hilos para respetar cuotas de APIs.
+
+Cada host tiene su propio bucket (ver get_limiter). `acquire()` bloquea hasta
+que haya un token; `pause()` congela el bucket para todos los hilos, p.ej.
+cuando el servidor responde 429 con Retry-After.
+"""
+
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+# host -> (requests por segundo, ráfaga máxima)
+# OpenAQ v3: 60 req/min; OpenWeather free: 60 req/min
+RATE_LIMITS = {
+    "api.openaq.org": (1.0, 5),
+    "api.openweathermap.org": (1.0, 5),
+}
+DEFAULT_RATE = (5.0, 10)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Bloquea hasta poder consumir `tokens`. Devuelve los segundos esperados."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return waited
+                    delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        """Detiene el bucket `seconds` para todos los hilos y lo vacía."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._updated = self._blocked_until
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(url):
+    """Bucket compartido por host (se crea la primera vez)."""
+    host = urlparse(url).hostname or ""
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = TokenBucket(*RATE_LIMITS.get(host, DEFAULT_RATE))
+        return _limiters[host]
+
+
+def retry_after_seconds(response, default):
+    """Interpreta Retry-After (segundos o fecha HTTP); si falta usa `default`."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,93 @@
+"""
+sat_grid.py - Agregación de píxeles satelitales en una grilla lat/lon regular.
+
+La grilla está anclada en (0, 0): la celda (i, j) cubre
+[i*res, (i+1)*res) x [j*res, (j+1)*res). Así los índices no dependen del bbox
+de cada corrida y se pueden unir en SQL con floor(lat / res).
+
+Todo es NumPy (np.unique + np.bincount); no hay objetos Python por píxel.
+"""
+
+import numpy as np
+
+# columnas acumuladas por celda: n, sum(v), sum(v²), sum(qa), sum(qa*v)
+_N, _S, _SS, _W, _WV = range(5)
+
+
+def cell_index(coord, res):
+    """Índice entero de celda para lat o lon."""
+    return np.floor(np.asarray(coord, dtype=np.float64) / res).astype(np.int64)
+
+
+def _reduce(cells, sums):
+    """Suma las filas de `sums` que comparten celda."""
+    uniq, inv = np.unique(cells, axis=0, return_inverse=True)
+    inv = inv.ravel()
+    out = np.column_stack([
+        np.bincount(inv, weights=sums[:, k], minlength=len(uniq)) for k in range(sums.shape[1])
+    ])
+    return uniq, out
+
+
+class GridAccumulator:
+    """
+    Acumula estadísticas por celda lote a lote (memoria proporcional al número
+    de celdas, no de píxeles).
+    """
+
+    def __init__(self, res=0.05):
+        self.res = res
+        self._cells = np.empty((0, 2), dtype=np.int64)
+        self._sums = np.empty((0, 5), dtype=np.float64)
+
+    def add(self, lat, lon, value, qa=None):
+        value = np.asarray(value, dtype=np.float64)
+        if value.size == 0:
+            return
+        weight = np.ones_like(value) if qa is None else np.asarray(qa, dtype=np.float64)
+        cells = np.column_stack([cell_index(lat, self.res), cell_index(lon, self.res)])
+        sums = np.column_stack([np.ones_like(value), value, value * value, weight, weight * value])
+        cells, sums = _reduce(cells, sums)
+        self._cells, self._sums = _reduce(
+            np.concatenate([self._cells, cells]), np.concatenate([self._sums, sums])
+        )
+
+    def __len__(self):
+        return len(self._cells)
+
+    def result(self):
+        """
+        Devuelve columnas por celda: cell_i, cell_j, lat/lon del centro,
+        n_pixels, mean, std (poblacional) y qa_mean (media ponderada por QA).
+        """
+        n = self._sums[:, _N]
+        mean = self._sums[:, _S] / n
+        var = np.maximum(self._sums[:, _SS] / n - mean * mean, 0.0)
+        w = self._sums[:, _W]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            qa_mean = np.where(w > 0, self._sums[:, _WV] / w, mean)
+        i, j = self._cells[:, 0], self._cells[:, 1]
+        return {
+            "cell_i": i,
+            "cell_j": j,
+            "lat": (i + 0.5) * self.res,
+            "lon": (j + 0.5) * self.res,
+            "n_pixels": n.astype(np.int64),
+            "mean": mean,
+            "std": np.sqrt(var),
+            "qa_mean": qa_mean,
+        }
+
+
+def grid_batches(batches, res=0.05):
+    """
+    Agrupa lotes columnares (ver etl_air_quality._make_batch) por
+    (station_id, parameter, datetime) y devuelve una lista de
+    (key, columnas de celdas) con una entrada por granule/producto.
+    """
+    accs = {}
+    for batch in batches:
+        key = (batch["station_id"], batch["parameter"], batch["datetime"])
+        acc = accs.setdefault(key, GridAccumulator(res))
+        acc.add(batch["latitude"], batch["longitude"], batch["value"], batch.get("qa_value"))
+    return [(key, acc.result()) for key, acc in accs.items() if len(acc)]
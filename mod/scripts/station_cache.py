@@ -0,0 +1,86 @@
+"""
+station_cache.py - Registro en memoria de estaciones (fuente, nombre) -> id.
+
+Se carga una vez desde `stations` y sólo inserta las estaciones que no
+conoce (INSERT ... RETURNING id), así que una corrida con N mediciones de K
+estaciones hace O(K) consultas de estaciones y no O(N).
+
+Invalidación: cada `ttl` segundos se compara (count, max(id)) de `stations`
+con lo cacheado y se recarga si otro proceso agregó estaciones. Los nombres
+que otro proceso insertó entre medio se recuperan con un SELECT puntual.
+"""
+
+import threading
+import time
+
+import psycopg2.extras
+
+
+class StationRegistry:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._ids = {}        # (fuente, nombre) -> id
+        self._by_name = {}    # nombre -> id (stations.nombre es UNIQUE)
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.queries = 0
+
+    def _store(self, rows):
+        for sid, nombre, fuente in rows:
+            self._ids[(fuente, nombre)] = sid
+            self._by_name[nombre] = sid
+
+    def _stamp(self, cur):
+        self.queries += 1
+        cur.execute("SELECT count(*), max(id) FROM stations")
+        return cur.fetchone()
+
+    def _load(self, cur):
+        self.queries += 1
+        cur.execute("SELECT id, nombre, fuente FROM stations")
+        self._ids, self._by_name = {}, {}
+        self._store(cur.fetchall())
+        self._version = self._stamp(cur)
+        self._checked_at = time.monotonic()
+
+    def _maybe_refresh(self, cur):
+        if self._version is None:
+            self._load(cur)
+        elif time.monotonic() - self._checked_at > self.ttl:
+            self._checked_at = time.monotonic()
+            if self._stamp(cur) != self._version:
+                self._load(cur)
+
+    def invalidate(self):
+        """Fuerza recarga en el próximo resolve (p.ej. tras un rollback)."""
+        with self._lock:
+            self._version = None
+
+    def resolve(self, cur, stations):
+        """
+        stations: dict nombre -> (lat, lon, tipo, fuente). Devuelve {nombre: id}.
+        Inserta en bloque sólo las desconocidas; no hace commit.
+        """
+        with self._lock:
+            self._maybe_refresh(cur)
+            missing = [n for n in stations if n not in self._by_name]
+            if missing:
+                self.queries += 1
+                rows = psycopg2.extras.execute_values(cur, """
+                    INSERT INTO stations (nombre, lat, lon, tipo, fuente)
+                    VALUES %s
+                    ON CONFLICT (nombre) DO NOTHING
+                    RETURNING id, nombre, fuente
+                """, [(n, *stations[n]) for n in missing], fetch=True)
+                self._store(rows)
+                lost = [n for n in missing if n not in self._by_name]
+                if lost:
+                    # otro proceso las insertó después de nuestra última carga
+                    self.queries += 1
+                    cur.execute("SELECT id, nombre, fuente FROM stations WHERE nombre = ANY(%s)", (lost,))
+                    self._store(cur.fetchall())
+            return {n: self._by_name[n] for n in stations if n in self._by_name}
+
+    def get(self, source, name):
+        return self._ids.get((source, name))
@@ -0,0 +1,100 @@
+"""
+test_downloader.py - downloader.fetch contra un http.server local con soporte de Range.
+
+    python -m pytest mod/scripts/test_downloader.py
+"""
+
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import downloader
+
+DATA = os.urandom(3 * downloader.CHUNK_SIZE + 12345)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+ETAG = '"granule-v1"'
+
+
+class GranuleHandler(BaseHTTPRequestHandler):
+    """Sirve DATA con ETag y Range/If-Range; `cut_next` corta la próxima respuesta a la mitad."""
+
+    requests_seen = []
+    cut_next = False
+
+    def do_GET(self):
+        rng = self.headers.get("Range")
+        type(self).requests_seen.append(rng)
+        start = 0
+        if rng and self.headers.get("If-Range", ETAG) == ETAG:
+            start = int(rng.split("=")[1].split("-")[0])
+        body = DATA[start:]
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(DATA) - 1}/{len(DATA)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        if type(self).cut_next:
+            type(self).cut_next = False
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    GranuleHandler.requests_seen = []
+    GranuleHandler.cut_next = False
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), GranuleHandler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_port}/S5P_test.nc"
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(downloader, "RETRY_BACKOFF", 0.0)
+
+
+def test_resume_after_truncated_partial(server, tmp_path):
+    GranuleHandler.cut_next = True
+    path = downloader.fetch(server, sha256=SHA256, cache_dir=str(tmp_path))
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    first, resumed = GranuleHandler.requests_seen
+    assert first is None
+    # el segundo pedido sigue desde lo que quedó en disco, no desde cero
+    assert resumed.startswith("bytes=") and int(resumed[6:-1]) > 0
+    assert not os.listdir(tmp_path / "partial")
+
+
+def test_checksum_mismatch_is_rejected(server, tmp_path):
+    with pytest.raises(downloader.DownloadError):
+        downloader.fetch(server, sha256="0" * 64, cache_dir=str(tmp_path))
+
+    assert downloader.cached(server, cache_dir=str(tmp_path)) is None
+    assert not os.path.exists(tmp_path / "objects")
+    assert not os.listdir(tmp_path / "partial")
+
+
+def test_cache_hit_makes_no_request(server, tmp_path):
+    first = downloader.fetch(server, cache_dir=str(tmp_path))
+    assert len(GranuleHandler.requests_seen) == 1
+
+    dest = tmp_path / "out" / "S5P_test.nc"
+    again = downloader.fetch(server, dest=str(dest), cache_dir=str(tmp_path))
+
+    assert len(GranuleHandler.requests_seen) == 1
+    assert again == str(dest) and os.path.samefile(first, dest)
+    assert first == downloader.object_path(SHA256, str(tmp_path))
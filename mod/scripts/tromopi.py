@@ -1,6 +1,8 @@
 import requests
 import base64
 
+from downloader import DownloadError, fetch
+
 # =============================
 # ⚠️ ESCRIBE AQUÍ TUS CREDENCIALES MANUALMENTE
 # =============================
@@ -20,13 +22,9 @@ session.headers.update({
     "User-Agent": "tromopi-client/1.0"
 })
 
-response = session.get(url, allow_redirects=True, timeout=60)
-
-print("Status:", response.status_code)
-
-if response.status_code == 200:
-    with open("tropomi_sample.nc", "wb") as f:
-        f.write(response.content)
-    print("✅ Archivo descargado correctamente.")
-else:
-    print("❌ Falló la descarga:", response.text[:200])
+# Caché de granules: reanuda descargas cortadas y no vuelve a bajar lo que ya está
+try:
+    path = fetch(url, dest="tropomi_sample.nc", session=session)
+    print("✅ Archivo descargado correctamente:", path)
+except (DownloadError, requests.RequestException) as e:
+    print("❌ Falló la descarga:", e)